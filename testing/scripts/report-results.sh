@@ -0,0 +1,13 @@
+#!/usr/bin/env bash
+
+#
+# Report on the results of the latest test session, failing on performance budget violations
+#
+
+set -e
+source .virtualenv/bin/activate
+export PYTEST_LOG_PATH=output/report_results.log
+python -m tests.common.results_utils \
+  --database .harness-cache/results.sqlite \
+  --budgets performance-budgets.yaml \
+  "$@"
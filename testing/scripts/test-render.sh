@@ -0,0 +1,10 @@
+#!/usr/bin/env bash
+
+#
+# Render every combination of template parameters and check the emitted projects' structure
+#
+
+set -e
+source .virtualenv/bin/activate
+export PYTEST_LOG_PATH=output/test_render.log
+py.test -n auto -x -m "custom_render_test" --self-contained-html --html=output/test_render.report.html tests
@@ -10,22 +10,39 @@ import logging
 import os
 import sys
 
+from tests.common.log_utils import (
+    CONTROLLER_PART_NAME,
+    start_log_part_listener,
+)
+
 #
 # Kludges
 #
 
 def configure_python_logging():
-    """Brute force config of python logging"""
+    """
+    Brute force config of python logging
+
+    Each process (the xdist workers, and the process running them) logs into its own part of the
+    log file via a listener thread.  The parts are merged into the log file at the end of the test
+    session (see the pytest_sessionfinish hook in tests/conftest.py).
+    """
     log_format = '[%(asctime)s] [%(levelname)s] [%(name)s:%(lineno)d] [%(funcName)s] -- %(message)s'
     date_format = '%H:%M:%S'
     log_level = logging.DEBUG
 
     # attempt to get python log file path from shell env
     env_var_name = 'PYTEST_LOG_PATH'
+    listener = None
     try:
         log_file_path = os.environ[env_var_name]
         assert log_file_path, "log file path from env var {} is empty string or None".format(env_var_name)
-        logging.basicConfig(filename=os.path.abspath(log_file_path), filemode='w', level=log_level, format=log_format, datefmt=date_format)
+        logging.getLogger().setLevel(log_level)
+        listener = start_log_part_listener(
+            log_file_path=os.path.abspath(log_file_path),
+            process_name=os.environ.get('PYTEST_XDIST_WORKER', CONTROLLER_PART_NAME),
+            log_format=log_format,
+            date_format=date_format)
     except Exception:
         # fallback to stderr
         logging.basicConfig(stream=sys.stderr, level=log_level, format=log_format, datefmt=date_format)
@@ -39,5 +56,7 @@ def configure_python_logging():
     post_gen_hook_logger = logging.getLogger('post_gen_project')
     post_gen_hook_logger.setLevel(logging.DEBUG)
 
+    return listener
+
 
-configure_python_logging()
+LOG_PART_LISTENER = configure_python_logging()
@@ -9,6 +9,7 @@ Utilities for test assertions
 
 # import core
 import copy
+import errno
 import logging
 import pprint
 import os
@@ -16,6 +17,7 @@ import os
 # import third party
 import pytest
 import ruamel.yaml as yaml
+import scandir
 import testfixtures
 
 # this project
@@ -48,11 +50,75 @@ from tests.common.cookiecutter_utils import (
 # logger
 _LOGGER = logging.getLogger(__name__)
 
+# cache of relative paths in each project flavor's origin directory, keyed by that directory,
+# with the root module name left as a cookiecutter template variable
+_PROJECT_FLAVOR_ORIGIN_PATHS = {}
+
 
 #
 # Helper classes
 #
 
+class FileSystemSnapshot(object):
+    """
+    In-memory index of every path (and its mode) under a directory, built with a single walk.
+
+    Paths outside of the snapshotted directory are not indexed, so questions about them fall back
+    to asking the file system.
+    """
+
+    def __init__(self, root_directory):
+        _LOGGER.debug("Begin taking file system snapshot of %s", root_directory)
+        self.root_dir = os.path.abspath(root_directory)
+        self.modes = {}
+        pending_dir_paths = [self.root_dir]
+        while pending_dir_paths:
+            for entry in scandir.scandir(pending_dir_paths.pop()):
+                try:
+                    # same as os.stat(), so dangling symlinks don't count as existing
+                    self.modes[entry.path] = entry.stat().st_mode
+                except OSError:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    pending_dir_paths.append(entry.path)
+        self.paths = frozenset(self.modes)
+        _LOGGER.debug("Finished taking file system snapshot of %s, found %d paths", self.root_dir,
+                      len(self.paths))
+
+    def _is_indexed(self, path):
+        """Return true/false on whether the path is under the snapshotted directory"""
+        return path.startswith(self.root_dir + os.sep)
+
+    def _split_by_indexed(self, paths):
+        """Split paths into those under the snapshotted directory and those outside of it"""
+        paths = set(os.path.normpath(path) for path in paths)
+        indexed_paths = set(path for path in paths if self._is_indexed(path))
+        return indexed_paths, paths - indexed_paths
+
+    def find_missing(self, paths):
+        """Get the sorted list of paths which do not exist"""
+        indexed_paths, other_paths = self._split_by_indexed(paths)
+        missing = indexed_paths - self.paths
+        missing.update(path for path in other_paths if not os.path.exists(path))
+        return sorted(missing)
+
+    def find_present(self, paths):
+        """Get the sorted list of paths which do exist"""
+        indexed_paths, other_paths = self._split_by_indexed(paths)
+        present = indexed_paths & self.paths
+        present.update(path for path in other_paths if os.path.exists(path))
+        return sorted(present)
+
+    def get_mode(self, path):
+        """Get the mode of the path, same as the `st_mode` of os.stat()"""
+        path = os.path.normpath(path)
+        if self._is_indexed(path):
+            if path not in self.modes:
+                raise OSError(errno.ENOENT, "No such file or directory", path)
+            return self.modes[path]
+        return os.stat(path).st_mode
+
+
 class FileSystemSpec(object):
     """Specification of included / excluded files under a directory"""
 
@@ -118,19 +184,36 @@ class FileSystemSpec(object):
         )
         _LOGGER.debug("Origin path for project flavor %s is %s", project_flavor,
                       project_flavor_origin_path)
+        for relative_path in FileSystemSpec._get_project_flavor_origin_paths(
+                project_flavor_origin_path):
+            self.include_path(relative_path.replace('{{cookiecutter.root_module_name}}',
+                                                    root_module_name))
+        return self
+
+    @staticmethod
+    def _get_project_flavor_origin_paths(project_flavor_origin_path):
+        """
+        Get the relative paths which a project flavor's origin directory will emit.
+
+        The origin directory is only walked once, since it is the same for every test.  The root
+        module name is left as a cookiecutter template variable in the returned paths.
+        """
+        if project_flavor_origin_path in _PROJECT_FLAVOR_ORIGIN_PATHS:
+            return _PROJECT_FLAVOR_ORIGIN_PATHS[project_flavor_origin_path]
+
+        relative_paths = []
         relative_dir_path_replace_pattern = "{}/".format(project_flavor_origin_path)
-        for dir_path, dir_names, file_names in os.walk(project_flavor_origin_path):
+        for dir_path, dir_names, file_names in scandir.walk(project_flavor_origin_path):
             abs_dir_path = os.path.abspath(dir_path)
             relative_dir_path = abs_dir_path.replace(relative_dir_path_replace_pattern, '')
-            relative_dir_path = relative_dir_path.replace('{{cookiecutter.root_module_name}}',
-                                                          root_module_name)
             _LOGGER.debug("relative destination dir path is %s", relative_dir_path)
             if abs_dir_path != project_flavor_origin_path:
-                self.include_path(relative_dir_path)
+                relative_paths.append(relative_dir_path)
             for file_name in file_names:
                 if file_name not in ['.gitignore']:
-                    self.include_path(os.path.join(relative_dir_path, file_name))
-        return self
+                    relative_paths.append(os.path.join(relative_dir_path, file_name))
+        _PROJECT_FLAVOR_ORIGIN_PATHS[project_flavor_origin_path] = tuple(relative_paths)
+        return _PROJECT_FLAVOR_ORIGIN_PATHS[project_flavor_origin_path]
 
     def specify_by_python_version_mode(self, python_version_mode):
         """Update the file system spec based on the PythonVersionMode"""
@@ -168,39 +251,55 @@ class FileSystemSpec(object):
             self.file_modes[relative_path].add(bit_mask)
         return self
 
-    def assert_includes(self):
-        """Run the test assertion for includes"""
+    def take_snapshot(self):
+        """Take a snapshot of the root target directory to check the specs against"""
+        return FileSystemSnapshot(self.tgt_dir_root)
+
+    def assert_includes(self, snapshot=None):
+        """Run the test assertion for includes, optionally against a file system snapshot"""
         _LOGGER.info("Begin asserting the include file list")
-        for path in self.include:
-            assert os.path.exists(path), "Expected path {} to exist".format(path)
+        if snapshot is None:
+            for path in self.include:
+                assert os.path.exists(path), "Expected path {} to exist".format(path)
+        else:
+            missing_paths = snapshot.find_missing(self.include)
+            assert not missing_paths, "Expected paths {} to exist".format(missing_paths)
         _LOGGER.info("Finished asserting the include file list")
         return self
 
-    def assert_excludes(self):
-        """Run the test assertion for excludes"""
+    def assert_excludes(self, snapshot=None):
+        """Run the test assertion for excludes, optionally against a file system snapshot"""
         _LOGGER.info("Begin asserting the exclude file list")
-        for path in self.exclude:
-            assert not os.path.exists(path), "Expected path {} to NOT exist".format(path)
+        if snapshot is None:
+            for path in self.exclude:
+                assert not os.path.exists(path), "Expected path {} to NOT exist".format(path)
+        else:
+            present_paths = snapshot.find_present(self.exclude)
+            assert not present_paths, "Expected paths {} to NOT exist".format(present_paths)
         _LOGGER.info("Finished asserting the exclude file list")
         return self
 
-    def assert_file_modes(self):
-        """Assert file modes"""
+    def assert_file_modes(self, snapshot=None):
+        """Assert file modes, optionally against a file system snapshot"""
         _LOGGER.info("Begin asserting specified file modes")
         for relative_path in sorted(self.file_modes.keys()):
             abs_path = os.path.join(self.tgt_dir_root, relative_path)
-            stat_result = os.stat(abs_path)
+            if snapshot is None:
+                st_mode = os.stat(abs_path).st_mode
+            else:
+                st_mode = snapshot.get_mode(abs_path)
             for bit_mask in self.file_modes[relative_path]:
-                assert bool(stat_result.st_mode & bit_mask), \
-                    "'AND' of os.stat() result {} and bit mask {} for path {} was not true".format(
-                        stat_result, bit_mask, relative_path)
+                assert bool(st_mode & bit_mask), \
+                    "'AND' of os.stat() mode {} and bit mask {} for path {} was not true".format(
+                        oct(st_mode), bit_mask, relative_path)
         _LOGGER.info("Finished asserting specified file modes")
         return self
 
     def assert_all(self):
-        """Run all possible assertions"""
+        """Run all possible assertions against a single snapshot of the root target directory"""
         _LOGGER.info("Begin running all possible assertions")
-        self.assert_includes().assert_excludes().assert_file_modes()
+        snapshot = self.take_snapshot()
+        self.assert_includes(snapshot).assert_excludes(snapshot).assert_file_modes(snapshot)
         _LOGGER.info("Finished running all possible assertions")
         return self
 
@@ -210,11 +309,8 @@ class PipRequirementsFileSpec(object):
     Specification to assert/test Pip requirements txt files.
 
     WARNING:
-         * Pip's authors (in their infinite wisdom) have refused to provide a solid API for
-           programmatically working with their library.
-         * So we are using their latest internal API for this testing.  And this may break in
-           the future as they change their stuff.
-         * But for now, it is a necessary evil due to the lack of other options
+         * Parsing is done by the harness' own requirements parser rather than pip, so only the
+           parts of the requirements file format used by the emitted projects are understood.
     """
 
     def __init__(self, project_output_path):
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for caching expensive artifacts (like rendered projects) across tests
+"""
+
+#
+# Imports
+#
+
+# import core
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+
+# import third party
+import scandir
+
+# this project
+from tests.common.cookiecutter_utils import (
+    CookieCutterInvoker,
+    compute_template_digest,
+)
+from tests.common.misc_utils import (
+    file_lock,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# ways of cloning a cached render, see clone_tree
+CLONE_STRATEGIES = ('auto', 'reflink', 'hardlink', 'copy')
+
+# ioctl sharing the extents of one file with another (copy-on-write), on btrfs, xfs, etc.
+_FICLONE = 0x40049409
+
+# errors from FICLONE meaning the file systems can't share extents
+_REFLINK_UNSUPPORTED_ERRNOS = (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY)
+
+# whether reflinks work, keyed by the (source, destination) devices
+_REFLINK_SUPPORT = {}
+
+# write permission for anyone
+_WRITE_PERMISSION_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+# whether the hardlink strategy was already turned down for running as root (so it's said once)
+_HARDLINK_AS_ROOT = {'warned': False}
+
+
+#
+# Functions
+#
+
+def _reflink_file(src_path, dst_path):
+    """Clone a file by sharing its extents, raising IOError if the file system can't"""
+    with open(src_path, 'rb') as src_file:
+        with open(dst_path, 'wb') as dst_file:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+    shutil.copystat(src_path, dst_path)
+
+
+def _clone_file(src_path, dst_path, src_stat, strategy, devices):
+    """Clone a file with the given strategy, returning how it was cloned"""
+    if strategy == 'reflink' or (strategy == 'auto' and _REFLINK_SUPPORT.get(devices, True)):
+        try:
+            _reflink_file(src_path, dst_path)
+            _REFLINK_SUPPORT[devices] = True
+            os.chmod(dst_path, stat.S_IMODE(src_stat.st_mode) | stat.S_IWUSR)
+            return 'reflink'
+        except IOError as error:
+            if strategy == 'reflink' or error.errno not in _REFLINK_UNSUPPORTED_ERRNOS:
+                raise
+            _LOGGER.info("Reflinks aren't supported from %s to %s, so clones are full copies: %s",
+                         src_path, dst_path, error)
+            _REFLINK_SUPPORT[devices] = False
+            os.remove(dst_path)
+
+    # a file that's read-only (from the start, see make_tree_read_only) can't be written through
+    # by anyone but root, so the clone can share it
+    if strategy == 'hardlink' and not src_stat.st_mode & _WRITE_PERMISSION_BITS:
+        try:
+            os.link(src_path, dst_path)
+            return 'hardlink'
+        except OSError as error:
+            if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+
+    shutil.copy2(src_path, dst_path)
+    os.chmod(dst_path, stat.S_IMODE(src_stat.st_mode) | stat.S_IWUSR)
+    return 'copy'
+
+
+def make_tree_read_only(root_path):
+    """
+    Take away everyone's write permission from every file in a directory tree.
+
+    This has to happen before anything hardlinks the files, since a hardlink shares the file's
+    permissions as well as its content.
+    """
+    pending = [root_path]
+    while pending:
+        for entry in scandir.scandir(pending.pop()):
+            if entry.is_symlink():
+                continue
+            elif entry.is_dir():
+                pending.append(entry.path)
+            else:
+                os.chmod(entry.path, stat.S_IMODE(entry.stat().st_mode) & ~_WRITE_PERMISSION_BITS)
+
+
+def clone_tree(src_path, dst_path, strategy='auto'):
+    """
+    Clone a directory tree, sharing storage with the source where that's safe.
+
+    Strategies:
+        * reflink: Copy-on-write clones of every file, which needs a file system like btrfs or xfs
+        * hardlink: Hardlinks for the read-only files (which stay read-only in the clone), copies
+          of the rest
+        * copy: Copies of every file
+        * auto: Reflinks where the file systems support them, else copies (so, on file systems
+          without copy-on-write like ext4, it saves nothing over copy)
+
+    Running as root, hardlink falls back to copy: root writes through read-only files, so a test
+    editing a file in place would change the source for good.
+
+    Reflinks and copies are private to the clone, so they're writable by their owner even when
+    the source is read-only.
+
+    Arguments:
+        src_path (str): Directory to clone
+        dst_path (str): Directory to create as the clone
+        strategy (str): One of CLONE_STRATEGIES
+    Returns:
+        dict: Number of files cloned each way, keyed by 'reflink', 'hardlink' and 'copy'
+    """
+    assert strategy in CLONE_STRATEGIES, "Unknown clone strategy '{}'".format(strategy)
+    if strategy == 'hardlink' and os.geteuid() == 0:
+        if not _HARDLINK_AS_ROOT['warned']:
+            _LOGGER.warning("Not hardlinking clones when running as root, which writes through "
+                            "read-only files, copying them instead")
+            _HARDLINK_AS_ROOT['warned'] = True
+        strategy = 'copy'
+    counts = {'reflink': 0, 'hardlink': 0, 'copy': 0}
+    os.mkdir(dst_path)
+    devices = (os.stat(src_path).st_dev, os.stat(dst_path).st_dev)
+    pending = [(src_path, dst_path)]
+    while pending:
+        src_dir_path, dst_dir_path = pending.pop()
+        for entry in scandir.scandir(src_dir_path):
+            entry_dst_path = os.path.join(dst_dir_path, entry.name)
+            if entry.is_symlink():
+                os.symlink(os.readlink(entry.path), entry_dst_path)
+            elif entry.is_dir():
+                os.mkdir(entry_dst_path)
+                pending.append((entry.path, entry_dst_path))
+            else:
+                counts[_clone_file(
+                    entry.path, entry_dst_path, entry.stat(), strategy, devices)] += 1
+        # only now, so that cloning into a read-only directory works
+        shutil.copystat(src_dir_path, dst_dir_path)
+    return counts
+
+
+#
+# Classes
+#
+
+class RenderCache(object):
+    """
+    Cache of projects rendered by cookiecutter.
+
+    Renders are content-addressed by the full cookiecutter "extra context" plus a digest of the
+    template tree, so the cache can be shared across test sessions and xdist workers without ever
+    handing out a stale render after the template is edited.  Every consumer gets its own private
+    clone of a cached (golden) render, so tests are free to mutate what they get back.  Clones
+    share storage with the golden render where the clone strategy allows (see clone_tree).  Golden
+    renders are made read-only before they're published, so that the hardlink strategy can share
+    every file of them, which in turn leaves the files of those clones read-only.
+    """
+
+    @staticmethod
+    def build_key(extra_context, template_digest):
+        """Build a cache key out of the full extra context and the template digest"""
+        assert isinstance(extra_context, dict)
+        assert template_digest
+        hash_obj = hashlib.sha256()
+        hash_obj.update(json.dumps(
+            {'extra_context': extra_context, 'template_digest': template_digest}, sort_keys=True))
+        return hash_obj.hexdigest()
+
+    def __init__(self, cache_root_path, repo_root_path, cookiecutter_config_path,
+                 clone_strategy='auto'):
+        assert clone_strategy in CLONE_STRATEGIES
+        self.cache_root_path = os.path.abspath(cache_root_path)
+        self.clone_strategy = clone_strategy
+        self.template_digest = compute_template_digest(repo_root_path)
+        self.invoker = CookieCutterInvoker(
+            repo_root_path=repo_root_path,
+            cookiecutter_config_path=cookiecutter_config_path)
+        if not os.path.exists(self.cache_root_path):
+            try:
+                os.makedirs(self.cache_root_path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+    def _get_cached_render_path(self, extra_context):
+        """Get the path to the cached render for the extra context, rendering it if necessary"""
+        key = RenderCache.build_key(extra_context, self.template_digest)
+        cached_render_path = os.path.join(self.cache_root_path, key)
+        if os.path.exists(cached_render_path):
+            _LOGGER.debug("Render cache hit for key %s", key)
+            return cached_render_path
+
+        # render into a scratch directory and then atomically move it into place, so that
+        # concurrent sessions never see a partial render
+        scratch_path = tempfile.mkdtemp(prefix='.scratch-', dir=self.cache_root_path)
+        _LOGGER.debug("Render cache miss for key %s, rendering into %s", key, scratch_path)
+        try:
+            self.invoker.invoke_via_api(
+                root_output_path=scratch_path,
+                extra_context=extra_context)
+            self._publish(scratch_path, key)
+        finally:
+            if os.path.exists(scratch_path):
+                shutil.rmtree(scratch_path, ignore_errors=True)
+        return cached_render_path
+
+    def _publish(self, scratch_path, key):
+        """Atomically move a finished render into place, unless someone else beat us to it"""
+        make_tree_read_only(scratch_path)
+        try:
+            os.rename(scratch_path, os.path.join(self.cache_root_path, key))
+        except OSError as error:
+            if error.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            _LOGGER.debug("Lost the race to populate key %s, using the other render", key)
+
+    def prime(self, extra_contexts, render_worker_pool):
+        """
+        Render every extra context that isn't cached yet, in parallel.
+
+        Only one process on the host primes the cache at a time, so concurrent sessions (or xdist
+        workers) asking for the same extra contexts wait for each other instead of rendering
+        them again.
+
+        Arguments:
+            extra_contexts (list): The cookiecutter extra contexts to render
+            render_worker_pool (RenderWorkerPool): The worker processes to render with
+        """
+        _LOGGER.info("Begin priming the render cache with %d extra contexts", len(extra_contexts))
+        with file_lock(os.path.join(self.cache_root_path, '.prime.lock')):
+            missing = {}
+            for extra_context in extra_contexts:
+                key = RenderCache.build_key(extra_context, self.template_digest)
+                if not os.path.exists(os.path.join(self.cache_root_path, key)):
+                    missing[key] = extra_context
+            if missing:
+                scratch_paths = dict(
+                    (key, tempfile.mkdtemp(prefix='.scratch-', dir=self.cache_root_path))
+                    for key in missing)
+                try:
+                    render_worker_pool.render_all(
+                        [(scratch_paths[key], missing[key]) for key in sorted(missing)])
+                    for key in sorted(missing):
+                        self._publish(scratch_paths[key], key)
+                finally:
+                    for scratch_path in scratch_paths.values():
+                        if os.path.exists(scratch_path):
+                            shutil.rmtree(scratch_path, ignore_errors=True)
+        _LOGGER.info("Finished priming the render cache, rendered %d extra contexts",
+                     len(missing))
+
+    def render(self, root_output_path, extra_context):
+        """
+        Lay down a private clone of the project rendered with the extra context.
+
+        Arguments:
+            root_output_path (str): Directory to emit the project into, same as the cookiecutter
+                `output_dir` argument.
+            extra_context (dict): The cookiecutter extra context to render with.
+        """
+        _LOGGER.info("Begin laying down a cached render into %s", root_output_path)
+        cached_render_path = self._get_cached_render_path(extra_context)
+        for entry_name in os.listdir(cached_render_path):
+            src_path = os.path.join(cached_render_path, entry_name)
+            dst_path = os.path.join(root_output_path, entry_name)
+            counts = clone_tree(src_path, dst_path, self.clone_strategy)
+            _LOGGER.debug("Cloned cached render from %s to %s with %s", src_path, dst_path,
+                          ", ".join("{} {}".format(counts[kind], kind) for kind in sorted(counts)))
+        _LOGGER.info("Finished laying down a cached render into %s", root_output_path)
+
+    def clear(self):
+        """Remove every cached render"""
+        _LOGGER.debug("Removing render cache at %s", self.cache_root_path)
+        shutil.rmtree(self.cache_root_path, ignore_errors=True)
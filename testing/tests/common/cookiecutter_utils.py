@@ -9,14 +9,19 @@ Utilities for cookiecutter JSON and invocation
 
 # import core
 import collections
+import contextlib
 import copy
+import hashlib
 import logging
+import multiprocessing
 import os
 
 # import third party
 import cookiecutter
+import cookiecutter.generate
 import cookiecutter.main
 import enum
+import jinja2
 import marshmallow
 
 # this project
@@ -28,6 +33,7 @@ from tests.constants import (
     VagrantBoxMode,
 )
 from tests.common.misc_utils import (
+    ShellCommandCancelled,
     redirected_stdout_and_stderr,
     run_shell,
 )
@@ -39,21 +45,146 @@ from tests.common.misc_utils import (
 # logger
 _LOGGER = logging.getLogger(__name__)
 
+# paths (relative to the repo root) of the template tree that feeds the rendered output
+_TEMPLATE_TREE_ENTRIES = ('cookiecutter.json', 'hooks', '{{cookiecutter.package_name}}')
+
+# memoized template digests keyed by repo root path
+_TEMPLATE_DIGESTS = {}
+
+# memoized digests of every file in the template tree, keyed by repo root path
+_TEMPLATE_FILE_DIGESTS = {}
+
+# the cookiecutter invoker of the current render worker process (see RenderWorkerPool)
+_RENDER_WORKER_STATE = {'invoker': None}
+
+# the Jinja bytecode cache shared by the renders of the current process (see
+# get_shared_bytecode_cache)
+_SHARED_BYTECODE_CACHE = {'cache': None}
+
+
+#
+# Functions
+#
+
+def _iter_template_tree_files(repo_root_path):
+    """Yield the relative paths of every file in the template tree, in a stable order"""
+    for entry in _TEMPLATE_TREE_ENTRIES:
+        entry_path = os.path.join(repo_root_path, entry)
+        if os.path.isfile(entry_path):
+            yield entry
+            continue
+        for dir_path, dir_names, file_names in os.walk(entry_path):
+            dir_names[:] = sorted(item for item in dir_names if item != '__pycache__')
+            for file_name in sorted(file_names):
+                if file_name.endswith('.pyc'):
+                    continue
+                yield os.path.relpath(os.path.join(dir_path, file_name), repo_root_path)
+
+
+def compute_template_file_digests(repo_root_path):
+    """
+    Compute a digest of each file in the template tree (file mode and contents).
+
+    Memoized per repo root path, since the template doesn't change during a test session.
+
+    Arguments:
+        repo_root_path (str): Path to the root of this repo
+    Returns:
+        collections.OrderedDict: Hex digests keyed by path relative to the repo root, in the stable
+            order of the template tree
+    """
+    repo_root_path = os.path.abspath(repo_root_path)
+    if repo_root_path in _TEMPLATE_FILE_DIGESTS:
+        return _TEMPLATE_FILE_DIGESTS[repo_root_path]
+
+    file_digests = collections.OrderedDict()
+    for relative_path in _iter_template_tree_files(repo_root_path):
+        path = os.path.join(repo_root_path, relative_path)
+        hash_obj = hashlib.sha256()
+        hash_obj.update("{:o}".format(os.stat(path).st_mode & 0o777))
+        with open(path, 'rb') as input_file:
+            hash_obj.update(hashlib.sha256(input_file.read()).hexdigest())
+        file_digests[relative_path] = hash_obj.hexdigest()
+    _TEMPLATE_FILE_DIGESTS[repo_root_path] = file_digests
+    return file_digests
+
+
+def compute_template_digest(repo_root_path):
+    """
+    Compute a digest of the template tree (paths, file modes and contents).
+
+    Memoized per repo root path, since the template doesn't change during a test session.
+
+    Arguments:
+        repo_root_path (str): Path to the root of this repo
+    Returns:
+        str: Hex digest of the template tree
+    """
+    repo_root_path = os.path.abspath(repo_root_path)
+    if repo_root_path in _TEMPLATE_DIGESTS:
+        return _TEMPLATE_DIGESTS[repo_root_path]
+
+    _LOGGER.debug("Begin computing the template digest for %s", repo_root_path)
+    hash_obj = hashlib.sha256()
+    for relative_path, file_digest in compute_template_file_digests(repo_root_path).items():
+        hash_obj.update(relative_path)
+        hash_obj.update(file_digest)
+    digest = hash_obj.hexdigest()
+    _TEMPLATE_DIGESTS[repo_root_path] = digest
+    _LOGGER.debug("Finished computing the template digest for %s: %s", repo_root_path, digest)
+    return digest
+
 
 #
 # Classes for invoking cookiecutter cli
 #
 
+@contextlib.contextmanager
+def _generating_with_bytecode_cache(bytecode_cache):
+    """
+    Context manager having the Jinja environments cookiecutter builds to generate files use a
+    bytecode cache, while it lasts.
+
+    Cookiecutter builds a new Jinja environment for every render, and has no way to pass it one,
+    so without this every template is compiled again on every render.
+    """
+    if bytecode_cache is None:
+        yield
+        return
+    environment_class = cookiecutter.generate.StrictEnvironment
+
+    class CachingStrictEnvironment(environment_class):
+        """Cookiecutter's Jinja environment, with the bytecode cache"""
+
+        def __init__(self, **kwargs):
+            kwargs.setdefault('bytecode_cache', bytecode_cache)
+            super(CachingStrictEnvironment, self).__init__(**kwargs)
+
+    cookiecutter.generate.StrictEnvironment = CachingStrictEnvironment
+    try:
+        yield
+    finally:
+        cookiecutter.generate.StrictEnvironment = environment_class
+
+
 class CookieCutterInvoker(object):
     """Wrapper around invocations to cookiecutter via api/cli"""
 
-    def __init__(self, repo_root_path, cookiecutter_config_path):
+    def __init__(self, repo_root_path, cookiecutter_config_path, bytecode_cache=None):
+        """
+        Arguments:
+            repo_root_path (str): The template's repo
+            cookiecutter_config_path (str): The cookiecutter config file
+            bytecode_cache (jinja2.BytecodeCache): Optional cache of compiled templates for API
+                invocations to share (see `get_shared_bytecode_cache`)
+        """
         assert os.path.exists(repo_root_path), \
             "repo root path does not exist: {}".format(repo_root_path)
         self.repo_root_path = repo_root_path
         assert os.path.exists(cookiecutter_config_path), \
             "cookiecutter config path does not exist: {}".format(cookiecutter_config_path)
         self.cookiecutter_config_path = cookiecutter_config_path
+        self.bytecode_cache = bytecode_cache
 
     def invoke_via_api(self, root_output_path, extra_context=None):
         """Run cookiecutter template via its Python API"""
@@ -61,7 +192,8 @@ class CookieCutterInvoker(object):
         _LOGGER.info("Begin calling cookiecutter API with template under test: %s", run_params)
 
         try:
-            with redirected_stdout_and_stderr():
+            with redirected_stdout_and_stderr(), \
+                    _generating_with_bytecode_cache(self.bytecode_cache):
                 cookiecutter.main.cookiecutter(
                     template=self.repo_root_path,
                     no_input=True,
@@ -92,6 +224,9 @@ class CookieCutterInvoker(object):
                 self.repo_root_path,
             ])
             run_shell(cmd_text, working_path=working_path)
+        except ShellCommandCancelled:
+            # another test failed first, this one didn't fail as such
+            raise
         except Exception as error:
             _LOGGER.exception("Call to cookiecutter CLI failed")
             raise Exception("Cookiecutter failed, see log file")
@@ -99,6 +234,98 @@ class CookieCutterInvoker(object):
             _LOGGER.info("Finished calling cookiecutter CLI with template under test: %s",
                          run_params)
 
+
+class InMemoryBytecodeCache(jinja2.BytecodeCache):
+    """
+    Jinja bytecode cache kept in memory, and shared by every Jinja environment in the process.
+
+    Entries are keyed by template name and checked against a checksum of the template source,
+    so edited templates are recompiled.
+    """
+
+    def __init__(self):
+        self._bytecode = {}
+
+    def load_bytecode(self, bucket):
+        if bucket.key in self._bytecode:
+            bucket.bytecode_from_string(self._bytecode[bucket.key])
+
+    def dump_bytecode(self, bucket):
+        self._bytecode[bucket.key] = bucket.bytecode_to_string()
+
+    def clear(self):
+        self._bytecode.clear()
+
+
+def get_shared_bytecode_cache():
+    """Get the Jinja bytecode cache for the cookiecutter invokers of this process to share"""
+    if _SHARED_BYTECODE_CACHE['cache'] is None:
+        _SHARED_BYTECODE_CACHE['cache'] = InMemoryBytecodeCache()
+        _LOGGER.debug("Created the shared Jinja bytecode cache of process %d", os.getpid())
+    return _SHARED_BYTECODE_CACHE['cache']
+
+
+def _initialize_render_worker(repo_root_path, cookiecutter_config_path):
+    """Warm up a render worker process"""
+    _RENDER_WORKER_STATE['invoker'] = CookieCutterInvoker(
+        repo_root_path=repo_root_path,
+        cookiecutter_config_path=cookiecutter_config_path,
+        bytecode_cache=get_shared_bytecode_cache())
+
+
+def _render_in_worker(job):
+    """Render one (root output path, extra context) job in a render worker process"""
+    root_output_path, extra_context = job
+    _RENDER_WORKER_STATE['invoker'].invoke_via_api(
+        root_output_path=root_output_path,
+        extra_context=extra_context)
+    return root_output_path
+
+
+class RenderWorkerPool(object):
+    """
+    Pool of warm worker processes rendering this repo's template via cookiecutter's API.
+
+    The worker processes live until the pool is closed, and each keeps the compiled templates
+    around between renders.
+
+    WARNING:
+        * Cookiecutter still runs the template's hooks as separate processes.
+    """
+
+    def __init__(self, repo_root_path, cookiecutter_config_path, process_count):
+        assert process_count > 0
+        self.repo_root_path = repo_root_path
+        self.cookiecutter_config_path = cookiecutter_config_path
+        self.process_count = process_count
+        self._pool = None
+
+    def render_all(self, jobs):
+        """
+        Render many extra contexts in parallel.
+
+        Arguments:
+            jobs (list): Of (root output path, extra context) tuples, where the root output path
+                is the same as the cookiecutter `output_dir` argument.
+        """
+        _LOGGER.info("Begin rendering %d extra contexts with %d worker processes", len(jobs),
+                     self.process_count)
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                processes=self.process_count,
+                initializer=_initialize_render_worker,
+                initargs=(self.repo_root_path, self.cookiecutter_config_path))
+        self._pool.map(_render_in_worker, jobs, chunksize=1)
+        _LOGGER.info("Finished rendering %d extra contexts", len(jobs))
+
+    def close(self):
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
 #
 # Enums and classes for cookiecutter JSON
 #
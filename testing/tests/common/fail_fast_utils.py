@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for stopping every xdist worker, and the make runs they're in the middle of, on a failure
+"""
+
+#
+# Imports
+#
+
+# import core
+import errno
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+# import third party
+import pytest
+
+# this project
+from tests.common.misc_utils import (
+    ShellCommandCancelled,
+    cancel_shell_commands,
+    get_shell_cancellation_reason,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# seconds between checks of the stop file by each worker
+_STOP_FILE_POLL_SECONDS = 0.5
+
+
+#
+# Classes
+#
+
+class ClusterFailFast(object):
+    """
+    Pytest plugin which stops every process of a test session once it has had enough failures.
+
+    `-x` (or `--maxfail`) alone only stops the xdist master handing out tests, while the workers
+    carry on with the ones they have, each maybe minutes of make.  Instead, whichever process sees
+    the failure that reaches the limit publishes a stop file.  Every worker watches for it: its
+    running shell commands (make, tox, etc.) get their process groups killed, and its queued tests
+    get skipped.  The tests that were cut short (those failing on ShellCommandCancelled) are
+    reported as skipped rather than failed, so the failure that stopped the session stands out,
+    while tests failing in their own right as the session stops still fail.
+    """
+
+    def __init__(self, stop_file_path, maxfail, is_worker):
+        """
+        Arguments:
+            stop_file_path (str): The stop file, unique to the test session
+            maxfail (int): Number of failures that stop the session
+            is_worker (bool): Whether this process is an xdist worker (so it watches the stop file)
+        """
+        self.stop_file_path = stop_file_path
+        self.maxfail = maxfail
+        self.is_worker = is_worker
+        self.failure_count = 0
+        self._stopped = threading.Event()
+        self._watcher = None
+
+    def publish(self, nodeid):
+        """Publish the stop file, unless some other process already has"""
+        if os.path.exists(self.stop_file_path):
+            return
+        stop_dir_path = os.path.dirname(self.stop_file_path)
+        try:
+            os.makedirs(stop_dir_path)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        file_descriptor, scratch_path = tempfile.mkstemp(prefix='.scratch-', dir=stop_dir_path)
+        with os.fdopen(file_descriptor, 'w') as stop_file:
+            json.dump({
+                'nodeid': nodeid,
+                'published_at': time.strftime('%H:%M:%S'),
+                'worker': os.environ.get('PYTEST_XDIST_WORKER', 'master'),
+            }, stop_file)
+        os.rename(scratch_path, self.stop_file_path)
+        _LOGGER.info("Published stop file %s after %d failures, the last in %s",
+                     self.stop_file_path, self.failure_count, nodeid)
+
+    def get_stop_reason(self):
+        """Get why the session is stopping, or None if it isn't"""
+        try:
+            with open(self.stop_file_path, 'r') as stop_file:
+                stop_data = json.load(stop_file)
+        except IOError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return None
+        return "stopping the session since {} failed (on {} at {})".format(
+            stop_data['nodeid'], stop_data['worker'], stop_data['published_at'])
+
+    def _watch(self):
+        while not self._stopped.wait(_STOP_FILE_POLL_SECONDS):
+            reason = self.get_stop_reason()
+            if reason is not None:
+                cancel_shell_commands(reason)
+                return
+
+    def pytest_sessionstart(self):
+        """Start watching the stop file (on xdist workers)"""
+        if self.is_worker:
+            self._watcher = threading.Thread(target=self._watch, name='stop-file-watcher')
+            self._watcher.daemon = True
+            self._watcher.start()
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_setup(self, item):
+        """Skip the queued tests once the session is stopping"""
+        reason = get_shell_cancellation_reason() or self.get_stop_reason()
+        if reason is not None:
+            pytest.skip(reason)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        """Report the tests whose shell commands were cancelled as skipped"""
+        outcome = yield
+        report = outcome.get_result()
+        if not report.failed or call.excinfo is None or \
+                not call.excinfo.errisinstance(ShellCommandCancelled):
+            return
+        reason = get_shell_cancellation_reason() or self.get_stop_reason()
+        if reason is not None:
+            report.outcome = 'skipped'
+            report.longrepr = (str(item.fspath), item.location[1], "Skipped: {}".format(reason))
+
+    def pytest_runtest_logreport(self, report):
+        """Count the failures, and publish the stop file on the one that reaches the limit"""
+        if not report.failed:
+            return
+        self.failure_count += 1
+        if self.failure_count >= self.maxfail:
+            self.publish(report.nodeid)
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_sessionfinish(self):
+        """Stop watching the stop file, and clear it out (on the master, once workers are done)"""
+        self._stopped.set()
+        if self._watcher is not None:
+            self._watcher.join()
+        if not self.is_worker and os.path.exists(self.stop_file_path):
+            os.remove(self.stop_file_path)
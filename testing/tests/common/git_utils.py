@@ -14,6 +14,7 @@ import logging
 
 # this project
 from tests.common.misc_utils import (
+    ShellCommandCancelled,
     run_shell,
 )
 
@@ -39,6 +40,9 @@ def prepare_minimal_viable_git_repo(repo_path):
         ]
         for cmd_text in cmd_texts:
             run_shell(cmd_text, working_path=repo_path)
+    except ShellCommandCancelled:
+        # another test failed first, this one didn't fail as such
+        raise
     except Exception as error:
         msg = "Invocation of git during test failed"
         _LOGGER.exception(msg)
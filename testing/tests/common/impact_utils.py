@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for working out which tests a change to the template (or the harness) can affect
+"""
+
+#
+# Imports
+#
+
+# import core
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+# import third party
+import pytest
+
+# this project
+from tests.constants import (
+    ProjectFlavor,
+)
+from tests.common.cookiecutter_utils import (
+    compute_template_file_digests,
+)
+from tests.common.output_utils import (
+    OutputDirectoryManager,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# the directory of the template holding every project flavor's files, only one of which the
+# post generation hook keeps
+_PROJECT_FLAVORS_PATH = os.path.join(
+    '{{cookiecutter.package_name}}', 'cookiecutter-project-flavors')
+
+# memoized digests of the harness itself, keyed by its root path
+_HARNESS_DIGESTS = {}
+
+
+#
+# Functions
+#
+
+def get_impacting_template_files(repo_root_path, specific_test_params):
+    """
+    Get the template files that feed the output rendered for a set of test params.
+
+    That is every file in the template tree, except for the files of the project flavors which
+    the template's post generation hook throws away.
+
+    Arguments:
+        repo_root_path (str): Path to the root of this repo
+        specific_test_params (tuple): A specific set of test parameters
+    Returns:
+        list: Paths relative to the repo root
+    """
+    other_flavor_paths = tuple(
+        os.path.join(_PROJECT_FLAVORS_PATH, project_flavor.json_value) + os.sep
+        for project_flavor in ProjectFlavor
+        if project_flavor is not specific_test_params.project_flavor)
+    return [
+        relative_path for relative_path in compute_template_file_digests(repo_root_path)
+        if not relative_path.startswith(other_flavor_paths)
+    ]
+
+
+def compute_harness_digest(harness_root_path):
+    """
+    Compute a digest of the harness code, so that changing the expectations re-runs every test.
+
+    Arguments:
+        harness_root_path (str): Path to the directory holding the harness (`<repo>/testing`)
+    Returns:
+        str: Hex digest
+    """
+    harness_root_path = os.path.abspath(harness_root_path)
+    if harness_root_path in _HARNESS_DIGESTS:
+        return _HARNESS_DIGESTS[harness_root_path]
+
+    hash_obj = hashlib.sha256()
+    for file_name in ('pytest.ini', 'requirements.txt', 'cookiecutter-config.yaml'):
+        file_path = os.path.join(harness_root_path, file_name)
+        if os.path.exists(file_path):
+            with open(file_path, 'rb') as input_file:
+                hash_obj.update(file_name)
+                hash_obj.update(hashlib.sha256(input_file.read()).hexdigest())
+    for dir_path, dir_names, file_names in os.walk(os.path.join(harness_root_path, 'tests')):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            # the golden snapshots (JSON) are expectations too
+            if not file_name.endswith(('.py', '.json')):
+                continue
+            file_path = os.path.join(dir_path, file_name)
+            with open(file_path, 'rb') as input_file:
+                hash_obj.update(os.path.relpath(file_path, harness_root_path))
+                hash_obj.update(hashlib.sha256(input_file.read()).hexdigest())
+    digest = hash_obj.hexdigest()
+    _HARNESS_DIGESTS[harness_root_path] = digest
+    return digest
+
+
+#
+# Classes
+#
+
+class ImpactIndex(object):
+    """
+    Index of the last passing result of each test parameter combination.
+
+    Each entry records the template files that feed the combination's output along with a digest of
+    them (plus the harness code and the cookiecutter JSON data), so a later run can tell whether
+    anything the combination depends on has changed since it passed.
+    """
+
+    def __init__(self, index_root_path, repo_root_path, skip_unaffected):
+        """
+        Arguments:
+            index_root_path (str): Directory to keep the index entries in
+            repo_root_path (str): Path to the root of this repo
+            skip_unaffected (bool): Whether to skip combinations whose inputs haven't changed
+                since they last passed
+        """
+        self.index_root_path = os.path.abspath(index_root_path)
+        self.repo_root_path = repo_root_path
+        self.skip_unaffected = skip_unaffected
+        if not os.path.exists(self.index_root_path):
+            try:
+                os.makedirs(self.index_root_path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+    def _get_entry_path(self, prefix, specific_test_params):
+        params_hash = OutputDirectoryManager.build_params_hash(specific_test_params)
+        return os.path.join(self.index_root_path, "{}-{}.json".format(prefix, params_hash))
+
+    def _compute_inputs_digest(self, input_files, cookiecutter_json_data):
+        file_digests = compute_template_file_digests(self.repo_root_path)
+        hash_obj = hashlib.sha256()
+        hash_obj.update(compute_harness_digest(os.path.join(self.repo_root_path, 'testing')))
+        hash_obj.update(json.dumps(cookiecutter_json_data, sort_keys=True))
+        for relative_path in input_files:
+            hash_obj.update(relative_path)
+            hash_obj.update(file_digests[relative_path])
+        return hash_obj.hexdigest()
+
+    def skip_if_unaffected(self, prefix, specific_test_params, cookiecutter_json_data):
+        """
+        Skip the test, as a cached pass, if nothing feeding it changed since it last passed.
+
+        Arguments:
+            prefix (str): The kind of test (the same prefix its output directory gets)
+            specific_test_params (tuple): A specific set of test parameters
+            cookiecutter_json_data (dict): Baseline cookiecutter JSON data
+        """
+        if not self.skip_unaffected:
+            return
+        entry_path = self._get_entry_path(prefix, specific_test_params)
+        if not os.path.exists(entry_path):
+            _LOGGER.debug("No earlier passing result in %s", entry_path)
+            return
+        with open(entry_path, 'r') as entry_file:
+            entry = json.load(entry_file)
+        inputs_digest = self._compute_inputs_digest(
+            get_impacting_template_files(self.repo_root_path, specific_test_params),
+            cookiecutter_json_data)
+        if entry['inputs_digest'] == inputs_digest:
+            pytest.skip(
+                "cached pass: none of its {} input files changed since it passed at {}".format(
+                    len(entry['input_files']), entry['passed_at']))
+        _LOGGER.debug("Inputs changed since the earlier passing result in %s", entry_path)
+
+    def record_pass(self, prefix, specific_test_params, cookiecutter_json_data):
+        """
+        Record that a test passed with the current template and harness.
+
+        Arguments:
+            prefix (str): The kind of test (the same prefix its output directory gets)
+            specific_test_params (tuple): A specific set of test parameters
+            cookiecutter_json_data (dict): Baseline cookiecutter JSON data
+        """
+        input_files = get_impacting_template_files(self.repo_root_path, specific_test_params)
+        entry = {
+            'input_files': input_files,
+            'inputs_digest': self._compute_inputs_digest(input_files, cookiecutter_json_data),
+            'passed_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'specific_test_params': str(specific_test_params),
+        }
+        entry_path = self._get_entry_path(prefix, specific_test_params)
+        file_descriptor, scratch_path = tempfile.mkstemp(
+            prefix='.scratch-', dir=self.index_root_path)
+        with os.fdopen(file_descriptor, 'w') as entry_file:
+            json.dump(entry, entry_file, indent=2, sort_keys=True)
+        os.rename(scratch_path, entry_path)
+        _LOGGER.debug("Recorded a passing result in %s", entry_path)
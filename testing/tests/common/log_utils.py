@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for logging from many test processes at once (like xdist workers) without contention
+
+WARNING:
+    * This is imported while the `tests` package itself is being imported, so it must only import
+      from the standard library.
+"""
+
+#
+# Imports
+#
+
+# import core
+import errno
+import heapq
+import json
+import logging
+import os
+import Queue
+import threading
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# name of the log part file of the process that isn't an xdist worker
+CONTROLLER_PART_NAME = 'master'
+
+# node id of the test currently running in this process, stamped onto every log record
+_CURRENT_TEST = {'nodeid': None}
+
+
+#
+# Functions
+#
+
+def set_current_test(nodeid):
+    """Set the node id of the test running in this process (None between tests)"""
+    _CURRENT_TEST['nodeid'] = nodeid
+
+
+def get_log_parts_path(log_file_path):
+    """Get the directory holding the per-process log parts which are merged into a log file"""
+    return "{}.parts".format(log_file_path)
+
+
+def _iter_part_records(part_path):
+    """Yield the records of a log part, skipping a partially written last line"""
+    with open(part_path, 'r') as part_file:
+        for line in part_file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def merge_log_parts(parts_path, log_file_path, nodeid_filter=None):
+    """
+    Merge the per-process log parts into one log, ordered by time.
+
+    Arguments:
+        parts_path (str): Directory holding the log parts (JSON lines, one file per process)
+        log_file_path (str): The merged log to write
+        nodeid_filter (str): Only keep records logged while a test whose node id contains this
+            was running
+    Returns:
+        int: Number of records written
+    """
+    part_paths = sorted(
+        os.path.join(parts_path, file_name) for file_name in os.listdir(parts_path)
+        if file_name.endswith('.jsonl'))
+    record_iters = [
+        ((record['created'], index, record) for record in _iter_part_records(part_path))
+        for index, part_path in enumerate(part_paths)]
+
+    record_count = 0
+    with open(log_file_path, 'w') as log_file:
+        for _, _, record in heapq.merge(*record_iters):
+            if nodeid_filter is not None and nodeid_filter not in (record['nodeid'] or ''):
+                continue
+            log_file.write(u"[{}] {}\n".format(record['process'], record['text']).encode('utf-8'))
+            record_count += 1
+    return record_count
+
+
+def start_log_part_listener(log_file_path, process_name, log_format, date_format):
+    """
+    Log every record of this process into its own log part, via a listener thread.
+
+    Arguments:
+        log_file_path (str): The log file the parts get merged into at the end of the session
+        process_name (str): The xdist worker id, or CONTROLLER_PART_NAME if not a worker
+        log_format (str): Format of the log records
+        date_format (str): Format of the timestamps in the log records
+    Returns:
+        LogPartListener: The running listener
+    """
+    parts_path = get_log_parts_path(log_file_path)
+    if process_name == CONTROLLER_PART_NAME and os.path.isdir(parts_path):
+        # the controlling process starts before any workers, so these are from an earlier session
+        for file_name in os.listdir(parts_path):
+            os.remove(os.path.join(parts_path, file_name))
+    try:
+        os.makedirs(parts_path)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+    listener = LogPartListener(parts_path, process_name)
+    listener.handler.setFormatter(logging.Formatter(log_format, date_format))
+    logging.getLogger().addHandler(listener.handler)
+    return listener
+
+
+#
+# Classes
+#
+
+class _LogPartWriter(object):
+    """Writes formatted log records as JSON lines into one process's log part"""
+
+    def __init__(self, part_path):
+        self.part_path = part_path
+        self._file = open(part_path, 'w')
+        self._lock = threading.Lock()
+
+    def write(self, record_data):
+        line = json.dumps(record_data) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class QueueLogHandler(logging.Handler):
+    """
+    Log handler which formats records in the logging thread and hands them off to a queue.
+
+    The records are formatted right away (so later changes to their arguments don't show), and
+    stamped with the process name and the node id of the running test.  A forked child process
+    (like a render worker) writes its records straight to its own log part instead, since the
+    listener thread doesn't survive the fork.
+    """
+
+    def __init__(self, record_queue, process_name, parts_path):
+        logging.Handler.__init__(self)
+        self.record_queue = record_queue
+        self.process_name = process_name
+        self.parts_path = parts_path
+        self._pid = os.getpid()
+        self._forked_writer = None
+
+    def emit(self, record):
+        try:
+            record_data = {
+                'created': record.created,
+                'nodeid': _CURRENT_TEST['nodeid'],
+                'process': self.process_name,
+                'text': self.format(record),
+            }
+            if os.getpid() == self._pid:
+                self.record_queue.put(record_data)
+                return
+            if self._forked_writer is None:
+                self._forked_writer = _LogPartWriter(os.path.join(
+                    self.parts_path, "{}-{}.jsonl".format(self.process_name, os.getpid())))
+            record_data['process'] = "{}-{}".format(self.process_name, os.getpid())
+            self._forked_writer.write(record_data)
+            self._forked_writer.flush()
+        except Exception:
+            self.handleError(record)
+
+
+class LogPartListener(object):
+    """
+    Thread writing the records a QueueLogHandler hands off into this process's log part.
+
+    Tests never wait on the log file, and each process writes a file of its own, so processes
+    never contend for (or interleave within) one log file.
+    """
+
+    # queued to tell the listener thread to stop
+    _SENTINEL = None
+
+    def __init__(self, parts_path, process_name):
+        self.parts_path = parts_path
+        self.process_name = process_name
+        self.record_queue = Queue.Queue()
+        self.handler = QueueLogHandler(self.record_queue, process_name, parts_path)
+        self._writer = _LogPartWriter(os.path.join(parts_path, "{}.jsonl".format(process_name)))
+        self._thread = threading.Thread(target=self._listen, name='log-part-listener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            record_data = self.record_queue.get()
+            if record_data is LogPartListener._SENTINEL:
+                self._writer.flush()
+                return
+            self._writer.write(record_data)
+            if self.record_queue.empty():
+                self._writer.flush()
+
+    def stop(self):
+        """
+        Write out every queued record and stop the thread.
+
+        Records logged after this are written by the handler directly, so nothing gets lost.
+        """
+        if not self._thread.is_alive():
+            return
+        self.handler.record_queue = _DirectWriteQueue(self._writer)
+        self.record_queue.put(LogPartListener._SENTINEL)
+        self._thread.join()
+
+
+class _DirectWriteQueue(object):
+    """Stand in for the record queue once the listener has stopped, writing records right away"""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def put(self, record_data):
+        self.writer.write(record_data)
+        self.writer.flush()
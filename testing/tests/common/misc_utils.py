@@ -10,10 +10,21 @@ Miscellaneous utility functions for tests.
 # import core
 import collections
 import contextlib
+import ctypes
+import errno
+import fcntl
+import hashlib
 import logging
+import os
+import re
+import resource
+import select
+import signal
 import StringIO
 import subprocess
 import sys
+import threading
+import time
 
 # import third party
 import pytest
@@ -28,6 +39,44 @@ import shutilwhich
 # logger
 _LOGGER = logging.getLogger(__name__)
 
+# defaults for run_shell, normally set per test via set_run_shell_defaults
+_RUN_SHELL_DEFAULTS = {
+    'log_file_path': None,
+    'timeout': None,
+}
+
+# number of trailing lines of shell command output to show in failure messages
+RUN_SHELL_TAIL_LINE_COUNT = 40
+
+# bytes to read from a shell command's output at a time
+_RUN_SHELL_READ_SIZE = 64 * 1024
+
+# seconds to give a timed out shell command to exit before escalating the signal
+_RUN_SHELL_KILL_GRACE_PERIOD = 10
+
+# seconds between checks of whether a shell command that closed its output has exited yet
+_RUN_SHELL_EXIT_POLL_SECONDS = 0.1
+
+# resource usage of the shell commands run via run_shell since the defaults were last set (so, by
+# the current test), each a dict of the command, its working directory, its duration and its usage
+_RUN_SHELL_USAGES = []
+
+# shell commands running via run_shell (in any thread), keyed by process id, and why shell commands
+# were cancelled (None unless they were), both guarded by the lock
+_RUNNING_SHELL_COMMANDS = {}
+_SHELL_CANCELLATION = {'reason': None}
+_SHELL_COMMANDS_LOCK = threading.Lock()
+
+# waitid arguments (Linux values, for pythons whose os module has no waitid), to wait for a shell
+# command to exit while leaving it a zombie, so its /proc entry (I/O counters) is still readable
+_P_PID = getattr(os, 'P_PID', 1)
+_WEXITED = getattr(os, 'WEXITED', 4)
+_WNOWAIT = getattr(os, 'WNOWAIT', 0x01000000)
+_SIGINFO_SIZE = 128
+
+# length limit on the human readable part of per-test log file names
+_LOG_FILE_NAME_MAX_READABLE_LENGTH = 120
+
 #
 # Configure python logging
 #
@@ -65,6 +114,31 @@ BasicTestParams = collections.namedtuple(
         'cookiecutter_json_data',
         'root_output_path',
         'retain_passed_test_data',
+        'render_cache',
+        'tox_virtualenv_pool',
+        'local_package_index',
+        'output_garbage_collector',
+        'impact_index',
+        'resource_token_pool',
+        'phase_timer',
+    ])
+
+# resource usage of a shell command and everything it ran (and waited for), from `wait4` and the
+# command's `/proc/<pid>/io` (storage bytes are those that hit the block layer, and None without
+# task I/O accounting in the kernel), the peak RSS being at least the harness's own since the
+# command is forked from it
+ShellCommandUsage = collections.namedtuple(
+    'ShellCommandUsage',
+    [
+        'user_cpu_seconds',
+        'system_cpu_seconds',
+        'peak_rss_bytes',
+        'block_input_operations',
+        'block_output_operations',
+        'read_bytes',
+        'write_bytes',
+        'storage_read_bytes',
+        'storage_write_bytes',
     ])
 
 SpecificTestParamsFilter = collections.namedtuple(
@@ -77,6 +151,23 @@ SpecificTestParamsFilter = collections.namedtuple(
     ])
 
 
+#
+# Exceptions
+#
+
+class ShellCommandError(AssertionError):
+    """A shell command run by `run_shell` exited with a non-zero exit code"""
+
+    def __init__(self, message, returncode, usage=None):
+        AssertionError.__init__(self, message)
+        self.returncode = returncode
+        self.usage = usage
+
+
+class ShellCommandCancelled(Exception):
+    """A shell command run by `run_shell` was cancelled (see `cancel_shell_commands`)"""
+
+
 #
 # Context manager for redirecting std{out|err}
 #
@@ -104,10 +195,37 @@ def redirected_stdout_and_stderr():
             _LOGGER.debug("Buffered STDERR was\n%s", stderr_buffer)
 
 
+#
+# Context manager for host-wide file locks
+#
+
+@contextlib.contextmanager
+def file_lock(lock_file_path):
+    """Context manager holding an exclusive lock on a file, shared by every process on the host"""
+    _LOGGER.debug("Acquiring file lock %s", lock_file_path)
+    with open(lock_file_path, 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        _LOGGER.debug("Acquired file lock %s", lock_file_path)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            _LOGGER.debug("Released file lock %s", lock_file_path)
+
+
 #
 # Functions
 #
 
+def compute_median(values):
+    """Get the median of a non-empty list of numbers"""
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
 def skip_if_missing_python_interpreter(python_version_enum):
     """Skip test if missing the necessary version of the Python interpreter"""
     file_name = python_version_enum.executable_name
@@ -116,26 +234,313 @@ def skip_if_missing_python_interpreter(python_version_enum):
         pytest.skip(message)
 
 
-def run_shell(cmd_text, working_path):
+def set_run_shell_defaults(log_file_path=None, timeout=None):
+    """
+    Set the defaults for shell commands run via `run_shell` (normally once per test).
+
+    Arguments:
+        log_file_path (str): Optional file to stream command output into, instead of the common
+            test log
+        timeout (float): Optional number of seconds after which commands are killed
+    """
+    _RUN_SHELL_DEFAULTS['log_file_path'] = log_file_path
+    _RUN_SHELL_DEFAULTS['timeout'] = timeout
+    del _RUN_SHELL_USAGES[:]
+
+
+def get_run_shell_usages():
+    """
+    Get the resource usage of the shell commands run via `run_shell` since the defaults were set.
+
+    Returns:
+        list: Dicts of each command's `command`, `working_path` and `seconds`, along with the
+            fields of its ShellCommandUsage
+    """
+    return [dict(usage) for usage in _RUN_SHELL_USAGES]
+
+
+def build_log_file_name(test_node_id):
+    """Build a file system friendly, unique, log file name out of a pytest test node id"""
+    readable_name = re.sub(r'[^\w.-]+', '_', test_node_id)[:_LOG_FILE_NAME_MAX_READABLE_LENGTH]
+    return "{}-{}.log".format(readable_name, hashlib.sha256(test_node_id).hexdigest()[:8])
+
+
+def _has_exited(pid, block):
+    """
+    Check whether a child process has exited, without reaping it (so it stays a zombie).
+
+    Arguments:
+        pid (int): The child process
+        block (bool): Whether to wait for it to exit
+    Returns:
+        bool: Whether it has exited
+    """
+    options = _WEXITED | _WNOWAIT | (0 if block else os.WNOHANG)
+    os_waitid = getattr(os, 'waitid', None)
+    while True:
+        try:
+            if os_waitid is not None:
+                return os_waitid(_P_PID, pid, options) is not None
+            # zeroed, so that si_signo stays zero unless a child exited
+            siginfo = ctypes.create_string_buffer(_SIGINFO_SIZE)
+            if ctypes.CDLL(None, use_errno=True).waitid(_P_PID, pid, siginfo, options) != 0:
+                error_number = ctypes.get_errno()
+                raise OSError(error_number, os.strerror(error_number))
+            return siginfo.raw[:ctypes.sizeof(ctypes.c_int)] != b'\0' * ctypes.sizeof(ctypes.c_int)
+        except OSError as error:
+            if error.errno != errno.EINTR:
+                raise
+
+
+def _kill_process_group(sub_proc):
+    """
+    Terminate a shell command and everything it started, killing it if it does not go quietly.
+
+    The command is left for `_wait_for_usage` to reap.
+    """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(sub_proc.pid, sig)
+        except OSError as error:
+            if error.errno != errno.ESRCH:
+                raise
+            break
+        deadline = time.time() + _RUN_SHELL_KILL_GRACE_PERIOD
+        while not _has_exited(sub_proc.pid, block=False) and time.time() < deadline:
+            time.sleep(0.1)
+        if _has_exited(sub_proc.pid, block=False):
+            break
+
+
+def _read_proc_io(pid):
+    """Get the I/O counters of a process (including the children it reaped), or None if unknown"""
+    try:
+        with open("/proc/{}/io".format(pid), 'r') as io_file:
+            return dict(
+                (name, int(value)) for name, value in
+                (line.split(':', 1) for line in io_file if ':' in line))
+    except (IOError, ValueError):
+        return None
+
+
+def _wait_for_usage(sub_proc):
+    """
+    Reap a shell command, getting its resource usage along with everything it waited for.
+
+    Unlike deltas of `getrusage(RUSAGE_CHILDREN)`, this only counts the command itself, even with
+    other commands running at the same time (in threads, or render workers).  It first waits for
+    the command to exit without reaping it, then reads its I/O counters while it's a zombie that
+    already holds its children's counts, and only then reaps it.
+
+    Returns:
+        ShellCommandUsage: The resource usage
+    """
+    _has_exited(sub_proc.pid, block=True)
+    proc_io = _read_proc_io(sub_proc.pid) or {}
+    while True:
+        try:
+            _, status, rusage = os.wait4(sub_proc.pid, 0)
+            break
+        except OSError as error:
+            if error.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        sub_proc.returncode = -os.WTERMSIG(status)
+    else:
+        sub_proc.returncode = os.WEXITSTATUS(status)
+    return ShellCommandUsage(
+        user_cpu_seconds=rusage.ru_utime,
+        system_cpu_seconds=rusage.ru_stime,
+        # kilobytes on Linux
+        peak_rss_bytes=rusage.ru_maxrss * 1024,
+        block_input_operations=rusage.ru_inblock,
+        block_output_operations=rusage.ru_oublock,
+        read_bytes=proc_io.get('rchar'),
+        write_bytes=proc_io.get('wchar'),
+        storage_read_bytes=proc_io.get('read_bytes'),
+        storage_write_bytes=proc_io.get('write_bytes'))
+
+
+def get_shell_cancellation_reason():
+    """Get why shell commands were cancelled via `cancel_shell_commands`, or None if they weren't"""
+    return _SHELL_CANCELLATION['reason']
+
+
+def cancel_shell_commands(reason):
+    """
+    Kill every running shell command (and everything it started), and refuse to run any more.
+
+    Safe to call from any thread.  The threads running the commands see them exit, and raise
+    ShellCommandCancelled.  Commands that don't go quietly are killed after a grace period.
+
+    Arguments:
+        reason (str): Why, for the log and the ShellCommandCancelled errors
     """
-    Shell command runner which streams its output to the common test log.
+    with _SHELL_COMMANDS_LOCK:
+        _SHELL_CANCELLATION['reason'] = reason
+        running_commands = dict(_RUNNING_SHELL_COMMANDS)
+    _LOGGER.info("Cancelling %d running shell commands: %s", len(running_commands), reason)
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        deadline = time.time() + _RUN_SHELL_KILL_GRACE_PERIOD
+        for pid, cmd_text in running_commands.items():
+            _LOGGER.debug("Sending signal %d to the process group of '%s'", sig, cmd_text)
+            try:
+                os.killpg(pid, sig)
+            except OSError as error:
+                if error.errno != errno.ESRCH:
+                    raise
+        # the threads running the commands reap them
+        while time.time() < deadline:
+            with _SHELL_COMMANDS_LOCK:
+                running_commands = dict(
+                    (pid, cmd_text) for pid, cmd_text in running_commands.items()
+                    if pid in _RUNNING_SHELL_COMMANDS)
+            if not running_commands:
+                return
+            time.sleep(0.1)
+
+
+def run_shell(cmd_text, working_path, env=None, timeout=None):
+    """
+    Shell command runner which streams its output to a log file without blocking on lines.
+
+    Output goes to the log file set via `set_run_shell_defaults` (normally one per test) or,
+    failing that, to the common test log.  The last lines of output are kept in memory so that
+    failures can show them.
+
+    Arguments:
+        cmd_text (str): The shell command to run
+        working_path (str): Working directory to run the command in
+        env (dict): Optional environment variables to add to (or override in) the current
+            environment for the command
+        timeout (float): Optional number of seconds after which the command (and everything it
+            started) is killed, overriding the default set via `set_run_shell_defaults`
+    Returns:
+        ShellCommandUsage: Resource usage of the command (see also `get_run_shell_usages`)
     """
     _LOGGER.debug("Begin running subprocess shell in directory %s with command: '%s'",
                   working_path, cmd_text)
 
-    sub_proc = subprocess.Popen(
-        cmd_text,
-        shell=True,
-        cwd=working_path,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT)
-    for line in iter(sub_proc.stdout.readline, b''):
-        _LOGGER.debug(line.strip())
-    sub_proc.wait()
-    assert sub_proc.returncode == 0, \
-        "Non-zero exit code, {}, from running shell command in directory {}: '{}'".format(
-            sub_proc.returncode, working_path, cmd_text)
+    sub_proc_env = None
+    if env:
+        _LOGGER.debug("Adding these environment variables for the command: %s", env)
+        sub_proc_env = dict(os.environ)
+        sub_proc_env.update(env)
+
+    if timeout is None:
+        timeout = _RUN_SHELL_DEFAULTS['timeout']
+    log_file_path = _RUN_SHELL_DEFAULTS['log_file_path']
+    if log_file_path:
+        _LOGGER.debug("Streaming output of the command to %s", log_file_path)
+
+    # run in a new process group so a timeout (or cancellation) can take down everything the
+    # command started
+    with _SHELL_COMMANDS_LOCK:
+        if _SHELL_CANCELLATION['reason'] is not None:
+            raise ShellCommandCancelled(
+                "Not running shell command '{}', shell commands were cancelled: {}".format(
+                    cmd_text, _SHELL_CANCELLATION['reason']))
+        sub_proc = subprocess.Popen(
+            cmd_text,
+            shell=True,
+            cwd=working_path,
+            env=sub_proc_env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            preexec_fn=os.setsid)
+        _RUNNING_SHELL_COMMANDS[sub_proc.pid] = cmd_text
+    start_time = time.time()
+    fd = sub_proc.stdout.fileno()
+    deadline = time.time() + timeout if timeout else None
+    tail_lines = collections.deque(maxlen=RUN_SHELL_TAIL_LINE_COUNT)
+    partial_line = b''
+    timed_out = False
+    usage = None
+    log_file = open(log_file_path, 'ab') if log_file_path else None
+    try:
+        if log_file is not None:
+            log_file.write("==> [{}] in {}: {}\n".format(
+                time.strftime('%H:%M:%S'), working_path, cmd_text))
+        while True:
+            # checked on every pass, so that a command that never stops writing still times out
+            if deadline is not None and time.time() >= deadline:
+                timed_out = True
+                break
+            wait_time = None if deadline is None else max(0, deadline - time.time())
+            try:
+                readable, _, _ = select.select([fd], [], [], wait_time)
+            except select.error as error:
+                if error.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not readable:
+                continue
+            chunk = os.read(fd, _RUN_SHELL_READ_SIZE)
+            if not chunk:
+                break
+            if log_file is not None:
+                log_file.write(chunk)
+            lines = (partial_line + chunk).split(b'\n')
+            partial_line = lines.pop()
+            for line in lines:
+                tail_lines.append(line)
+                if log_file is None:
+                    _LOGGER.debug(line.strip())
+        if partial_line:
+            tail_lines.append(partial_line)
+            if log_file is None:
+                _LOGGER.debug(partial_line.strip())
+            else:
+                log_file.write(b'\n')
+        # the command may close its output and carry on, so the deadline holds until it exits
+        while not timed_out and deadline is not None and \
+                not _has_exited(sub_proc.pid, block=False):
+            if time.time() >= deadline:
+                timed_out = True
+            else:
+                time.sleep(_RUN_SHELL_EXIT_POLL_SECONDS)
+        if timed_out:
+            _LOGGER.debug("Command timed out after %s seconds, killing it", timeout)
+            _kill_process_group(sub_proc)
+        usage = _wait_for_usage(sub_proc)
+    finally:
+        sub_proc.stdout.close()
+        if log_file is not None:
+            log_file.close()
+        with _SHELL_COMMANDS_LOCK:
+            del _RUNNING_SHELL_COMMANDS[sub_proc.pid]
+
+    if usage is not None:
+        _LOGGER.debug("Command used %.2fs user and %.2fs system CPU, %d bytes peak RSS, and read "
+                      "%s (%s from storage) and wrote %s (%s to storage) bytes",
+                      usage.user_cpu_seconds, usage.system_cpu_seconds, usage.peak_rss_bytes,
+                      usage.read_bytes, usage.storage_read_bytes, usage.write_bytes,
+                      usage.storage_write_bytes)
+        usage_record = {
+            'command': cmd_text,
+            'working_path': working_path,
+            'seconds': time.time() - start_time,
+        }
+        usage_record.update(usage._asdict())
+        _RUN_SHELL_USAGES.append(usage_record)
+
+    tail_text = "Last {} lines of output{}:\n{}".format(
+        len(tail_lines),
+        " (full output in {})".format(log_file_path) if log_file_path else "",
+        "\n".join(tail_lines))
+    if sub_proc.returncode != 0 and _SHELL_CANCELLATION['reason'] is not None:
+        raise ShellCommandCancelled(
+            "Cancelled shell command in directory {}: '{}', {}\n{}".format(
+                working_path, cmd_text, _SHELL_CANCELLATION['reason'], tail_text))
+    assert not timed_out, \
+        "Timed out after {} seconds running shell command in directory {}: '{}'\n{}".format(
+            timeout, working_path, cmd_text, tail_text)
+    if sub_proc.returncode != 0:
+        raise ShellCommandError(
+            "Non-zero exit code, {}, from running shell command in directory {}: '{}'\n{}".format(
+                sub_proc.returncode, working_path, cmd_text, tail_text),
+            sub_proc.returncode, usage=usage)
 
     _LOGGER.debug("Finished running subprocess shell in directory %s with command: '%s'",
                   working_path, cmd_text)
-
+    return usage
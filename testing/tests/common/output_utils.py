@@ -8,17 +8,23 @@ Utilities for managing the working/output directories for tests
 #
 
 # import core
+import errno
 import hashlib
+import json
 import logging
 import pprint
 import os
+import Queue
 import shutil
+import threading
+import uuid
 
 # import third party
+import enum
+import scandir
 
 # this project
 import tests.constants
-import tests.fixtures
 import tests.common.misc_utils
 import tests.common.cookiecutter_utils
 
@@ -44,45 +50,231 @@ def _safer_rmtree(path):
     _LOGGER.debug("Removing directory tree at %s", abs_path)
     shutil.rmtree(abs_path, ignore_errors=False)
 
+
+def _get_disk_usage(path):
+    """Get the bytes of disk used by a directory tree, without following symlinks"""
+    total = 0
+    pending = [path]
+    while pending:
+        for entry in scandir.scandir(pending.pop()):
+            stat_result = entry.stat(follow_symlinks=False)
+            total += stat_result.st_blocks * 512
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+    return total
+
 #
 # Classes for output directory setup etc.
 #
 
 
+class OutputGarbageCollector(object):
+    """
+    Lifecycle manager for the output directories of tests.
+
+    Finished output trees are renamed into a trash directory, which is instant since it lives on
+    the same file system, and a background thread deletes them from there, so tests never wait on
+    deletion.  Output retained from failed tests is kept within a disk budget by evicting the
+    least recently used trees first.
+    """
+
+    # name of the trash directory in the root output directory
+    TRASH_DIR_NAME = '.trash'
+
+    def __init__(self, root_output_path, retained_budget_bytes=None):
+        """
+        Arguments:
+            root_output_path (str): The directory the output directories of tests live in
+            retained_budget_bytes (int): Disk budget for retained output, or None for no limit
+        """
+        self.root_output_path = os.path.abspath(root_output_path)
+        self.trash_path = os.path.join(
+            self.root_output_path, OutputGarbageCollector.TRASH_DIR_NAME)
+        self.retained_budget_bytes = retained_budget_bytes
+        self._queue = Queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        if not os.path.exists(self.trash_path):
+            try:
+                os.makedirs(self.trash_path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+    def _delete_forever(self):
+        """Body of the background thread, deleting whatever lands in the queue"""
+        while True:
+            trash_entry_path = self._queue.get()
+            try:
+                _LOGGER.debug("Deleting trashed output %s", trash_entry_path)
+                shutil.rmtree(trash_entry_path, ignore_errors=True)
+            finally:
+                self._queue.task_done()
+
+    def _enqueue(self, trash_entry_path):
+        """Queue a trash entry for deletion on the background thread"""
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._delete_forever, name='output-garbage-collector')
+                # trash left behind at exit is swept up by a later session
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put(trash_entry_path)
+
+    def discard(self, output_dir_path):
+        """Move an output directory into the trash and delete it in the background"""
+        abs_path = os.path.abspath(output_dir_path)
+        assert os.path.isdir(abs_path)
+        assert os.path.dirname(abs_path) == self.root_output_path
+        trash_entry_path = os.path.join(
+            self.trash_path, "{}-{}".format(os.path.basename(abs_path), uuid.uuid4().hex))
+        _LOGGER.debug("Moving output directory %s into the trash", abs_path)
+        os.rename(abs_path, trash_entry_path)
+        self._enqueue(trash_entry_path)
+
+    def sweep(self):
+        """Delete (in the background) whatever earlier sessions left in the trash"""
+        for entry in scandir.scandir(self.trash_path):
+            self._enqueue(entry.path)
+
+    def enforce_budget(self):
+        """
+        Evict the least recently used retained output until it fits in the disk budget.
+
+        WARNING:
+            * Only call this while no tests are running, since every output directory is
+              considered retained.
+        """
+        if self.retained_budget_bytes is None:
+            return
+        _LOGGER.info("Begin fitting retained output into a budget of %d bytes",
+                     self.retained_budget_bytes)
+        retained = []
+        for entry in scandir.scandir(self.root_output_path):
+            breadcrumb_path = os.path.join(
+                entry.path, OutputDirectoryManager.BREADCRUMB_FILE_NAME)
+            if entry.is_dir(follow_symlinks=False) and os.path.exists(breadcrumb_path):
+                retained.append(
+                    (os.path.getmtime(breadcrumb_path), _get_disk_usage(entry.path), entry.path))
+
+        # oldest first
+        retained.sort()
+        total = sum(size for _, size, _ in retained)
+        for _, size, output_dir_path in retained:
+            if total <= self.retained_budget_bytes:
+                break
+            _LOGGER.debug("Evicting %d bytes of retained output in %s", size, output_dir_path)
+            self.discard(output_dir_path)
+            total -= size
+        _LOGGER.info("Finished fitting retained output into the budget, %d bytes retained", total)
+
+    def close(self):
+        """Wait for the background thread to finish deleting what's been trashed"""
+        self._queue.join()
+
+
+
 class OutputDirectoryManager(object):
     """Manager for output directories used by tests"""
 
+    # number of hex digits of the content key used in output directory names (the full key is
+    # kept in the breadcrumb file), kept short so that shebang lines of virtualenvs created under
+    # the output directory stay under the kernel's length limit
+    DIR_NAME_KEY_LENGTH = 16
+
+    # number of hex digits of the params hash used in pytest arg ids
+    ARG_ID_HASH_LENGTH = 8
+
+    # name of the file recording the parameters a test ran with in its output directory
+    BREADCRUMB_FILE_NAME = 'test-params.txt'
+
+    @staticmethod
+    def _canonicalize(value):
+        """Convert test params into plain JSON-able data with a stable representation"""
+        if isinstance(value, enum.Enum):
+            return "{}.{}".format(value.__class__.__name__, value.name)
+        if isinstance(value, tuple) and hasattr(value, '_fields'):
+            canonical = {
+                field: OutputDirectoryManager._canonicalize(getattr(value, field))
+                for field in value._fields
+            }
+            canonical['__class__'] = value.__class__.__name__
+            return canonical
+        if isinstance(value, (list, tuple)):
+            return [OutputDirectoryManager._canonicalize(item) for item in value]
+        if isinstance(value, dict):
+            return {
+                str(key): OutputDirectoryManager._canonicalize(item)
+                for key, item in value.items()
+            }
+        return value
+
     @staticmethod
     def build_params_hash(specific_test_params):
-        """Make a semi-unique hash out of a prefix plus params"""
+        """Make a full-strength hash out of the params"""
         # verify params
         assert isinstance(specific_test_params, tuple)
 
         # calc hash
-        hash_obj = hashlib.sha1()
-        hash_obj.update("{}{}".format(specific_test_params.__class__, specific_test_params))
-        full_hash_hex = hash_obj.hexdigest()
-        short_hash_hex = full_hash_hex[-4:]
-        return short_hash_hex
+        hash_obj = hashlib.sha256()
+        hash_obj.update(json.dumps(
+            OutputDirectoryManager._canonicalize(specific_test_params), sort_keys=True))
+        return hash_obj.hexdigest()
+
+    @staticmethod
+    def build_short_params_hash(specific_test_params):
+        """Make a short hash out of the params, suitable for human facing pytest arg ids"""
+        params_hash = OutputDirectoryManager.build_params_hash(specific_test_params)
+        return params_hash[:OutputDirectoryManager.ARG_ID_HASH_LENGTH]
 
     @staticmethod
-    def _get_output_dir_path(basic_test_params, prefix, hash_value):
-        assert isinstance(basic_test_params, tests.fixtures.BasicTestParams)
+    def build_content_key(specific_test_params, cookiecutter_json_data, template_digest):
+        """
+        Make a content-addressed key out of everything that feeds a test's output.
+
+        Arguments:
+            specific_test_params (tuple): A specific set of test parameters
+            cookiecutter_json_data (dict): Baseline cookiecutter JSON data
+            template_digest (str): Digest of the template tree
+        Returns:
+            str: Hex digest
+        """
+        assert isinstance(specific_test_params, tuple)
+        assert template_digest
+        hash_obj = hashlib.sha256()
+        hash_obj.update(json.dumps({
+            'specific_test_params': OutputDirectoryManager._canonicalize(specific_test_params),
+            'cookiecutter_json_data': cookiecutter_json_data,
+            'template_digest': template_digest,
+        }, sort_keys=True))
+        return hash_obj.hexdigest()
+
+    @staticmethod
+    def _get_output_dir_path(basic_test_params, prefix, content_key):
+        assert isinstance(basic_test_params, tests.common.misc_utils.BasicTestParams)
         assert prefix
-        assert hash_value
-        sub_directory_name = "{}-{}".format(prefix, hash_value)
+        assert content_key
+        sub_directory_name = "{}-{}".format(
+            prefix, content_key[:OutputDirectoryManager.DIR_NAME_KEY_LENGTH])
         output_dir_path = os.path.join(basic_test_params.root_output_path, sub_directory_name)
         return output_dir_path
 
     def __init__(self, basic_test_params, specific_test_params, prefix):
-        assert isinstance(basic_test_params, tests.fixtures.BasicTestParams)
+        assert isinstance(basic_test_params, tests.common.misc_utils.BasicTestParams)
         assert isinstance(specific_test_params, tuple)
         self.basic_test_params = basic_test_params
         self.specific_test_params = specific_test_params
         self.output_prefix = prefix
         self.params_hash_value = OutputDirectoryManager.build_params_hash(self.specific_test_params)
+        self.template_digest = tests.common.cookiecutter_utils.compute_template_digest(
+            self.basic_test_params.repo_root_path)
+        self.content_key = OutputDirectoryManager.build_content_key(
+            self.specific_test_params,
+            self.basic_test_params.cookiecutter_json_data,
+            self.template_digest)
         self.output_dir_path = OutputDirectoryManager._get_output_dir_path(
-            self.basic_test_params, self.output_prefix, self.params_hash_value)
+            self.basic_test_params, self.output_prefix, self.content_key)
 
     def get_project_output_path(self):
         """
@@ -101,18 +293,21 @@ class OutputDirectoryManager(object):
         # remove any existing output directory
         if os.path.exists(self.output_dir_path):
             _LOGGER.debug("Found previous template output, removing it: %s", self.output_dir_path)
-            _safer_rmtree(self.output_dir_path)
+            self._remove_output_dir()
         os.mkdir(self.output_dir_path)
         _LOGGER.debug("Created output directory path: %s", self.output_dir_path)
 
         # make breadcrumb file with original parameters
         breadcrumb_data = {
             'params_hash_value': self.params_hash_value,
+            'template_digest': self.template_digest,
+            'content_key': self.content_key,
             'output_prefix': self.output_prefix,
             'basic_test_params': self.basic_test_params,
             'specific_test_params': self.specific_test_params,
         }
-        breadcrumb_path = os.path.join(self.output_dir_path, "test-params.txt")
+        breadcrumb_path = os.path.join(
+            self.output_dir_path, OutputDirectoryManager.BREADCRUMB_FILE_NAME)
         with open(breadcrumb_path, 'w') as output_file:
             for key in sorted(breadcrumb_data.keys()):
                 output_file.write("**** {} ****\n".format(key))
@@ -124,8 +319,16 @@ class OutputDirectoryManager(object):
         _LOGGER.info("Finished setting up output directory: %s", self.output_dir_path)
         return self.output_dir_path
 
+    def _remove_output_dir(self):
+        """Remove the output directory, in the background if there is a garbage collector"""
+        garbage_collector = self.basic_test_params.output_garbage_collector
+        if garbage_collector is not None:
+            garbage_collector.discard(self.output_dir_path)
+        else:
+            _safer_rmtree(self.output_dir_path)
+
     def tear_down(self):
         """Remove the test output directory"""
         _LOGGER.info("Begin tearing down (removing) output directory: %s", self.output_dir_path)
-        _safer_rmtree(self.output_dir_path)
+        self._remove_output_dir()
         _LOGGER.info("Finished tearing down (removing) output directory: %s", self.output_dir_path)
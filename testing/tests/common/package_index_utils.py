@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for serving the emitted projects' pip requirements from a local package index
+"""
+
+#
+# Imports
+#
+
+# import core
+import errno
+import logging
+import os
+
+# import third party
+import shutilwhich
+
+# this project
+from tests.constants import (
+    PipRequirementsFile,
+)
+from tests.common.misc_utils import (
+    file_lock,
+    run_shell,
+)
+from tests.common.resource_utils import (
+    hold_resource_tokens,
+)
+from tests.common.tox_utils import (
+    build_virtualenv_key,
+    get_tox_env_executable_name,
+    read_pip_environment_from_makefile,
+    resolve_tox_envs,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+
+#
+# Classes
+#
+
+class LocalPackageIndex(object):
+    """
+    Local wheel store standing in for the package indexes named in the emitted projects.
+
+    Every pinned requirement of an emitted project is prefetched into the store once per tox
+    environment its Makefile runs (like py27, or the host's python3 version) and distinct set of
+    pip requirements files, using the indexes the emitted Makefile names.  From then on, ``make`` and tox in the emitted projects are pointed at the
+    store via pip's ``--no-index``/``--find-links`` environment variables (which the emitted
+    tox.ini passes through), so they never touch the network.
+    """
+
+    # sub-directory of the store recording which requirement sets have been prefetched
+    PREFETCHED_DIR_NAME = '.prefetched'
+
+    def __init__(self, wheelhouse_path, resource_token_pool=None):
+        """
+        Arguments:
+            wheelhouse_path (str): Directory of the wheel store
+            resource_token_pool (ResourceTokenPool): Optional pool of resource tokens to hold while
+                building wheels into the store
+        """
+        self.wheelhouse_path = os.path.abspath(wheelhouse_path)
+        self.resource_token_pool = resource_token_pool
+        self.prefetched_path = os.path.join(
+            self.wheelhouse_path, LocalPackageIndex.PREFETCHED_DIR_NAME)
+        if not os.path.exists(self.prefetched_path):
+            try:
+                os.makedirs(self.prefetched_path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+    def get_pip_environment(self):
+        """Get the pip environment variables pointing pip at the local wheel store only"""
+        return {
+            'PIP_NO_INDEX': '1',
+            'PIP_FIND_LINKS': self.wheelhouse_path,
+        }
+
+    def _prefetch(self, tox_env, executable_name, project_output_path, env):
+        """Fill the wheel store with the project's requirements for one tox environment"""
+        key = build_virtualenv_key(tox_env, project_output_path, env)
+        marker_path = os.path.join(self.prefetched_path, key)
+
+        # one writer into the wheel store at a time across every process on the host
+        with file_lock(os.path.join(self.wheelhouse_path, '.lock')):
+            if os.path.exists(marker_path):
+                _LOGGER.debug("Requirements for %s are already prefetched", key)
+                return
+
+            _LOGGER.info("Prefetching requirements for %s into %s", key, self.wheelhouse_path)
+            cmd_text = "{} -m pip wheel --wheel-dir {} --find-links {} -r {}".format(
+                executable_name,
+                self.wheelhouse_path,
+                self.wheelhouse_path,
+                PipRequirementsFile.DEV_REQUIREMENTS_TXT.file_name)
+            with hold_resource_tokens(self.resource_token_pool, 1, cmd_text):
+                run_shell(cmd_text, working_path=project_output_path, env=env)
+            with open(marker_path, 'w') as marker_file:
+                marker_file.write(key)
+
+    def prepare(self, specific_test_params, project_output_path):
+        """
+        Make sure the wheel store can serve an emitted project, prefetching into it if necessary.
+
+        Arguments:
+            specific_test_params (tuple): A specific set of make test parameters
+            project_output_path (str): Path to the root directory of the emitted project
+        Returns:
+            dict: The pip environment variables to run make (and tox) in the project with
+        """
+        _LOGGER.info("Begin preparing the local package index for %s (make targets %s)",
+                     project_output_path, specific_test_params.make_targets)
+        env = read_pip_environment_from_makefile(project_output_path)
+        for tox_env in resolve_tox_envs(project_output_path):
+            executable_name = get_tox_env_executable_name(tox_env)
+            if executable_name is None or not shutilwhich.which(executable_name):
+                _LOGGER.debug("Missing interpreter %s of tox environment %s, not prefetching for it",
+                              executable_name, tox_env)
+                continue
+            self._prefetch(tox_env, executable_name, project_output_path, env)
+        _LOGGER.info("Finished preparing the local package index for %s", project_output_path)
+        return self.get_pip_environment()
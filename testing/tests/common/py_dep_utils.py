@@ -10,15 +10,13 @@ Utilities for introspecting on Python dependencies/requirements.
 
 # import core
 import collections
-import copy
+import hashlib
 import logging
 import pprint
 import os
+import re
 
 # import third party
-import pkg_resources
-import pip.download
-import pip.req.req_file
 
 # this project
 
@@ -29,6 +27,72 @@ import pip.req.req_file
 # logger
 _LOGGER = logging.getLogger(__name__)
 
+# regexes for the pieces of a pep-0508 dependency specification
+_NAME_REGEX = re.compile(r'^\s*([A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*')
+_EXTRAS_REGEX = re.compile(r'^\[\s*([^\]]*)\]\s*')
+_URL_REGEX = re.compile(r'^@\s*(\S+)\s*')
+_SPECIFIER_REGEX = re.compile(r'^(~=|===|==|!=|<=|>=|<|>)\s*([A-Za-z0-9_.*+!-]+)\s*$')
+
+# regex for the tokens of a pep-0508 environment marker
+_MARKER_TOKEN_REGEX = re.compile(
+    r'\s*(?:'
+    r'(?P<string>\'[^\']*\'|"[^"]*")|'
+    r'(?P<op>~=|===|==|!=|<=|>=|<|>|not\s+in\b|in\b)|'
+    r'(?P<bool>and\b|or\b)|'
+    r'(?P<paren>[()])|'
+    r'(?P<variable>[A-Za-z_.]+)'
+    r')')
+
+# environment marker variables, mapped to their PythonDependencyMarker field (if any)
+_MARKER_VARIABLES = {
+    'implementation_name': None,
+    'implementation_version': None,
+    'extra': None,
+    'os_name': 'os_name',
+    'os.name': 'os_name',
+    'platform_machine': 'platform_machine',
+    'platform.machine': 'platform_machine',
+    'platform_python_implementation': 'python_implementation',
+    'platform.python_implementation': 'python_implementation',
+    'python_implementation': 'python_implementation',
+    'platform_release': None,
+    'platform_system': None,
+    'platform_version': 'platform_version',
+    'platform.version': 'platform_version',
+    'python_full_version': 'python_full_version',
+    'python_version': 'python_version',
+    'sys_platform': 'sys_platform',
+    'sys.platform': 'sys_platform',
+}
+
+# requirements file options which pull in another requirements file (as constraints or not)
+_INCLUDE_OPTIONS = {
+    '-r': False,
+    '--requirement': False,
+    '-c': True,
+    '--constraint': True,
+}
+
+# requirements file options which don't change what's required (where pip finds it, how it installs
+# it), so they're skipped
+_SKIPPED_OPTIONS = frozenset([
+    '-i', '--index-url', '--extra-index-url', '--no-index', '-f', '--find-links',
+    '--trusted-host', '--pre', '--prefer-binary', '--only-binary', '--no-binary',
+    '--require-hashes',
+])
+
+# options of a single requirement (after it on its line), which don't change what's required
+_REQUIREMENT_OPTIONS = frozenset(['--hash', '--install-option', '--global-option'])
+
+# regex for requirements given as a url or a path rather than a name
+_URL_OR_PATH_REQUIREMENT_REGEX = re.compile(r'^(?:[A-Za-z][A-Za-z0-9+.-]*://|\.|/|~)')
+
+# cache of parsed requirements file lines, keyed by a hash of the file's content
+_PARSED_REQUIREMENTS_FILES = {}
+
+# cache of parsed requirement strings
+_PARSED_REQUIREMENT_STRS = {}
+
 
 #
 # classes/functions
@@ -47,7 +111,10 @@ PythonDependencyMarker = collections.namedtuple(
     ]
 )
 """
-A 'neutral' definition of a python dependency marker, reverse engineered from pip internals.
+A 'neutral' definition of a python dependency marker.
+
+Each field holds the comma separated comparisons the marker makes against that environment
+variable (e.g. "< '3.0'" for python_version), or None if the marker doesn't refer to it.
 """
 
 
@@ -61,8 +128,7 @@ PythonDependencySpecification = collections.namedtuple(
         'specifiers',
     ])
 """
-A 'neutral' definition of a Python dependency specification (pep-0508), reverse engineered from
-pip internals.
+A 'neutral' definition of a Python dependency specification (pep-0508).
 """
 
 
@@ -70,67 +136,214 @@ class PipRequirementsInspector(object):
     """
     Inspector for pip requirements
 
+    Parses pep-0508 dependency specifications and pip requirements files (including ones they
+    pull in via ``-r`` or ``-c``) without loading pip itself.  Parsed requirements files are
+    cached by content, so parsing the same file over and over is close to free.
+
     WARNING:
 
-    * Pip's authors (in their infinite wisdom) have refused to provide a solid API for
-      programmatically working with their library.
-    * So we are using their latest internal API for this testing.  And this may break in
-      the future as they change their stuff.
-    * But for now, it is a necessary evil due to the lack of other options
+    * Only the subset of the pip requirements file format used by the emitted projects is
+      understood.  Options that don't change what's required (like ``--index-url``, or ``--hash``
+      after a requirement) are skipped, while editable (``-e``), url and path requirements, and
+      any other option, raise ValueError rather than being dropped.
     """
 
     def __init__(self):
         pass
 
-    def _mint_neutral_marker(self, pip_req_marker):
-        """Mint a neutral marker from a raw pip req marker"""
-        _LOGGER.debug("Minting neutral marker from raw pip req marker: %s", pprint.pformat(
-            pip_req_marker))
-        neutral_marker = PythonDependencyMarker(
-            os_name=getattr(pip_req_marker, 'os_name', None),
-            sys_platform=getattr(pip_req_marker, 'sys_platform', None),
-            python_full_version=getattr(pip_req_marker, 'python_full_version', None),
-            python_version=getattr(pip_req_marker, 'python_version', None),
-            platform_version=getattr(pip_req_marker, 'platform_version', None),
-            platform_machine=getattr(pip_req_marker, 'platform_machine', None),
-            python_implementation=getattr(pip_req_marker, 'python_implementation', None),
-        )
+    @staticmethod
+    def _tokenize_marker(marker_str):
+        """Split an environment marker into (kind, text) tokens"""
+        tokens = []
+        position = 0
+        marker_str = marker_str.rstrip()
+        while position < len(marker_str):
+            match_obj = _MARKER_TOKEN_REGEX.match(marker_str, position)
+            if not match_obj or match_obj.end() == position:
+                raise ValueError("Invalid environment marker '{}' at position {}".format(
+                    marker_str, position))
+            kind = match_obj.lastgroup
+            tokens.append((kind, match_obj.group(kind)))
+            position = match_obj.end()
+        return tokens
+
+    def _mint_neutral_marker(self, marker_str):
+        """Mint a neutral marker from the text of an environment marker"""
+        _LOGGER.debug("Minting neutral marker from environment marker: '%s'", marker_str)
+        comparisons = collections.defaultdict(list)
+        tokens = PipRequirementsInspector._tokenize_marker(marker_str)
+        depth = 0
+        expect_expression = True
+        index = 0
+        while index < len(tokens):
+            kind, text = tokens[index]
+            if kind == 'paren' and text == '(' and expect_expression:
+                depth += 1
+                index += 1
+            elif kind == 'paren' and text == ')' and not expect_expression:
+                depth -= 1
+                if depth < 0:
+                    raise ValueError("Unbalanced parentheses in marker '{}'".format(marker_str))
+                index += 1
+            elif kind == 'bool' and not expect_expression:
+                expect_expression = True
+                index += 1
+            elif expect_expression and index + 2 < len(tokens) and \
+                    tokens[index + 1][0] == 'op':
+                (lhs_kind, lhs), (_, op), (rhs_kind, rhs) = tokens[index:index + 3]
+                if set([lhs_kind, rhs_kind]) - set(['variable', 'string']):
+                    raise ValueError("Invalid comparison in marker '{}'".format(marker_str))
+                variable, value = (lhs, rhs) if lhs_kind == 'variable' else (rhs, lhs)
+                if variable not in _MARKER_VARIABLES:
+                    raise ValueError("Unknown variable '{}' in marker '{}'".format(
+                        variable, marker_str))
+                if _MARKER_VARIABLES[variable] is not None:
+                    comparisons[_MARKER_VARIABLES[variable]].append(
+                        "{} {}".format(' '.join(op.split()), value))
+                expect_expression = False
+                index += 3
+            else:
+                raise ValueError("Invalid environment marker '{}'".format(marker_str))
+        if expect_expression or depth:
+            raise ValueError("Incomplete environment marker '{}'".format(marker_str))
+
+        neutral_marker = PythonDependencyMarker(**{
+            field_name: ', '.join(comparisons[field_name]) if field_name in comparisons
+            else None
+            for field_name in PythonDependencyMarker._fields
+        })
         return neutral_marker
 
-    def _launder_pip_req_obj(self, pip_req_obj):
-        _LOGGER.debug("Begin parsing raw pip.req object: %s", pprint.pformat(pip_req_obj))
+    def _parse_requirement(self, requirement_str, constraint=False):
+        """Parse a pep-0508 dependency specification into a neutral specification"""
+        remainder = requirement_str
+        marker_str = None
+        if ';' in remainder:
+            remainder, marker_str = remainder.split(';', 1)
+
+        # the name
+        match_obj = _NAME_REGEX.match(remainder)
+        if not match_obj:
+            raise ValueError("Invalid requirement, missing a name: '{}'".format(requirement_str))
+        name = match_obj.group(1)
+        remainder = remainder[match_obj.end():]
+
+        # the extras
+        extras = []
+        match_obj = _EXTRAS_REGEX.match(remainder)
+        if match_obj:
+            extras = [item.strip() for item in match_obj.group(1).split(',') if item.strip()]
+            remainder = remainder[match_obj.end():]
+
+        # the specifiers, either a url or (optionally parenthesized) version specifiers
+        specifiers = []
+        match_obj = _URL_REGEX.match(remainder)
+        if match_obj:
+            remainder = remainder[match_obj.end():]
+        else:
+            remainder = remainder.strip()
+            if remainder.startswith('(') and remainder.endswith(')'):
+                remainder = remainder[1:-1]
+            for item in remainder.split(',') if remainder.strip() else []:
+                spec_match_obj = _SPECIFIER_REGEX.match(item.strip())
+                if not spec_match_obj:
+                    raise ValueError("Invalid specifier '{}' in requirement: '{}'".format(
+                        item.strip(), requirement_str))
+                specifiers.append(''.join(spec_match_obj.groups()))
+            remainder = ''
+        if remainder.strip():
+            raise ValueError("Unexpected text '{}' in requirement: '{}'".format(
+                remainder.strip(), requirement_str))
+
+        # the markers
+        markers = []
+        if marker_str is not None and marker_str.strip():
+            markers.append(self._mint_neutral_marker(marker_str.strip()))
+
+        return PythonDependencySpecification(
+            name=name,
+            constraint=constraint,
+            markers=tuple(markers),
+            extras=tuple(extras),
+            specifiers=tuple(specifiers),
+        )
 
-        # launder the markers
-        neutral_markers = []
-        if pip_req_obj.markers is not None:
-            _LOGGER.debug("Laundering markers: %s", pprint.pformat(pip_req_obj.markers))
-            if isinstance(pip_req_obj.markers, collections.Iterable):
-                for marker in pip_req_obj.markers:
-                    neutral_markers.append(self._mint_neutral_marker(marker))
+    @staticmethod
+    def _iter_logical_lines(content):
+        """Iterate across the lines of a requirements file, joining continued lines and
+        dropping comments"""
+        logical_line = ''
+        for line in content.splitlines():
+            if line.endswith('\\'):
+                logical_line += line[:-1]
+                continue
+            logical_line += line
+            logical_line = re.sub(r'(^|\s)#.*$', '', logical_line).strip()
+            if logical_line:
+                yield logical_line
+            logical_line = ''
+        logical_line = re.sub(r'(^|\s)#.*$', '', logical_line).strip()
+        if logical_line:
+            yield logical_line
+
+    def _parse_requirements_content(self, content):
+        """
+        Parse the content of a single requirements file, without following includes.
+
+        Returns:
+            tuple: Of ('requirement', PythonDependencySpecification) and
+                ('include', relative path, whether it holds constraints) items
+        """
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash in _PARSED_REQUIREMENTS_FILES:
+            return _PARSED_REQUIREMENTS_FILES[content_hash]
+
+        items = []
+        for line in PipRequirementsInspector._iter_logical_lines(content):
+            if line.startswith('-'):
+                option, _, value = line.partition(' ')
+                if '=' in option:
+                    option, _, value = option.partition('=')
+                elif option[:2] in ('-r', '-c') and len(option) > 2:
+                    option, value = option[:2], option[2:]
+                if option in _INCLUDE_OPTIONS:
+                    items.append(('include', value.strip(), _INCLUDE_OPTIONS[option]))
+                elif option in _SKIPPED_OPTIONS:
+                    _LOGGER.debug("Skipping requirements file option line '%s'", line)
+                else:
+                    raise ValueError("Unsupported requirements file line: '{}'".format(line))
+                continue
+            if _URL_OR_PATH_REQUIREMENT_REGEX.match(line):
+                raise ValueError("Unsupported url or path requirement: '{}'".format(line))
+            # drop per-requirement options like --hash
+            pieces = re.split(r'\s(?=--?[A-Za-z])', ' ' + line)
+            for option_str in pieces[1:]:
+                option = re.split(r'[\s=]', option_str, maxsplit=1)[0]
+                if option not in _REQUIREMENT_OPTIONS:
+                    raise ValueError("Unsupported option '{}' of requirement: '{}'".format(
+                        option, line))
+            items.append(('requirement', self._parse_requirement(pieces[0].strip())))
+
+        _PARSED_REQUIREMENTS_FILES[content_hash] = tuple(items)
+        return _PARSED_REQUIREMENTS_FILES[content_hash]
+
+    def _collect_requirements_from_file(self, path, constraint, parsed_requirements, seen_paths):
+        """Collect the requirements from a file and the files it includes"""
+        path = os.path.abspath(path)
+        if path in seen_paths:
+            raise ValueError("Requirements file {} includes itself".format(path))
+        with open(path, 'rb') as req_file:
+            content = req_file.read()
+        for item in self._parse_requirements_content(content):
+            if item[0] == 'include':
+                _, include_path, include_is_constraint = item
+                self._collect_requirements_from_file(
+                    os.path.join(os.path.dirname(path), include_path),
+                    constraint or include_is_constraint,
+                    parsed_requirements,
+                    seen_paths | set([path]))
             else:
-                neutral_markers.append(self._mint_neutral_marker(pip_req_obj.markers))
-
-        # launder the specifiers
-        neutral_specifiers = []
-        if pip_req_obj.specifier._specs is not None:
-            _LOGGER.debug("Laundering specifiers: %s", pprint.pformat(pip_req_obj.specifier))
-            for item in pip_req_obj.specifier._specs:
-                neutral_specifiers.append(str(item))
-
-        # launder into neutral extras
-        neutral_extras = [item for item in pip_req_obj.req.extras]
-
-        # make the final deliverable
-        neutral_req = PythonDependencySpecification(
-            name=pip_req_obj.name,
-            constraint=pip_req_obj.constraint,
-            markers=neutral_markers,
-            extras=neutral_extras,
-            specifiers=neutral_specifiers,
-        )
-        _LOGGER.debug("Parsed raw pip.req object %s into %s",
-                      pprint.pformat(pip_req_obj), pprint.pformat(neutral_req))
-        return neutral_req
+                parsed_requirements.append(item[1]._replace(constraint=constraint))
 
     def parse_requirements_from_file(self, path):
         """
@@ -143,10 +356,8 @@ class PipRequirementsInspector(object):
             list: A list of PythonDependencySpecification objects
         """
         _LOGGER.debug("Begin parsing pip requirements file %s", path)
-        pip_session = pip.download.PipSession()
         parsed_requirements = []
-        for pip_req in pip.req.req_file.parse_requirements(path, session=pip_session):
-            parsed_requirements.append(self._launder_pip_req_obj(pip_req))
+        self._collect_requirements_from_file(path, False, parsed_requirements, frozenset())
 
         _LOGGER.debug("Parsed requirements from path %s are: %s",
                       path, pprint.pformat(parsed_requirements))
@@ -159,14 +370,16 @@ class PipRequirementsInspector(object):
         Parse a pip requirement from a string
 
         Arguments:
-            requirement_str (str): Path to a pip requirements text file
+            requirement_str (str): A pep-0508 dependency specification, with or without
+                parentheses around its version specifiers
 
         Returns:
             PythonDependencySpecification: The equivalent PythonDependencySpecification object
         """
         _LOGGER.debug("Begin parsing pip requirement str '%s'", requirement_str)
-        pip_req = pip.req.InstallRequirement.from_line(requirement_str)
-        parsed_requirement = self._launder_pip_req_obj(pip_req)
+        if requirement_str not in _PARSED_REQUIREMENT_STRS:
+            _PARSED_REQUIREMENT_STRS[requirement_str] = self._parse_requirement(requirement_str)
+        parsed_requirement = _PARSED_REQUIREMENT_STRS[requirement_str]
 
         _LOGGER.debug("Parsed requirement from str '%s' into %s",
                       requirement_str, pprint.pformat(parsed_requirement))
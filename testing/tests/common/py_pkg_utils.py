@@ -37,6 +37,51 @@ import wheel.util
 # logger
 _LOGGER = logging.getLogger(__name__)
 
+# memoized wheel inspections, keyed by the wheel's path, size and modification time
+_WHEEL_INSPECTIONS = {}
+
+# files to read from a wheel's dist-info sub-directory, keyed by their ParsedWheelDistInfo field
+_WHEEL_DIST_INFO_FILE_NAMES = {
+    'description_rst': 'DESCRIPTION.rst',
+    'metadata': 'METADATA',
+    'record': 'RECORD',
+    'wheel': 'WHEEL',
+    'metadata_json': 'metadata.json',
+    'top_level_txt': 'top_level.txt',
+}
+
+#
+# Immutable data helpers
+#
+
+
+class FrozenDict(collections.Mapping):
+    """Read-only dictionary"""
+
+    def __init__(self, *args, **kwargs):
+        self._data = dict(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self._data)
+
+
+def freeze(value):
+    """Recursively convert dicts and lists into their read-only equivalents"""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
 #
 # Classes for Python package inspection
 #
@@ -107,12 +152,24 @@ ParsedWheelDistInfo = collections.namedtuple(
 Parsed data files this sub-directory in the wheel zip file : {project-name}-{version}.dist-info
 
 Arguments:
-    description_rst (list): List of lines (as str) from the DESCRIPTION.rst file
-    metadata (list): List of lines (as str) from the METADATA file
-    record (list): List of lines (as str) from the RECORD file
-    wheel (list): List of lines (as str) from the WHEEL file
-    metadata_json (dict): Parsed JSON data from the metadata.json file
-    top_level_txt (list): List of lines (as str) from the top_level.txt file
+    description_rst (tuple): Lines (as str) from the DESCRIPTION.rst file
+    metadata (tuple): Lines (as str) from the METADATA file
+    record (tuple): Lines (as str) from the RECORD file
+    wheel (tuple): Lines (as str) from the WHEEL file
+    metadata_json (FrozenDict): Parsed JSON data from the metadata.json file
+    top_level_txt (tuple): Lines (as str) from the top_level.txt file
+"""
+
+WheelInspection = collections.namedtuple(
+    'WheelInspection',
+    ['meta_data', 'attributes', 'dist_info'])
+"""
+Everything learned from inspecting a wheel file in a single pass.
+
+Arguments:
+    meta_data (PackageFileMetaData): Meta-data from the wheel's file name
+    attributes (ParsedWheelAttributes): Parsed wheel attributes
+    dist_info (ParsedWheelDistInfo): Parsed data files from the wheel's dist-info sub-directory
 """
 
 
@@ -219,27 +276,8 @@ class PackageInspector(object):
         return is_wheel
 
     @staticmethod
-    def parse_wheel_attributes(package_path):
-        """
-        Use `wheel.install.WheelFile` to parse the wheel "attributes"
-
-        Arguments:
-            package_path (str): Path to the package file to be inspected.
-        Returns:
-             ParsedWheelAttributes: tuple bucket with output from parsing the
-                wheel attributes
-        Raises:
-            Exception: If package is not in wheel format, or just plain broken.
-        """
-        _LOGGER.debug("Begin parsing wheel attributes from %s", package_path)
-
-        # first make sure its a wheel at all
-        assert PackageInspector.is_wheel(package_path), \
-            "devpi-common metadata for package {} has file type that is not wheel".format(
-                package_path)
-
-        # now extract stuff
-        wheel_file = wheel.install.WheelFile(package_path)
+    def _normalize_wheel_attributes(wheel_file):
+        """Convert the attributes of a `wheel.install.WheelFile` into plain (immutable) data"""
 
         # convert compatibility tags
         normalized_compatibility_tags = next(wheel_file.compatibility_tags)
@@ -263,99 +301,118 @@ class PackageInspector(object):
                     normalized_parsed_wheel_info[key] = []
                 normalized_parsed_wheel_info[key].append(value.strip())
 
-        # final result
-        result = ParsedWheelAttributes(
+        return ParsedWheelAttributes(
             arity=wheel_file.arity,
             compatibility_tags=normalized_compatibility_tags,
             datadir_name=wheel_file.datadir_name,
             distinfo_name=wheel_file.distinfo_name,
-            install_paths=wheel_file.install_paths,
-            parsed_filename=normalized_parsed_filename,
-            parsed_wheel_info=normalized_parsed_wheel_info,
+            install_paths=freeze(wheel_file.install_paths),
+            parsed_filename=freeze(normalized_parsed_filename),
+            parsed_wheel_info=freeze(normalized_parsed_wheel_info),
             record_name=wheel_file.record_name,
             tags=normalized_tags,
             wheelinfo_name=wheel_file.wheelinfo_name,
         )
-        _LOGGER.debug("Parsed these wheel attributes from %s:\n%s",
-                      package_path, pprint.pformat(result))
-
-        # done
-        _LOGGER.debug("Finished parsing wheel attributes from %s", package_path)
-        return result
 
     @staticmethod
-    def parse_wheel_dist_info(package_path):
+    def inspect_wheel(package_path):
         """
-        Peeks in the wheel file (as a zip archive), and extracts contents the `*dist-info`
-        sub-directory.
+        Inspect a wheel in a single pass: one read of its file name meta-data, one opening of
+        the wheel (as a zip archive) and one sweep over its `*dist-info` sub-directory.
+
+        Results are memoized by path, size and modification time of the wheel, so repeated
+        inspections of an unchanged wheel are free.
 
         Arguments:
             package_path (str): Path to the package file to be inspected.
         Returns:
-             ParsedWheelDistInfo: tuple bucket with output from parsing the
-                wheel dist-info directory
+             WheelInspection: immutable tuple bucket with everything learned about the wheel
         Raises:
             Exception: If package is not in wheel format, or just plain broken.
         """
-        _LOGGER.debug("Begin parsing wheel dist info files from %s", package_path)
+        # verify the file exists etc.
+        package_path = os.path.abspath(package_path)
+        if not os.path.exists(package_path):
+            raise Exception("Package path '{}' does not exist".format(package_path))
+        stat_result = os.stat(package_path)
+        memo_key = (package_path, stat_result.st_size, stat_result.st_mtime)
+        if memo_key in _WHEEL_INSPECTIONS:
+            _LOGGER.debug("Re-using the inspection of the unchanged wheel %s", package_path)
+            return _WHEEL_INSPECTIONS[memo_key]
+
+        _LOGGER.debug("Begin inspecting wheel %s", package_path)
 
         # first make sure its a wheel at all
-        assert PackageInspector.is_wheel(package_path), \
+        meta_data = PackageInspector.get_meta_data(package_path)
+        assert meta_data.file_type == 'bdist_wheel', \
             "devpi-common metadata for package {} has file type that is not wheel".format(
                 package_path)
 
-        # parse the wheel attributes to get the dist-info sub-directory name
-        parsed_wheel_attributes = PackageInspector.parse_wheel_attributes(package_path)
-        dist_info_dir = parsed_wheel_attributes.distinfo_name
+        # the dist-info sub-directory name comes from the file name alone
+        wheel_file = wheel.install.WheelFile(package_path)
+        dist_info_dir = wheel_file.distinfo_name
         _LOGGER.debug("Looking for this dist info sub-dir in the package wheel: %s", dist_info_dir)
 
-        # setup the mapping between data names and the original data file names
-        data_to_filename_lookup = {
-            'description_rst': '{}/DESCRIPTION.rst'.format(dist_info_dir),
-            'metadata': '{}/METADATA'.format(dist_info_dir),
-            'record': '{}/RECORD'.format(dist_info_dir),
-            'wheel': '{}/WHEEL'.format(dist_info_dir),
-            'metadata_json': '{}/metadata.json'.format(dist_info_dir),
-            'top_level_txt': '{}/top_level.txt'.format(dist_info_dir),
-        }
-
-        # read the raw data
-        _LOGGER.debug("Begin reading all the raw dist-info data")
+        # read every dist-info file we care about in one sweep
         raw_data = {}
         with zipfile.ZipFile(package_path, 'r') as zip_file:
-            _LOGGER.debug("Found these top-level files in the package %s: %s",
-                          package_path,
-                          pprint.pformat([item.filename for item in zip_file.filelist]))
-            for data_name, zip_file_path in data_to_filename_lookup.items():
-                data_file_zip_info = zip_file.getinfo(zip_file_path)
-                _LOGGER.debug("Begin reading raw data from %s", zip_file_path)
-                with zip_file.open(data_file_zip_info, 'r') as data_file:
-                    raw_data[data_name] = data_file.read()
-                _LOGGER.debug("Finished reading raw data from %s", zip_file_path)
-        _LOGGER.debug("Finished reading all the raw dist-info data")
-
-        # normalize the raw data
-        _LOGGER.debug("Begin normalizing the raw dist-info data")
+            member_names = set(zip_file.namelist())
+            _LOGGER.debug("Found these files in the package %s: %s", package_path,
+                          pprint.pformat(sorted(member_names)))
+            for data_name, file_name in _WHEEL_DIST_INFO_FILE_NAMES.items():
+                zip_file_path = '{}/{}'.format(dist_info_dir, file_name)
+                if zip_file_path not in member_names:
+                    raise Exception("Missing dist-info file {} in wheel {}".format(
+                        zip_file_path, package_path))
+                raw_data[data_name] = zip_file.read(zip_file_path)
+
+        # hand the WHEEL file to the wheel file parser, so it doesn't re-open the archive
+        wheel_file.parsed_wheel_info = wheel.pkginfo.read_pkg_info_bytes(raw_data['wheel'])
+        attributes = PackageInspector._normalize_wheel_attributes(wheel_file)
+
+        # do some rudimentary normalization on some of the pieces of data
         normalized_data = {}
-        for data_name, filename in data_to_filename_lookup.items():
-            _LOGGER.debug("Begin normalizing %s data from original file %s", data_name, filename)
-            # bail out if you didn't find raw data for this
-            if data_name not in raw_data:
-                raise Exception(
-                    "Missing dataset {} in read raw data. Found datasets were {}".format(
-                        data_name, str(raw_data.keys())))
-
-            # do some rudimentary normalization on some of the pieces of data
+        for data_name, raw_value in raw_data.items():
             if data_name == 'metadata_json':
-                normalized_data[data_name] = json.loads(raw_data[data_name])
+                normalized_data[data_name] = freeze(json.loads(raw_value))
             else:
-                normalized_data[data_name] = raw_data[data_name].splitlines()
-            _LOGGER.debug("Finished normalizing %s data from original file %s", data_name, filename)
-        _LOGGER.debug("Finished normalizing the raw dist-info data")
+                normalized_data[data_name] = tuple(raw_value.splitlines())
+        dist_info = ParsedWheelDistInfo(**normalized_data)
 
-        # mint a named tuple and return
-        result = ParsedWheelDistInfo(**normalized_data)
-        _LOGGER.debug("Parsed wheel dist info from %s is\n%s", package_path, pprint.pformat(result))
+        result = WheelInspection(meta_data=meta_data, attributes=attributes, dist_info=dist_info)
+        _LOGGER.debug("Inspection of wheel %s is\n%s", package_path, pprint.pformat(result))
+        _WHEEL_INSPECTIONS[memo_key] = result
 
-        _LOGGER.debug("Finished parsing wheel dist info files from %s", package_path)
+        _LOGGER.debug("Finished inspecting wheel %s", package_path)
         return result
+
+    @staticmethod
+    def parse_wheel_attributes(package_path):
+        """
+        Use `wheel.install.WheelFile` to parse the wheel "attributes"
+
+        Arguments:
+            package_path (str): Path to the package file to be inspected.
+        Returns:
+             ParsedWheelAttributes: tuple bucket with output from parsing the
+                wheel attributes
+        Raises:
+            Exception: If package is not in wheel format, or just plain broken.
+        """
+        return PackageInspector.inspect_wheel(package_path).attributes
+
+    @staticmethod
+    def parse_wheel_dist_info(package_path):
+        """
+        Peeks in the wheel file (as a zip archive), and extracts contents the `*dist-info`
+        sub-directory.
+
+        Arguments:
+            package_path (str): Path to the package file to be inspected.
+        Returns:
+             ParsedWheelDistInfo: tuple bucket with output from parsing the
+                wheel dist-info directory
+        Raises:
+            Exception: If package is not in wheel format, or just plain broken.
+        """
+        return PackageInspector.inspect_wheel(package_path).dist_info
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for sharing the host's CPUs and memory amongst concurrent heavy phases of tests
+"""
+
+#
+# Imports
+#
+
+# import core
+import contextlib
+import errno
+import fcntl
+import logging
+import multiprocessing
+import os
+import time
+
+# import third party
+
+# this project
+from tests.common.misc_utils import (
+    file_lock,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# memory set aside for each resource token (a tox virtualenv build, a sphinx build, etc.)
+MEMORY_PER_TOKEN_BYTES = 1024 * 1024 * 1024
+
+# seconds between attempts at picking up more tokens
+_POLL_SECONDS = 0.25
+
+
+#
+# Functions
+#
+
+def get_available_memory_bytes():
+    """Get the memory available to start new processes without swapping, or None if unknown"""
+    try:
+        with open('/proc/meminfo', 'r') as meminfo_file:
+            for line in meminfo_file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        _LOGGER.debug("Unable to read the available memory from /proc/meminfo")
+    return None
+
+
+def compute_token_capacity(cpu_count=None, available_memory_bytes=None):
+    """
+    Compute how many resource tokens the host has: one per CPU, as long as there's the memory.
+
+    Arguments:
+        cpu_count (int): Number of CPUs (default: those of this host)
+        available_memory_bytes (int): Available memory (default: that of this host, right now)
+    Returns:
+        int: Number of tokens, at least one
+    """
+    if cpu_count is None:
+        cpu_count = multiprocessing.cpu_count()
+    if available_memory_bytes is None:
+        available_memory_bytes = get_available_memory_bytes()
+    capacity = cpu_count
+    if available_memory_bytes is not None:
+        capacity = min(capacity, available_memory_bytes // MEMORY_PER_TOKEN_BYTES)
+    return max(1, int(capacity))
+
+
+@contextlib.contextmanager
+def hold_resource_tokens(resource_token_pool, weight, purpose):
+    """
+    Context manager holding tokens from a resource token pool, if there is one.
+
+    Yields:
+        float: Seconds spent waiting for the tokens
+    """
+    if resource_token_pool is None:
+        yield 0.0
+        return
+    with resource_token_pool.tokens(weight, purpose) as waited_seconds:
+        yield waited_seconds
+
+
+#
+# Classes
+#
+
+class ResourceTokenPool(object):
+    """
+    Host-wide pool of resource tokens, which heavy phases of tests hold while they run.
+
+    Each token is a slot file, held with an exclusive `flock`, so every process on the host (every
+    xdist worker, and every concurrent test session) shares the pool.  The kernel releases a dead
+    process's tokens.  Heavier phases hold more tokens at once, and at most one process at a time
+    gathers tokens, so a heavy phase isn't starved by a stream of lighter ones.
+    """
+
+    def __init__(self, pool_root_path, capacity):
+        """
+        Arguments:
+            pool_root_path (str): Directory holding the slot files
+            capacity (int): Number of tokens in the pool (see compute_token_capacity)
+        """
+        assert capacity > 0
+        self.pool_root_path = os.path.abspath(pool_root_path)
+        self.capacity = capacity
+        if not os.path.exists(self.pool_root_path):
+            try:
+                os.makedirs(self.pool_root_path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+    def _try_slot(self, index):
+        """Get the open slot file if its token was free (and is now held), else None"""
+        slot_file = open(os.path.join(self.pool_root_path, "slot-{}.lock".format(index)), 'a')
+        try:
+            fcntl.flock(slot_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as error:
+            slot_file.close()
+            if error.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return None
+        return slot_file
+
+    @contextlib.contextmanager
+    def tokens(self, weight, purpose):
+        """
+        Context manager holding tokens for a phase, waiting until they're free.
+
+        Arguments:
+            weight (int): Number of tokens the phase needs (capped at the pool's capacity, and
+                phases that need none don't wait)
+            purpose (str): What the tokens are for, for the log
+        Yields:
+            float: Seconds spent waiting for the tokens
+        """
+        weight = min(weight, self.capacity)
+        if weight <= 0:
+            yield 0.0
+            return
+
+        start_time = time.time()
+        slot_files = {}
+        try:
+            with file_lock(os.path.join(self.pool_root_path, 'queue.lock')):
+                while True:
+                    for index in range(self.capacity):
+                        if len(slot_files) == weight:
+                            break
+                        if index not in slot_files:
+                            slot_file = self._try_slot(index)
+                            if slot_file is not None:
+                                slot_files[index] = slot_file
+                    if len(slot_files) == weight:
+                        break
+                    time.sleep(_POLL_SECONDS)
+            waited_seconds = time.time() - start_time
+            _LOGGER.info("Holding %d of %d resource tokens for '%s' (waited %.1f seconds)",
+                         weight, self.capacity, purpose, waited_seconds)
+            yield waited_seconds
+        finally:
+            for slot_file in slot_files.values():
+                fcntl.flock(slot_file.fileno(), fcntl.LOCK_UN)
+                slot_file.close()
+            if slot_files:
+                _LOGGER.debug("Released %d resource tokens for '%s'", len(slot_files), purpose)
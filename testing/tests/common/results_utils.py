@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for keeping the results of every test session, and holding them to performance budgets
+"""
+
+#
+# Imports
+#
+
+# import core
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+# import third party
+import ruamel.yaml as yaml
+
+# this project
+import tests
+from tests.common.log_utils import (
+    get_log_parts_path,
+    merge_log_parts,
+)
+from tests.common.misc_utils import (
+    compute_median,
+)
+from tests.common.timing_utils import (
+    PhaseTimingCollector,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# tables of the results database
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    host TEXT NOT NULL,
+    command_line TEXT NOT NULL,
+    template_digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    nodeid TEXT NOT NULL,
+    params TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    total_seconds REAL NOT NULL,
+    worker TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_nodeid ON results (nodeid, session_id);
+CREATE TABLE IF NOT EXISTS phases (
+    result_id INTEGER NOT NULL REFERENCES results (id),
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    result_id INTEGER NOT NULL REFERENCES results (id),
+    name TEXT NOT NULL,
+    value REAL NOT NULL
+);
+"""
+
+# settings of the regression checks, unless the budgets file says otherwise
+_DEFAULT_REGRESSION_SETTINGS = {
+    # how many of the latest earlier sessions (that passed the test) the baseline comes from
+    'history': 5,
+    # fewest earlier sessions there must be to check against the baseline at all
+    'min_history': 3,
+    # how much worse than the baseline (as a fraction of it) is a regression
+    'tolerance': 0.25,
+    # phases shorter than this are too noisy to flag
+    'min_seconds': 5.0,
+    # measurements, besides the phases, to check for regressions
+    'measurements': [],
+}
+
+
+#
+# Functions
+#
+
+def load_budgets(yaml_path):
+    """
+    Load the performance budgets from a YAML file.
+
+    The file has a list of `budgets`, each capping either how long a phase of the matching tests
+    takes (`phase` and `max_seconds`) or one of their measurements (`measurement` and `max_value`).
+    A budget's `match` names the test params it applies to, and it applies to every test without
+    one.  The optional `regression` settings are for flagging tests that got slower (or bigger)
+    than they were in earlier sessions.
+
+    Arguments:
+        yaml_path (str): Path to the YAML file
+    Returns:
+        dict: With the keys 'budgets' (list) and 'regression' (dict)
+    """
+    with open(yaml_path, 'r') as yaml_file:
+        data = yaml.YAML(typ='safe').load(yaml_file) or {}
+
+    regression_settings = dict(_DEFAULT_REGRESSION_SETTINGS)
+    regression_settings.update(data.get('regression') or {})
+    budgets = data.get('budgets') or []
+    for index, budget in enumerate(budgets):
+        assert 'description' in budget, "Budget #{} in {} has no description".format(
+            index, yaml_path)
+        assert ('phase' in budget and 'max_seconds' in budget) != \
+            ('measurement' in budget and 'max_value' in budget), \
+            "Budget '{}' in {} needs either a phase and max_seconds or a measurement and " \
+            "max_value".format(budget['description'], yaml_path)
+    return {'budgets': budgets, 'regression': regression_settings}
+
+
+def _matches(match, params):
+    """Whether a test's params have every value the budget's match names"""
+    for field_name, value in (match or {}).items():
+        if params.get(field_name) != value:
+            return False
+    return True
+
+
+def check_budgets(results_database, budgets, session_id):
+    """
+    Check the results of a test session against the performance budgets and earlier sessions.
+
+    Arguments:
+        results_database (ResultsDatabase): The database holding the results
+        budgets (dict): The budgets, as loaded by `load_budgets`
+        session_id (int): The session to check
+    Returns:
+        list: Text describing each violation (empty if there are none)
+    """
+    regression_settings = budgets['regression']
+    violations = []
+    for result in results_database.get_session_results(session_id):
+        for budget in budgets['budgets']:
+            if not _matches(budget.get('match'), result['params']):
+                continue
+            if 'phase' in budget:
+                seconds = result['phases'].get(budget['phase'])
+                if seconds is not None and seconds > budget['max_seconds']:
+                    violations.append(
+                        "{}: phase '{}' took {:.1f}s, over its budget of {}s ({})".format(
+                            result['nodeid'], budget['phase'], seconds, budget['max_seconds'],
+                            budget['description']))
+            else:
+                value = result['measurements'].get(budget['measurement'])
+                if value is not None and value > budget['max_value']:
+                    violations.append(
+                        "{}: {} is {:g}, over its budget of {:g} ({})".format(
+                            result['nodeid'], budget['measurement'], value, budget['max_value'],
+                            budget['description']))
+
+        if result['outcome'] != 'passed':
+            continue
+        history = results_database.get_history(
+            result['nodeid'], session_id, regression_settings['history'])
+        if len(history) < regression_settings['min_history']:
+            continue
+        checks = [('phase', name, seconds, [earlier['phases'].get(name) for earlier in history])
+                  for name, seconds in result['phases'].items()
+                  if seconds >= regression_settings['min_seconds']]
+        checks.extend(
+            ('measurement', name, result['measurements'][name],
+             [earlier['measurements'].get(name) for earlier in history])
+            for name in regression_settings['measurements'] if name in result['measurements'])
+        for kind, name, value, earlier_values in checks:
+            earlier_values = [earlier for earlier in earlier_values if earlier is not None]
+            if len(earlier_values) < regression_settings['min_history']:
+                continue
+            baseline = compute_median(earlier_values)
+            if baseline > 0 and value > baseline * (1 + regression_settings['tolerance']):
+                violations.append(
+                    "{}: {} '{}' is {:.0%} worse than its median of {:g} over the last {} "
+                    "sessions, at {:g}".format(
+                        result['nodeid'], kind, name, value / baseline - 1, baseline,
+                        len(earlier_values), value))
+    return violations
+
+
+def main(argv=None):
+    """Report the results of a test session, flagging performance budget violations"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        '--database', required=True, help="Path to the results database")
+    parser.add_argument(
+        '--budgets', required=True, help="Path to the performance budgets YAML file")
+    parser.add_argument(
+        '--session', type=int, default=None,
+        help="Id of the session to report on (default: the latest)")
+    args = parser.parse_args(argv)
+
+    results_database = ResultsDatabase(args.database)
+    session_id = args.session
+    if session_id is None:
+        session_id = results_database.get_latest_session_id()
+    if session_id is None:
+        print("No test sessions recorded in {}".format(args.database))
+        return 0
+
+    session = results_database.get_session(session_id)
+    results = results_database.get_session_results(session_id)
+    print("Session {} started at {} on {} (template digest {})".format(
+        session_id, session['started_at'], session['host'], session['template_digest'][:12]))
+    print("  {}".format(session['command_line']))
+    for outcome in sorted(set(result['outcome'] for result in results)):
+        print("  {} {}".format(
+            len([result for result in results if result['outcome'] == outcome]), outcome))
+
+    violations = check_budgets(results_database, load_budgets(args.budgets), session_id)
+    if not violations:
+        print("No performance budget violations")
+        return 0
+    print("{} performance budget violations:".format(len(violations)))
+    for violation in violations:
+        print("  {}".format(violation))
+    return 1
+
+
+#
+# Classes
+#
+
+class ResultsDatabase(object):
+    """
+    SQLite database of the results of every test session.
+
+    Each session records its template digest, and each test its params, outcome, phase durations
+    and measurements (like the exit status of make, or the size of the wheel it built).
+    """
+
+    def __init__(self, sqlite_path):
+        self.sqlite_path = os.path.abspath(sqlite_path)
+        connection = self._connect()
+        try:
+            connection.executescript(_SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # concurrent sessions wait on each other's writes rather than fail
+        connection = sqlite3.connect(self.sqlite_path, timeout=60)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def record_session(self, template_digest, records):
+        """
+        Record the results of a test session.
+
+        Arguments:
+            template_digest (str): Digest of the template the session tested
+            records (list): The phase timing records of the tests (see PhaseTimingCollector)
+        Returns:
+            int: The id of the session
+        """
+        _LOGGER.debug("Begin recording %d results in %s", len(records), self.sqlite_path)
+        connection = self._connect()
+        try:
+            with connection:
+                session_id = connection.execute(
+                    "INSERT INTO sessions (started_at, host, command_line, template_digest) "
+                    "VALUES (?, ?, ?, ?)",
+                    (time.strftime('%Y-%m-%d %H:%M:%S'), socket.gethostname(), ' '.join(sys.argv),
+                     template_digest)).lastrowid
+                for record in records:
+                    result_id = connection.execute(
+                        "INSERT INTO results "
+                        "(session_id, nodeid, params, outcome, total_seconds, worker) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (session_id, record['nodeid'],
+                         json.dumps(record.get('params', {}), sort_keys=True), record['outcome'],
+                         record['total_seconds'], record['worker'])).lastrowid
+                    connection.executemany(
+                        "INSERT INTO phases (result_id, position, name, seconds) "
+                        "VALUES (?, ?, ?, ?)",
+                        [(result_id, position, phase['name'], phase['seconds'])
+                         for position, phase in enumerate(record['phases'])])
+                    connection.executemany(
+                        "INSERT INTO measurements (result_id, name, value) VALUES (?, ?, ?)",
+                        [(result_id, name, value)
+                         for name, value in sorted(record.get('measurements', {}).items())])
+        finally:
+            connection.close()
+        _LOGGER.debug("Finished recording results as session %d", session_id)
+        return session_id
+
+    def get_latest_session_id(self):
+        """Get the id of the latest session, or None if there are none"""
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT MAX(id) FROM sessions").fetchone()[0]
+        finally:
+            connection.close()
+
+    def get_session(self, session_id):
+        """Get a session's row as a dict"""
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        finally:
+            connection.close()
+        assert row is not None, "No session {} in {}".format(session_id, self.sqlite_path)
+        return dict(zip(row.keys(), row))
+
+    def _get_results(self, where_clause, where_args):
+        """Get results, each a dict with its phases and measurements, in session order"""
+        connection = self._connect()
+        try:
+            results = []
+            for row in connection.execute(
+                    "SELECT * FROM results WHERE {} ORDER BY session_id DESC, id".format(
+                        where_clause), where_args).fetchall():
+                result = dict(zip(row.keys(), row))
+                result['params'] = json.loads(result['params'])
+                result['phases'] = dict(
+                    (phase_row['name'], phase_row['seconds']) for phase_row in connection.execute(
+                        "SELECT name, seconds FROM phases WHERE result_id = ? ORDER BY position",
+                        (result['id'],)))
+                result['measurements'] = dict(
+                    (measurement_row['name'], measurement_row['value'])
+                    for measurement_row in connection.execute(
+                        "SELECT name, value FROM measurements WHERE result_id = ?",
+                        (result['id'],)))
+                results.append(result)
+            return results
+        finally:
+            connection.close()
+
+    def get_session_results(self, session_id):
+        """Get the results of every test in a session"""
+        return self._get_results("session_id = ?", (session_id,))
+
+    def get_history(self, nodeid, before_session_id, count):
+        """Get the passing results of a test from the latest sessions before a session"""
+        return self._get_results(
+            "nodeid = ? AND session_id < ? AND outcome = 'passed' "
+            "AND session_id IN (SELECT DISTINCT session_id FROM results WHERE nodeid = ? AND "
+            "session_id < ? AND outcome = 'passed' ORDER BY session_id DESC LIMIT ?)",
+            (nodeid, before_session_id, nodeid, before_session_id, count))
+
+
+class ResultsRecorder(object):
+    """
+    Pytest plugin recording the results of the test session into the results database.
+
+    It picks up the phase timing record every test's call report carries (see
+    PhaseTimingCollector), so it only runs in the process that isn't an xdist worker.  Tests that
+    time no phases are recorded all the same, without phases.  The terminal summary then lists the
+    performance budget violations of the session.
+    """
+
+    def __init__(self, results_database, template_digest, budgets):
+        """
+        Arguments:
+            results_database (ResultsDatabase): The database to record into
+            template_digest (str): Digest of the template the session tests
+            budgets (dict): The performance budgets, as loaded by `load_budgets`, or None to not
+                check any
+        """
+        self.results_database = results_database
+        self.template_digest = template_digest
+        self.budgets = budgets
+        self.session_id = None
+        self._records = []
+
+    def pytest_runtest_logreport(self, report):
+        """Pick up the phase timing record attached to a test report"""
+        if report.when != 'call':
+            return
+        record = PhaseTimingCollector.get_record(report)
+        if record is not None:
+            self._records.append(record)
+
+    def pytest_sessionfinish(self):
+        """Record the session's results"""
+        if self._records:
+            self.session_id = self.results_database.record_session(
+                self.template_digest, self._records)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        """List the performance budget violations of the session"""
+        if self.session_id is None or self.budgets is None:
+            return
+        violations = check_budgets(self.results_database, self.budgets, self.session_id)
+        terminalreporter.write_sep('=', 'performance budget violations: {}'.format(len(violations)))
+        for violation in violations:
+            terminalreporter.write_line(violation)
+        terminalreporter.write_line("Results of this session are session {} in {}".format(
+            self.session_id, self.results_database.sqlite_path))
+
+
+if __name__ == '__main__':
+    EXIT_STATUS = main()
+    # write out and merge the log part of this process, like the pytest_sessionfinish hook does
+    if tests.LOG_PART_LISTENER is not None:
+        tests.LOG_PART_LISTENER.stop()
+        LOG_FILE_PATH = os.path.abspath(os.environ['PYTEST_LOG_PATH'])
+        merge_log_parts(get_log_parts_path(LOG_FILE_PATH), LOG_FILE_PATH)
+    sys.exit(EXIT_STATUS)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for spreading tests across xdist workers and CI hosts, using how long they took before
+"""
+
+#
+# Imports
+#
+
+# import core
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+# import third party
+import pytest
+import xdist.dsession
+
+# this project
+from tests.common.misc_utils import (
+    compute_median,
+    file_lock,
+)
+from tests.common.output_utils import (
+    OutputDirectoryManager,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+
+#
+# Functions
+#
+
+def _get_test_function_id(nodeid):
+    """Get the node id of the test function a (possibly parametrized) test belongs to"""
+    return nodeid.split('[', 1)[0]
+
+
+def estimate_durations(nodeids, durations):
+    """
+    Estimate how long each test takes, from the durations of earlier runs.
+
+    Tests without a recorded duration get the median duration of the other parametrizations of
+    the same test function, or failing that the median of every recorded duration.
+
+    Arguments:
+        nodeids (list): The node ids of the tests to estimate
+        durations (dict): Recorded durations in seconds, keyed by node id
+    Returns:
+        dict: Estimated durations in seconds, keyed by node id
+    """
+    function_durations = collections.defaultdict(list)
+    for nodeid, seconds in durations.items():
+        function_durations[_get_test_function_id(nodeid)].append(seconds)
+    overall_estimate = compute_median(list(durations.values())) if durations else 0.0
+
+    estimates = {}
+    for nodeid in nodeids:
+        if nodeid in durations:
+            estimates[nodeid] = durations[nodeid]
+        elif function_durations.get(_get_test_function_id(nodeid)):
+            estimates[nodeid] = compute_median(function_durations[_get_test_function_id(nodeid)])
+        else:
+            estimates[nodeid] = overall_estimate
+    return estimates
+
+
+def build_shard_key(item):
+    """
+    Build a key for a test which is the same on every host, whatever order the tests collect in.
+
+    Parametrized tests are keyed by their node id plus the full hash of their specific test
+    params, since their human facing arg ids only carry a short hash.
+
+    Arguments:
+        item (pytest.Item): The collected test
+    Returns:
+        str: Hex digest
+    """
+    callspec = getattr(item, 'callspec', None)
+    specific_test_params = callspec.params.get('specific_test_params') if callspec else None
+    if specific_test_params is not None:
+        key_text = "{}::{}".format(
+            item.nodeid, OutputDirectoryManager.build_params_hash(specific_test_params))
+    else:
+        key_text = item.nodeid
+    return hashlib.sha256(key_text).hexdigest()
+
+
+def assign_shards(shard_keys, shard_count, estimates=None):
+    """
+    Partition tests into shards, the same way on every host.
+
+    Tests are dealt in order of their keys, or longest expected first if there are estimates, to
+    whichever shard has the least expected time and then the fewest tests.  So without estimates
+    the shards differ by at most one test, and with them they take roughly equally long.
+
+    Arguments:
+        shard_keys (list): The shard keys of the tests (see build_shard_key)
+        shard_count (int): The number of shards
+        estimates (dict): Optional expected durations in seconds, keyed by shard key
+    Returns:
+        dict: Shard indices keyed by shard key
+    """
+    assert shard_count > 0
+    estimates = estimates or {}
+    loads = [(0.0, 0, index) for index in range(shard_count)]
+    assignments = {}
+    for key in sorted(shard_keys, key=lambda key: (-estimates.get(key, 0.0), key)):
+        seconds, count, index = min(loads)
+        assignments[key] = index
+        loads[index] = (seconds + estimates.get(key, 0.0), count + 1, index)
+    return assignments
+
+
+#
+# Classes
+#
+
+class TestDurationStore(object):
+    """Per-test durations from earlier test sessions, persisted as a JSON file"""
+
+    def __init__(self, json_path):
+        self.json_path = os.path.abspath(json_path)
+
+    def load(self):
+        """Get the recorded durations in seconds keyed by node id (empty if there are none)"""
+        if not os.path.exists(self.json_path):
+            return {}
+        try:
+            with open(self.json_path, 'r') as json_file:
+                return json.load(json_file)
+        except ValueError:
+            _LOGGER.warning("Ignoring unreadable test durations in %s", self.json_path)
+            return {}
+
+    def update(self, durations):
+        """Merge newly recorded durations into the store, replacing older ones of the same tests"""
+        _LOGGER.debug("Begin recording %d test durations in %s", len(durations), self.json_path)
+        with file_lock("{}.lock".format(self.json_path)):
+            merged = self.load()
+            merged.update(durations)
+            file_descriptor, scratch_path = tempfile.mkstemp(
+                prefix='.scratch-', dir=os.path.dirname(self.json_path))
+            with os.fdopen(file_descriptor, 'w') as json_file:
+                json.dump(merged, json_file, indent=2, sort_keys=True)
+            os.rename(scratch_path, self.json_path)
+        _LOGGER.debug("Finished recording test durations")
+
+
+class DurationAwareLoadScheduling(xdist.dsession.LoadScheduling):
+    """
+    Xdist load scheduling which hands out tests one at a time, in collection order.
+
+    The workers collect the tests longest expected first (see DurationAwareScheduling), so
+    this dispatches them longest-processing-time first: whichever worker frees up next gets the
+    longest of the remaining tests.
+    """
+
+    # tests queued on each worker, a worker only starts a test once it knows the next one
+    NODE_QUEUE_DEPTH = 2
+
+    def init_distribute(self):
+        assert self.collection_is_completed
+        if self.collection is not None:
+            for node in self.nodes:
+                self.check_schedule(node)
+            return
+
+        if not self._check_nodes_have_same_collection():
+            self.log('**Different tests collected, aborting run**')
+            return
+
+        self.collection = list(self.node2collection.values())[0]
+        self.pending[:] = range(len(self.collection))
+        if not self.collection:
+            return
+
+        for node in self.nodes:
+            self._send_tests(node, DurationAwareLoadScheduling.NODE_QUEUE_DEPTH)
+        if not self.pending:
+            for node in self.nodes:
+                node.shutdown()
+
+    def check_schedule(self, node, duration=0):
+        if node.shutting_down:
+            return
+        if self.pending:
+            self._send_tests(
+                node, DurationAwareLoadScheduling.NODE_QUEUE_DEPTH - len(self.node2pending[node]))
+        self.log("num items waiting for node:", len(self.pending))
+
+
+class DurationAwareScheduling(object):
+    """
+    Pytest plugin scheduling xdist runs by the test durations recorded in earlier runs.
+
+    The master records how long every test took into the duration store, and hands the recorded
+    durations to the workers, which order their collections longest expected first.  The master
+    then dispatches tests one at a time with DurationAwareLoadScheduling.
+    """
+
+    # key of the recorded durations in the xdist worker input
+    SLAVEINPUT_KEY = 'test_durations'
+
+    def __init__(self, duration_store, config):
+        self.duration_store = duration_store
+        self.is_worker = hasattr(config, 'slaveinput')
+        # loaded once, and handed to every worker as is
+        self._durations = duration_store.load() if not self.is_worker else None
+        self._recorded = {}
+        self._skipped_nodeids = set()
+        if not self.is_worker and getattr(config.option, 'dist', 'no') == 'load':
+            _LOGGER.debug("Scheduling xdist load runs with %s",
+                          DurationAwareLoadScheduling.__name__)
+            xdist.dsession.LoadScheduling = DurationAwareLoadScheduling
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_configure_node(self, node):
+        """Hand the recorded test durations to an xdist worker"""
+        node.slaveinput[DurationAwareScheduling.SLAVEINPUT_KEY] = self._durations
+
+    def pytest_collection_modifyitems(self, config, items):
+        """Order an xdist worker's collection longest expected first"""
+        if not self.is_worker:
+            return
+        durations = config.slaveinput.get(DurationAwareScheduling.SLAVEINPUT_KEY) or {}
+        estimates = estimate_durations([item.nodeid for item in items], durations)
+        # stable, so tests with equal estimates keep their relative order on every worker
+        items.sort(key=lambda item: estimates[item.nodeid], reverse=True)
+
+    def pytest_runtest_logreport(self, report):
+        """Add up the time each test spent in setup, call and teardown"""
+        if self.is_worker:
+            return
+        if report.skipped:
+            self._skipped_nodeids.add(report.nodeid)
+        self._recorded[report.nodeid] = self._recorded.get(report.nodeid, 0.0) + report.duration
+
+    def pytest_sessionfinish(self):
+        """Persist the durations of the tests that ran (skipped tests don't count)"""
+        if self.is_worker:
+            return
+        durations = dict(
+            (nodeid, seconds) for nodeid, seconds in self._recorded.items()
+            if nodeid not in self._skipped_nodeids)
+        if durations:
+            self.duration_store.update(durations)
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for comparing emitted projects against golden snapshots of them
+"""
+
+#
+# Imports
+#
+
+# import core
+import difflib
+import errno
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+
+# import third party
+import pytest
+import scandir
+
+# this project
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# largest text file whose full text goes into a snapshot (when snapshots keep the text)
+SNAPSHOT_TEXT_MAX_BYTES = 64 * 1024
+
+# most lines of unified diff shown per changed file
+_DIFF_MAX_LINES = 40
+
+# keys of emitted JSON files which differ from one render (or checkout) to the next, like the time
+# and platform of the render the post generation hook notes down, or the absolute path of the
+# template, left out of the snapshots; each a top level key, or a tuple of keys to a nested one
+VOLATILE_JSON_KEYS = {
+    'cookiecutter-crumbs.json': ('runtime_env', ('cookiecutter_params', '_template')),
+}
+
+
+#
+# Functions
+#
+
+def _read_text(content):
+    """Get the content as text if it is a reasonably small text file, else None"""
+    if len(content) > SNAPSHOT_TEXT_MAX_BYTES or b'\0' in content:
+        return None
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
+def _strip_volatile_json_keys(content, volatile_keys):
+    """Get the content of a JSON file without its volatile keys (see VOLATILE_JSON_KEYS)"""
+    try:
+        json_data = json.loads(content)
+    except ValueError:
+        return content
+    for key in volatile_keys:
+        key_path = key if isinstance(key, tuple) else (key,)
+        parent = json_data
+        for parent_key in key_path[:-1]:
+            parent = parent.get(parent_key) if isinstance(parent, dict) else None
+        if isinstance(parent, dict):
+            parent.pop(key_path[-1], None)
+    return json.dumps(json_data, indent=4, separators=(',', ': '), sort_keys=True) + '\n'
+
+
+def build_merkle_tree(root_path, with_text=False, _relative_path=''):
+    """
+    Build a Merkle tree of a directory: every node is hashed from its content, or its children's.
+
+    Files are hashed from their content and whether they are executable, symlinks from their
+    target, and directories from the names, kinds and hashes of their entries.  So two trees are
+    identical exactly when their root hashes are, and only the subtrees whose hashes differ have
+    to be looked into to find what changed.  Files with VOLATILE_JSON_KEYS are hashed without them.
+
+    Arguments:
+        root_path (str): The directory
+        with_text (bool): Whether to keep the full text of (small) text files in the tree
+    Returns:
+        dict: The root node, a directory node, with the keys
+            * type (str): 'dir', 'file' or 'symlink'
+            * hash (str): Hex digest of the node
+            * entries (dict): Child nodes keyed by name (directories only)
+            * executable (bool): Whether the file is executable (files only)
+            * text (str): The file's full text (files only, if kept)
+            * target (str): What the symlink points at (symlinks only)
+    """
+    entries = {}
+    hash_obj = hashlib.sha256()
+    for entry in sorted(scandir.scandir(root_path), key=lambda entry: entry.name):
+        relative_path = os.path.join(_relative_path, entry.name)
+        if entry.is_symlink():
+            target = os.readlink(entry.path)
+            node = {
+                'type': 'symlink',
+                'hash': hashlib.sha256(b'symlink\0' + target).hexdigest(),
+                'target': target,
+            }
+        elif entry.is_dir():
+            node = build_merkle_tree(entry.path, with_text=with_text, _relative_path=relative_path)
+        else:
+            with open(entry.path, 'rb') as input_file:
+                content = input_file.read()
+            if relative_path in VOLATILE_JSON_KEYS:
+                content = _strip_volatile_json_keys(content, VOLATILE_JSON_KEYS[relative_path])
+            executable = bool(entry.stat().st_mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH))
+            node = {
+                'type': 'file',
+                'hash': hashlib.sha256(
+                    b'file\0' + (b'x' if executable else b'-') + b'\0' + content).hexdigest(),
+                'executable': executable,
+            }
+            text = _read_text(content) if with_text else None
+            if text is not None:
+                node['text'] = text
+        entries[entry.name] = node
+        hash_obj.update(b"{}\0{}\0{}\n".format(entry.name, node['type'], node['hash']))
+    return {'type': 'dir', 'hash': hash_obj.hexdigest(), 'entries': entries}
+
+
+def diff_merkle_trees(expected_node, actual_node, relative_path=''):
+    """
+    Find what changed between two Merkle trees, only looking into subtrees whose hashes differ.
+
+    Returns:
+        list: (relative path, change) tuples, where change is 'added', 'removed' or 'changed'
+    """
+    if expected_node['hash'] == actual_node['hash']:
+        return []
+    if expected_node['type'] != 'dir' or actual_node['type'] != 'dir':
+        return [(relative_path, 'changed')]
+
+    changes = []
+    expected_entries = expected_node['entries']
+    actual_entries = actual_node['entries']
+    for name in sorted(set(expected_entries) | set(actual_entries)):
+        child_path = os.path.join(relative_path, name)
+        if name not in actual_entries:
+            changes.append((child_path, 'removed'))
+        elif name not in expected_entries:
+            changes.append((child_path, 'added'))
+        else:
+            changes.extend(
+                diff_merkle_trees(expected_entries[name], actual_entries[name], child_path))
+    return changes
+
+
+def _get_node(root_node, relative_path):
+    """Get the node at a path relative to the root of a Merkle tree"""
+    node = root_node
+    for name in relative_path.split(os.sep):
+        node = node['entries'][name]
+    return node
+
+
+def describe_change(expected_root, actual_root, relative_path, change):
+    """
+    Describe a change between two Merkle trees, with a diff if both trees have the file's text.
+
+    Returns:
+        str: Text describing the change
+    """
+    description = "{}: {}".format(relative_path, change)
+    if change != 'changed':
+        return description
+    expected_node = _get_node(expected_root, relative_path)
+    actual_node = _get_node(actual_root, relative_path)
+    if expected_node['type'] != actual_node['type']:
+        return "{} (from a {} to a {})".format(
+            description, expected_node['type'], actual_node['type'])
+    if expected_node['type'] == 'symlink':
+        return "{} (from {} to {})".format(
+            description, expected_node['target'], actual_node['target'])
+    if expected_node.get('executable') != actual_node.get('executable'):
+        description += " (executable: {} to {})".format(
+            expected_node.get('executable'), actual_node.get('executable'))
+    if 'text' not in expected_node or 'text' not in actual_node:
+        return description
+    diff_lines = list(difflib.unified_diff(
+        expected_node['text'].splitlines(), actual_node['text'].splitlines(),
+        fromfile="snapshot/{}".format(relative_path), tofile="render/{}".format(relative_path),
+        lineterm=''))
+    if len(diff_lines) > _DIFF_MAX_LINES:
+        diff_lines = diff_lines[:_DIFF_MAX_LINES] + ["... ({} more lines of diff)".format(
+            len(diff_lines) - _DIFF_MAX_LINES)]
+    return u"{}\n{}".format(description, u"\n".join(diff_lines))
+
+
+#
+# Classes
+#
+
+class SnapshotStore(object):
+    """
+    Golden snapshots of emitted projects, each a Merkle tree stored as a JSON file.
+
+    Checking an emitted project against its snapshot takes one comparison of root hashes when
+    nothing changed.  When something did, only the subtrees whose hashes differ are looked into,
+    and the changed files are diffed if the snapshot has their text.
+    """
+
+    def __init__(self, snapshots_path, update, with_text):
+        """
+        Arguments:
+            snapshots_path (str): Directory of the snapshot files
+            update (bool): Whether to update the snapshots to match, rather than check against them
+            with_text (bool): Whether updated snapshots keep the full text of (small) text files
+        """
+        self.snapshots_path = os.path.abspath(snapshots_path)
+        self.update = update
+        self.with_text = with_text
+
+    def get_snapshot_path(self, snapshot_name):
+        """Get the path to a snapshot file"""
+        return os.path.join(self.snapshots_path, "{}.json".format(snapshot_name))
+
+    def load(self, snapshot_name):
+        """Get a snapshot's Merkle tree, or None if there's no such snapshot"""
+        snapshot_path = self.get_snapshot_path(snapshot_name)
+        if not os.path.exists(snapshot_path):
+            return None
+        with open(snapshot_path, 'r') as snapshot_file:
+            return json.load(snapshot_file)
+
+    def save(self, snapshot_name, tree):
+        """Write a snapshot's Merkle tree, atomically"""
+        if not os.path.exists(self.snapshots_path):
+            try:
+                os.makedirs(self.snapshots_path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+        file_descriptor, scratch_path = tempfile.mkstemp(
+            prefix='.scratch-', dir=self.snapshots_path)
+        with os.fdopen(file_descriptor, 'w') as snapshot_file:
+            json.dump(tree, snapshot_file, indent=1, separators=(',', ': '), sort_keys=True)
+            snapshot_file.write('\n')
+        os.chmod(scratch_path, 0o644)
+        os.rename(scratch_path, self.get_snapshot_path(snapshot_name))
+
+    def check(self, snapshot_name, root_path):
+        """
+        Check a directory against its snapshot, failing the test with what changed.
+
+        When updating the snapshots, the snapshot is (re)written instead, if the directory differs
+        from it (or it has no text but should).
+
+        Arguments:
+            snapshot_name (str): Name of the snapshot
+            root_path (str): The directory to check
+        """
+        expected_tree = self.load(snapshot_name)
+        if self.update:
+            actual_tree = build_merkle_tree(root_path, with_text=self.with_text)
+            if expected_tree is not None and expected_tree['hash'] == actual_tree['hash'] and \
+                    expected_tree == actual_tree:
+                _LOGGER.debug("Snapshot %s is up to date", snapshot_name)
+                return
+            if expected_tree is not None:
+                _LOGGER.info("Updating snapshot %s, changed: %s", snapshot_name,
+                             diff_merkle_trees(expected_tree, actual_tree))
+            else:
+                _LOGGER.info("Creating snapshot %s", snapshot_name)
+            self.save(snapshot_name, actual_tree)
+            return
+
+        if expected_tree is None:
+            pytest.fail("No snapshot {} to check against, run with --update-snapshots to create "
+                        "it".format(self.get_snapshot_path(snapshot_name)))
+        actual_tree = build_merkle_tree(root_path)
+        if expected_tree['hash'] == actual_tree['hash']:
+            _LOGGER.debug("Matches snapshot %s (root hash %s)", snapshot_name, actual_tree['hash'])
+            return
+
+        # only now is the text worth having, to diff against
+        actual_tree = build_merkle_tree(root_path, with_text=True)
+        changes = diff_merkle_trees(expected_tree, actual_tree)
+        pytest.fail(u"Emitted project differs from snapshot {} in {} places (run with "
+                    u"--update-snapshots if that's intended):\n{}".format(
+                        self.get_snapshot_path(snapshot_name), len(changes), u"\n".join(
+                            describe_change(expected_tree, actual_tree, relative_path, change)
+                            for relative_path, change in changes)))
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for timing the phases of tests (rendering, assertions, make, etc.)
+"""
+
+#
+# Imports
+#
+
+# import core
+import collections
+import contextlib
+import json
+import logging
+import os
+import time
+
+# import third party
+import enum
+import pytest
+
+# this project
+from tests.common.misc_utils import (
+    get_run_shell_usages,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+
+#
+# Functions
+#
+
+def describe_specific_test_params(specific_test_params):
+    """
+    Describe a specific set of test params as JSON serializable data.
+
+    Enums are described by their lower case names, and lists of them by those names separated by
+    spaces (so make targets read like the make command line).
+    """
+    def describe(value):
+        if isinstance(value, enum.Enum):
+            return value.name.lower()
+        if isinstance(value, (list, tuple)):
+            return ' '.join(describe(item) for item in value)
+        return value
+
+    return dict(
+        (field_name, describe(value))
+        for field_name, value in specific_test_params._asdict().items())
+
+
+#
+# Classes
+#
+
+class PhaseTimer(object):
+    """
+    Records how long each phase of a single test takes, in the order they ran.
+
+    Also records other measurements of the test, like the exit status of make or the size of the
+    wheel it built.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.measurements = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def phase(self, phase_name):
+        """Context manager timing one phase, which is recorded even if the phase fails"""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start_time
+            _LOGGER.debug("Phase '%s' took %.3f seconds", phase_name, elapsed)
+            self.phases.append((phase_name, elapsed))
+
+    def record(self, measurement_name, value):
+        """Record a measurement (a number) of the test"""
+        _LOGGER.debug("Measurement '%s' is %s", measurement_name, value)
+        self.measurements[measurement_name] = value
+
+    def to_dict(self):
+        """Get the recorded phases and measurements as JSON serializable data"""
+        return {
+            'measurements': dict(self.measurements),
+            'phases': [{'name': name, 'seconds': seconds} for name, seconds in self.phases],
+            'total_seconds': sum(seconds for _, seconds in self.phases),
+            'worker': os.environ.get('PYTEST_XDIST_WORKER', 'master'),
+        }
+
+
+class PhaseTimingCollector(object):
+    """
+    Pytest plugin which gathers phase timings from every test, including tests on xdist workers.
+
+    Each test's phase timings ride along to the master process in a section of its report, where
+    they are taken out of the report again (so they don't show up under failures), written out
+    as JSON lines, and ranked in the terminal summary.  Other plugins of the master process get
+    the record via `get_record`.  So does the resource
+    usage of every shell command the test ran (CPU time, peak RSS, bytes read and written).
+    """
+
+    SECTION_NAME = 'phase timings'
+
+    # attribute of a report holding its record, once taken out of its sections
+    RECORD_ATTRIBUTE_NAME = 'phase_timing_record'
+
+    @staticmethod
+    def get_record(report):
+        """Get the phase timing record of a test's report (on the master), or None if it has none"""
+        return getattr(report, PhaseTimingCollector.RECORD_ATTRIBUTE_NAME, None)
+
+    def __init__(self, jsonl_path, collect, top_count=10):
+        """
+        Arguments:
+            jsonl_path (str): File to write one JSON line of phase timings per test into
+            collect (bool): Whether this process collects timings (false on xdist workers)
+            top_count (int): Number of slowest phases and tests to show in the summary
+        """
+        self.jsonl_path = jsonl_path
+        self.collect = collect
+        self.top_count = top_count
+        self._records = []
+        if self.collect:
+            with open(self.jsonl_path, 'w'):
+                pass
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        """Attach the test's phase timings, and its shell commands' resource usage, to its report"""
+        outcome = yield
+        report = outcome.get_result()
+        if call.when != 'call':
+            return
+        # every test gets a record (so every result reaches the results database), with no phases
+        # if it has no phase timer, in which case its total is the duration of its call
+        phase_timer = getattr(item, 'funcargs', {}).get('phase_timer') or PhaseTimer()
+        record = phase_timer.to_dict()
+        if not phase_timer.phases:
+            record['total_seconds'] = call.stop - call.start
+        record['shell_commands'] = get_run_shell_usages()
+        callspec = getattr(item, 'callspec', None)
+        specific_test_params = callspec.params.get('specific_test_params') if callspec else None
+        if specific_test_params is not None:
+            record['params'] = describe_specific_test_params(specific_test_params)
+        report.sections.append((PhaseTimingCollector.SECTION_NAME, json.dumps(record)))
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_logreport(self, report):
+        """Take the phase timings out of a test report, and write them out"""
+        if not self.collect or report.when != 'call':
+            return
+        for section in list(report.sections):
+            section_name, section_text = section
+            if section_name == PhaseTimingCollector.SECTION_NAME:
+                report.sections.remove(section)
+                record = json.loads(section_text)
+                record['nodeid'] = report.nodeid
+                record['outcome'] = report.outcome
+                setattr(report, PhaseTimingCollector.RECORD_ATTRIBUTE_NAME, record)
+                self._records.append(record)
+                with open(self.jsonl_path, 'a') as jsonl_file:
+                    jsonl_file.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def pytest_terminal_summary(self, terminalreporter):
+        """Rank the slowest phases and tests"""
+        if not self.collect or not self._records:
+            return
+
+        phase_totals = collections.defaultdict(list)
+        for record in self._records:
+            for phase in record['phases']:
+                phase_totals[phase['name']].append(phase['seconds'])
+        ranked_phases = sorted(
+            phase_totals.items(), key=lambda item: sum(item[1]), reverse=True)
+
+        terminalreporter.write_sep('=', 'slowest {} test phases'.format(self.top_count))
+        for phase_name, durations in ranked_phases[:self.top_count]:
+            terminalreporter.write_line(
+                "{:10.2f}s total {:8.2f}s max {:5d}x  {}".format(
+                    sum(durations), max(durations), len(durations), phase_name))
+
+        ranked_records = sorted(
+            (record for record in self._records if record['phases']),
+            key=lambda record: record['total_seconds'], reverse=True)
+        terminalreporter.write_sep('=', 'slowest {} parameter combinations'.format(self.top_count))
+        for record in ranked_records[:self.top_count]:
+            slowest_phase = max(record['phases'], key=lambda phase: phase['seconds'])
+            terminalreporter.write_line(
+                "{:10.2f}s (slowest phase: {} {:.2f}s)  {}".format(
+                    record['total_seconds'], slowest_phase['name'], slowest_phase['seconds'],
+                    record['nodeid']))
+        terminalreporter.write_line("Phase timings for every test are in {}".format(self.jsonl_path))
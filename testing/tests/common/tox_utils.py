@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for managing the tox virtualenvs of emitted projects
+"""
+
+#
+# Imports
+#
+
+# import core
+import errno
+import hashlib
+import logging
+import os
+import re
+import subprocess
+
+# import third party
+import shutilwhich
+
+# this project
+from tests.constants import (
+    PipRequirementsFile,
+)
+from tests.common.cache_utils import (
+    clone_tree,
+)
+from tests.common.misc_utils import (
+    file_lock,
+    run_shell,
+)
+from tests.common.resource_utils import (
+    hold_resource_tokens,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# regex for the pip index url variable defaults set in the emitted project's Makefile
+_MAKEFILE_PIP_VARIABLE_REGEX = re.compile(r'^(PIP_\w+)\s*\?=\s*(\S+)\s*$')
+
+# make command printing the tox environments the emitted project's Makefile runs tox with
+_PRINT_TOX_ENVS_CMD = \
+    "make --no-print-directory --eval 'print_tox_envs: ; @echo $(TOXENV),$(DEFAULT_PY_ENV)' " \
+    "print_tox_envs"
+
+# regex for the tox environments named after a CPython version, like py27 or py36
+_TOX_ENV_PYTHON_REGEX = re.compile(r'^py(\d)(\d+)$')
+
+
+#
+# Functions
+#
+
+def _hash_requirements_files(hash_obj, project_output_path):
+    """Update a hash with the emitted project's pip requirements files"""
+    for pip_req_file in PipRequirementsFile:
+        hash_obj.update(pip_req_file.file_name)
+        with open(os.path.join(project_output_path, pip_req_file.file_name), 'rb') as req_file:
+            hash_obj.update(hashlib.sha256(req_file.read()).hexdigest())
+
+
+def build_virtualenv_key(tox_env, project_output_path, pip_env):
+    """
+    Build a key out of a tox environment, the emitted project's pip requirements files, and the
+    pip environment variables the virtualenv gets built with (like the package index it uses).
+
+    Arguments:
+        tox_env (str): The tox environment, like py27
+        project_output_path (str): Path to the root directory of the emitted project
+        pip_env (dict): Environment variables to build the virtualenv with (only the PIP_* ones
+            count)
+    Returns:
+        str: The key, prefixed with the tox environment
+    """
+    hash_obj = hashlib.sha256()
+    _hash_requirements_files(hash_obj, project_output_path)
+    for name, value in sorted(pip_env.items()):
+        if name.startswith('PIP_'):
+            hash_obj.update("{}={}\n".format(name, value))
+    return "{}-{}".format(tox_env, hash_obj.hexdigest())
+
+
+def resolve_tox_envs(project_output_path, env=None):
+    """
+    Get the tox environments the emitted project's make targets run tox with.
+
+    Those are whatever TOXENV and DEFAULT_PY_ENV come to in its Makefile, which depend on the
+    host (like the version of its python3).
+
+    Arguments:
+        project_output_path (str): Path to the root directory of the emitted project
+        env (dict): Optional environment variables to add to (or override in) the current
+            environment for make
+    Returns:
+        list: Names of the tox environments, sorted
+    """
+    make_env = dict(os.environ)
+    make_env.update(env or {})
+    sub_proc = subprocess.Popen(
+        _PRINT_TOX_ENVS_CMD,
+        shell=True,
+        cwd=project_output_path,
+        env=make_env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    output, error_output = sub_proc.communicate()
+    if sub_proc.returncode != 0:
+        raise Exception("Command, {}, failed with exit code {}: {}".format(
+            _PRINT_TOX_ENVS_CMD, sub_proc.returncode, error_output))
+    tox_envs = sorted(set(tox_env for tox_env in output.strip().split(',') if tox_env))
+    _LOGGER.debug("The Makefile in %s runs tox environments %s", project_output_path, tox_envs)
+    return tox_envs
+
+
+def get_tox_env_executable_name(tox_env):
+    """Get the interpreter a tox environment like py36 runs (python3.6), or None if unknown"""
+    match_obj = _TOX_ENV_PYTHON_REGEX.match(tox_env)
+    return "python{}.{}".format(*match_obj.groups()) if match_obj else None
+
+
+def _rebase_virtualenv_scripts(virtualenv_path, old_virtualenv_path):
+    """Point the scripts of a cloned virtualenv (shebangs, activate scripts) at the clone"""
+    bin_path = os.path.join(virtualenv_path, 'bin')
+    for file_name in os.listdir(bin_path):
+        file_path = os.path.join(bin_path, file_name)
+        if os.path.islink(file_path) or not os.path.isfile(file_path):
+            continue
+        with open(file_path, 'rb') as script_file:
+            content = script_file.read()
+        if b'\0' in content or old_virtualenv_path not in content:
+            continue
+        # write a new file, rather than through a clone which may share storage with the pool
+        scratch_path = "{}.scratch".format(file_path)
+        with open(scratch_path, 'wb') as script_file:
+            script_file.write(content.replace(old_virtualenv_path, virtualenv_path))
+        os.chmod(scratch_path, os.stat(file_path).st_mode)
+        os.rename(scratch_path, file_path)
+
+
+def read_pip_environment_from_makefile(project_output_path):
+    """
+    Get the pip environment variables that the emitted project's Makefile would export.
+
+    Variables already set in the current environment win, same as with the Makefile's `?=`.
+
+    Arguments:
+        project_output_path (str): Path to the root directory of the emitted project
+    Returns:
+        dict: Environment variable names to values
+    """
+    pip_env = {}
+    with open(os.path.join(project_output_path, 'Makefile'), 'r') as input_file:
+        for line in input_file:
+            match_obj = _MAKEFILE_PIP_VARIABLE_REGEX.match(line)
+            if match_obj:
+                name, value = match_obj.groups()
+                pip_env[name] = os.environ.get(name, value)
+    _LOGGER.debug("Read this pip environment from the Makefile in %s: %s",
+                  project_output_path, pip_env)
+    return pip_env
+
+
+#
+# Classes
+#
+
+class ToxVirtualenvPool(object):
+    """
+    Pool of pre-built tox virtualenvs shared by emitted projects.
+
+    Entries are keyed by the tox environment the emitted project's Makefile resolves (like py27,
+    or the host's python3 version), plus a hash of its pip requirements files and of the pip
+    environment variables (its package index, or the local package index).  Each entry is built
+    once (by tox itself, so tox considers it up to date) in the pool, and then cloned into the
+    ``.tox`` directory of every project that needs it (see clone_tree), so every project can
+    install into its own virtualenvs without touching the pool.
+    """
+
+    # name of the file marking a pool entry as completely built
+    COMPLETE_MARKER_FILE_NAME = '.pool-entry-complete'
+
+    def __init__(self, pool_root_path, resource_token_pool=None, clone_strategy='auto'):
+        """
+        Arguments:
+            pool_root_path (str): Directory to keep the pooled virtualenvs in
+            resource_token_pool (ResourceTokenPool): Optional pool of resource tokens to hold while
+                building virtualenvs
+            clone_strategy (str): How to clone pooled virtualenvs into the emitted projects, one
+                of CLONE_STRATEGIES
+        """
+        self.pool_root_path = os.path.abspath(pool_root_path)
+        self.resource_token_pool = resource_token_pool
+        self.clone_strategy = clone_strategy
+        if not os.path.exists(self.pool_root_path):
+            try:
+                os.makedirs(self.pool_root_path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+    def _ensure_entry(self, tox_env, project_output_path, env):
+        """Get the path to the pooled virtualenv, building it if necessary"""
+        key = build_virtualenv_key(tox_env, project_output_path, env)
+        entry_path = os.path.join(self.pool_root_path, key)
+        virtualenv_path = os.path.join(entry_path, tox_env)
+        marker_path = os.path.join(entry_path, ToxVirtualenvPool.COMPLETE_MARKER_FILE_NAME)
+
+        # serialize builds of the same entry across every process on the host
+        with file_lock(os.path.join(self.pool_root_path, "{}.lock".format(key))):
+            if os.path.exists(marker_path):
+                _LOGGER.debug("Tox virtualenv pool hit for %s", key)
+                return virtualenv_path
+
+            _LOGGER.info("Tox virtualenv pool miss for %s, building it in %s", key, entry_path)
+            cmd_text = "tox --notest -e {} --workdir {}".format(tox_env, entry_path)
+            with hold_resource_tokens(self.resource_token_pool, 1, cmd_text):
+                run_shell(cmd_text, working_path=project_output_path, env=env)
+            with open(marker_path, 'w') as marker_file:
+                marker_file.write(key)
+        return virtualenv_path
+
+    def attach(self, specific_test_params, project_output_path, env=None):
+        """
+        Clone pooled tox virtualenvs into an emitted project, building them if necessary.
+
+        Arguments:
+            specific_test_params (tuple): A specific set of make test parameters
+            project_output_path (str): Path to the root directory of the emitted project
+            env (dict): Optional environment variables to build the virtualenvs with (and run
+                make with), on top of the pip environment from the emitted project's Makefile
+        """
+        _LOGGER.info("Begin attaching pooled tox virtualenvs to %s for make targets %s",
+                     project_output_path, specific_test_params.make_targets)
+        build_env = read_pip_environment_from_makefile(project_output_path)
+        build_env.update(env or {})
+        tox_dir_path = os.path.join(project_output_path, '.tox')
+        if not os.path.exists(tox_dir_path):
+            os.mkdir(tox_dir_path)
+        for tox_env in resolve_tox_envs(project_output_path, env=env):
+            executable_name = get_tox_env_executable_name(tox_env)
+            if executable_name is not None and not shutilwhich.which(executable_name):
+                _LOGGER.debug("Missing interpreter %s, not attaching a pooled virtualenv",
+                              executable_name)
+                continue
+            virtualenv_path = self._ensure_entry(tox_env, project_output_path, build_env)
+            clone_path = os.path.join(tox_dir_path, tox_env)
+            _LOGGER.debug("Cloning pooled tox virtualenv %s to %s", virtualenv_path, clone_path)
+            clone_counts = clone_tree(virtualenv_path, clone_path, strategy=self.clone_strategy)
+            _rebase_virtualenv_scripts(clone_path, virtualenv_path)
+            _LOGGER.debug("Cloned pooled tox virtualenv %s: %s", tox_env, clone_counts)
+        _LOGGER.info("Finished attaching pooled tox virtualenvs to %s", project_output_path)
@@ -8,15 +8,55 @@ Pytest configuration fixtures and hooks
 
 # core python
 import logging
+import os
+import uuid
 
 # third party
+import pytest
 
 # this project
+import tests
 from tests.constants import (
     DependencyManagementMode,
     MakeTarget,
     ProjectFlavor,
     PythonVersionMode,
+    VagrantVMBackend,
+)
+from tests.common.cache_utils import (
+    CLONE_STRATEGIES,
+)
+from tests.common.cookiecutter_utils import (
+    compute_template_digest,
+)
+from tests.common.fail_fast_utils import (
+    ClusterFailFast,
+)
+from tests.common.log_utils import (
+    get_log_parts_path,
+    merge_log_parts,
+    set_current_test,
+)
+from tests.common.output_utils import (
+    OutputGarbageCollector,
+)
+from tests.common.resource_utils import (
+    compute_token_capacity,
+)
+from tests.common.results_utils import (
+    ResultsDatabase,
+    ResultsRecorder,
+    load_budgets,
+)
+from tests.common.scheduling_utils import (
+    DurationAwareScheduling,
+    TestDurationStore,
+    assign_shards,
+    build_shard_key,
+    estimate_durations,
+)
+from tests.common.timing_utils import (
+    PhaseTimingCollector,
 )
 
 # import to expose to pytest magic
@@ -25,10 +65,22 @@ from tests.fixtures import (
     cookiecutter_config_path,
     cookiecutter_json_data,
     cookiecutter_json_path,
+    harness_cache_path,
+    impact_index,
+    local_package_index,
     original_cookiecutter_json_data,
+    output_garbage_collector,
+    phase_timer,
+    render_cache,
+    render_snapshot_store,
+    render_worker_pool,
     repo_root_path,
+    resource_token_pool,
     root_output_path,
+    shell_log_file_path,
+    shell_logs_path,
     specific_test_params_filter,
+    tox_virtualenv_pool,
 )
 
 #
@@ -70,8 +122,278 @@ def pytest_addoption(parser):
         type=str,
         help="Override python version mode used in tests")
 
+    parser.addoption(
+        "--vm-backend",
+        choices=[item.name.lower() for item in VagrantVMBackend],
+        default=VagrantVMBackend.VAGRANT.name.lower(),
+        help="Bring up the emitted project's vagrant VMs as virtual machines (vagrant), or as "
+             "sandboxes over a base rootfs which run the same provisioners (sandbox)")
+
+    parser.addoption(
+        "--vm-base-rootfs",
+        type=str,
+        default=None,
+        help="Base rootfs (a directory, or a tarball that gets extracted into the harness cache "
+             "once) of the sandboxes of the sandbox VM backend")
+
+    parser.addoption(
+        "--disable-render-cache",
+        action="store_true",
+        default=False,
+        help="Run cookiecutter for every test instead of re-using cached renders")
+
+    parser.addoption(
+        "--render-clone-strategy",
+        choices=CLONE_STRATEGIES,
+        default='auto',
+        help="How tests clone cached renders: reflink (copy-on-write), hardlink (every file, "
+             "read-only; copy when running as root), copy, or auto (reflink where supported, "
+             "else copy)")
+
+    parser.addoption(
+        "--render-workers",
+        type=int,
+        default=None,
+        help="Number of worker processes priming the render cache (default: one per CPU, or 0 "
+             "on xdist workers; 0 to render in each test instead)")
+
+    parser.addoption(
+        "--use-tox-virtualenv-pool",
+        action="store_true",
+        default=False,
+        help="Share pre-built tox virtualenvs across emitted projects and test sessions")
+
+    parser.addoption(
+        "--use-local-package-index",
+        action="store_true",
+        default=False,
+        help="Install the emitted projects' pip requirements from a prefetched local wheel store")
+
+    parser.addoption(
+        "--shell-command-timeout",
+        type=float,
+        default=None,
+        help="Kill shell commands run by tests (like make) after this many seconds")
+
+    parser.addoption(
+        "--disable-duration-scheduling",
+        action="store_true",
+        default=False,
+        help="Hand tests to xdist workers in collection order instead of longest expected first")
+
+    parser.addoption(
+        "--shard-count",
+        type=int,
+        default=1,
+        help="Split the collected tests into this many disjoint shards (e.g. one per CI host)")
+
+    parser.addoption(
+        "--shard-index",
+        type=int,
+        default=0,
+        help="Only run the tests in this shard, counting from 0")
+
+    parser.addoption(
+        "--shard-by-duration",
+        action="store_true",
+        default=False,
+        help="Balance the shards by the recorded test durations (every host needs the same "
+             ".harness-cache/test-durations.json for the shards to stay disjoint)")
+
+    parser.addoption(
+        "--skip-unaffected",
+        action="store_true",
+        default=False,
+        help="Skip (as cached passes) tests of the emitted project whose template files and "
+             "harness code haven't changed since they last passed")
+
+    parser.addoption(
+        "--log-test-filter",
+        type=str,
+        default=None,
+        help="Only keep the log records of tests whose node ids contain this in the merged log "
+             "(every record stays in the per-process log parts)")
+
     parser.addoption(
         "--retain-passed-test-data",
         action="store_true",
         default=False,
         help="Retain data from successful tests")
+
+    parser.addoption(
+        "--retained-output-budget-mb",
+        type=float,
+        default=None,
+        help="Evict the least recently used output of earlier tests beyond this many megabytes of "
+             "disk at the end of the test session")
+
+    parser.addoption(
+        "--resource-tokens",
+        type=int,
+        default=None,
+        help="Number of host-wide resource tokens the heavy phases of tests (make, tox virtualenv "
+             "builds) share (default: one per CPU, as long as there's a GiB of memory available "
+             "per token, 0 to not limit them)")
+
+    parser.addoption(
+        "--disable-results-database",
+        action="store_true",
+        default=False,
+        help="Don't record the results of the session in .harness-cache/results.sqlite")
+
+    parser.addoption(
+        "--performance-budgets",
+        default=None,
+        help="YAML file of the performance budgets to hold the results of the session to "
+             "(default: performance-budgets.yaml)")
+
+    parser.addoption(
+        "--update-snapshots",
+        action="store_true",
+        default=False,
+        help="Update the golden snapshots of the emitted projects to match the render tests' "
+             "renders, rather than check the renders against them")
+
+    parser.addoption(
+        "--snapshot-with-text",
+        action="store_true",
+        default=False,
+        help="Keep the full text of the emitted text files in updated snapshots, so changes "
+             "against them show as diffs (not just the files that changed)")
+
+    parser.addoption(
+        "--disable-cluster-fail-fast",
+        action="store_true",
+        default=False,
+        help="With -x (or --maxfail), only stop handing out tests on reaching the failure limit, "
+             "rather than also cancelling the make runs of every xdist worker and skipping their "
+             "queued tests")
+
+
+def pytest_configure(config):
+    """Register the plugins that gather the phase timings, durations and results of tests"""
+    shard_count = config.getoption('shard_count')
+    shard_index = config.getoption('shard_index')
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise pytest.UsageError(
+            "--shard-index must be from 0 to --shard-count - 1, got {} of {}".format(
+                shard_index, shard_count))
+
+    root_output_path = os.path.join(os.path.abspath('..'), 'testing', 'output')
+    if not os.path.exists(root_output_path):
+        os.mkdir(root_output_path)
+    collector = PhaseTimingCollector(
+        jsonl_path=os.path.join(root_output_path, 'phase-timings.jsonl'),
+        collect=not hasattr(config, 'slaveinput'))
+    config.pluginmanager.register(collector, 'phase_timing_collector')
+
+    # size the resource token pool once, so every xdist worker (which get the master's options)
+    # agrees on it, however much memory is free when each of them starts
+    if config.getoption('resource_tokens') is None and not hasattr(config, 'slaveinput'):
+        config.option.resource_tokens = compute_token_capacity()
+        _LOGGER.info("Sized the resource token pool at %d tokens", config.option.resource_tokens)
+
+    harness_cache_path = os.path.join(os.path.abspath('..'), 'testing', '.harness-cache')
+    if not os.path.exists(harness_cache_path):
+        try:
+            os.mkdir(harness_cache_path)
+        except OSError:
+            # another xdist worker beat us to it
+            assert os.path.isdir(harness_cache_path)
+
+    if not config.getoption('disable_duration_scheduling'):
+        scheduling = DurationAwareScheduling(
+            duration_store=TestDurationStore(
+                os.path.join(harness_cache_path, 'test-durations.json')),
+            config=config)
+        config.pluginmanager.register(scheduling, 'duration_aware_scheduling')
+
+    # the master names the stop file of the session, and every xdist worker gets its options
+    if config.getoption('maxfail') > 0 and not config.getoption('disable_cluster_fail_fast'):
+        if not hasattr(config, 'slaveinput'):
+            config.option.cluster_stop_file_path = os.path.join(
+                harness_cache_path, 'stop-files', "{}.json".format(uuid.uuid4().hex))
+        fail_fast = ClusterFailFast(
+            stop_file_path=config.getoption('cluster_stop_file_path'),
+            maxfail=config.getoption('maxfail'),
+            is_worker=hasattr(config, 'slaveinput'))
+        config.pluginmanager.register(fail_fast, 'cluster_fail_fast')
+
+    if not config.getoption('disable_results_database') and not hasattr(config, 'slaveinput'):
+        budgets_path = config.getoption('performance_budgets') or os.path.join(
+            os.path.abspath('..'), 'testing', 'performance-budgets.yaml')
+        recorder = ResultsRecorder(
+            results_database=ResultsDatabase(os.path.join(harness_cache_path, 'results.sqlite')),
+            template_digest=compute_template_digest(os.path.abspath('..')),
+            budgets=load_budgets(budgets_path) if os.path.exists(budgets_path) else None)
+        config.pluginmanager.register(recorder, 'results_recorder')
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_collection_modifyitems(config, items):
+    """Deselect the tests outside of this host's shard (after -k and -m deselect theirs)"""
+    shard_count = config.getoption('shard_count')
+    if shard_count == 1:
+        return
+    shard_index = config.getoption('shard_index')
+
+    shard_keys = dict((item.nodeid, build_shard_key(item)) for item in items)
+    estimates = None
+    if config.getoption('shard_by_duration'):
+        durations = TestDurationStore(
+            os.path.join(os.path.abspath('..'), 'testing', '.harness-cache', 'test-durations.json')
+        ).load()
+        estimates = dict(
+            (shard_keys[nodeid], seconds) for nodeid, seconds in
+            estimate_durations(shard_keys.keys(), durations).items())
+    assignments = assign_shards(list(shard_keys.values()), shard_count, estimates=estimates)
+
+    selected = []
+    deselected = []
+    for item in items:
+        if assignments[shard_keys[item.nodeid]] == shard_index:
+            selected.append(item)
+        else:
+            deselected.append(item)
+    _LOGGER.info("Running %d of %d tests in shard %d of %d", len(selected), len(items),
+                 shard_index, shard_count)
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item):
+    """Stamp the log records of each test with its node id"""
+    set_current_test(item.nodeid)
+    yield
+    set_current_test(None)
+
+
+def pytest_sessionfinish(session):
+    """
+    Clear out the trash, fit retained test output into its disk budget and merge the log parts
+    """
+    config = session.config
+    log_part_listener = tests.LOG_PART_LISTENER
+    if hasattr(config, 'slaveinput'):
+        # the master does the rest once every worker is done (and xdist only tells it a worker is
+        # done after this hook), so all a worker does is write out its log part
+        if log_part_listener is not None:
+            log_part_listener.stop()
+        return
+    budget_mb = config.getoption('retained_output_budget_mb')
+    garbage_collector = OutputGarbageCollector(
+        root_output_path=os.path.join(os.path.abspath('..'), 'testing', 'output'),
+        retained_budget_bytes=None if budget_mb is None else int(budget_mb * 1024 * 1024))
+    garbage_collector.sweep()
+    garbage_collector.enforce_budget()
+    garbage_collector.close()
+
+    if log_part_listener is not None:
+        log_part_listener.stop()
+        log_file_path = os.path.abspath(os.environ['PYTEST_LOG_PATH'])
+        merge_log_parts(
+            get_log_parts_path(log_file_path),
+            log_file_path,
+            nodeid_filter=config.getoption('log_test_filter'))
@@ -67,13 +67,19 @@ class MakeTarget(enum.Enum):
 
     @staticmethod
     def build_target_tree():
-        """Return a tree representing the inter-dependencies amongst the make targets"""
+        """
+        Return a tree representing the inter-dependencies amongst the make targets.
+
+        Each make target maps to its prerequisites in the order make runs them.  This has to match
+        the rules of the emitted Makefile, which `assert_make_target_tree_matches_makefile` checks.
+        """
         data = {
             MakeTarget.ALL: [
                 MakeTarget.CLEAN,
                 MakeTarget.BUILD,
                 MakeTarget.LINT,
                 MakeTarget.LINT_TESTS,
+                MakeTarget.TESTS,
                 MakeTarget.DOCS,
                 MakeTarget.WHEEL],
             MakeTarget.CLEAN: [
@@ -85,13 +91,29 @@ class MakeTarget(enum.Enum):
                 MakeTarget.CLEAN_TOX_OUTPUT
             ],
             MakeTarget.CLEAN_ALL: [MakeTarget.CLEAN, MakeTarget.CLEAN_TOX],
+            MakeTarget.CLEAN_TOX: [MakeTarget.CLEAN_TOX_OUTPUT],
             MakeTarget.TEST_WHEEL: [MakeTarget.WHEEL],
+            MakeTarget.WHEEL: [MakeTarget.CLEAN_DIST],
         }
         for make_target in MakeTarget:
             if make_target not in data:
                 data[make_target] = []
         return copy.deepcopy(data)
 
+    @staticmethod
+    def get_targets_run_by(*make_targets):
+        """Return the set of make targets run by the make targets, including themselves"""
+        tree = MakeTarget.build_target_tree()
+        targets_run = set()
+        pending = list(make_targets)
+        while pending:
+            make_target = pending.pop()
+            assert isinstance(make_target, MakeTarget)
+            if make_target not in targets_run:
+                targets_run.add(make_target)
+                pending.extend(tree[make_target])
+        return targets_run
+
     @staticmethod
     def should_build_a_wheel(*make_targets):
         """Return true/false on whether the make target should result in a wheel"""
@@ -248,6 +270,19 @@ class VagrantVM(enum.Enum):
         return 'ssh {} -c "{}"'.format(self.vm_name, ssh_command)
 
 
+@enum.unique
+class VagrantVMBackend(enum.Enum):
+    """
+    Enumeration of the backends the vagrant VMs of the emitted project can be brought up with.
+    Ordered by default first.
+    """
+
+    # virtual machines, via vagrant itself
+    VAGRANT = 'vagrant'
+    # chroots over a cached base rootfs, in their own mount and pid namespaces
+    SANDBOX = 'sandbox'
+
+
 @enum.unique
 class PipRequirementsFile(enum.Enum):
     """Enumeration of pip requirements files that should be in the emitted project"""
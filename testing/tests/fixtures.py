@@ -11,6 +11,7 @@ Common fixtures
 import copy
 import json
 import logging
+import multiprocessing
 import os
 
 # import third party
@@ -23,12 +24,40 @@ from tests.constants import (
     ProjectFlavor,
     PythonVersionMode,
 )
+from tests.common.cache_utils import (
+    RenderCache,
+)
 from tests.common.cookiecutter_utils import (
     CookiecutterJSONSchema,
+    RenderWorkerPool,
 )
 from tests.common.misc_utils import (
     BasicTestParams,
     SpecificTestParamsFilter,
+    build_log_file_name,
+    set_run_shell_defaults,
+)
+from tests.common.impact_utils import (
+    ImpactIndex,
+)
+from tests.common.output_utils import (
+    OutputGarbageCollector,
+)
+from tests.common.package_index_utils import (
+    LocalPackageIndex,
+)
+from tests.common.resource_utils import (
+    ResourceTokenPool,
+    compute_token_capacity,
+)
+from tests.common.snapshot_utils import (
+    SnapshotStore,
+)
+from tests.common.timing_utils import (
+    PhaseTimer,
+)
+from tests.common.tox_utils import (
+    ToxVirtualenvPool,
 )
 
 #
@@ -77,12 +106,155 @@ def root_output_path(repo_root_path):
     return root_output_path
 
 
+@pytest.fixture(scope="session")
+def output_garbage_collector(root_output_path):
+    """Deletes the output directories of tests in the background"""
+    garbage_collector = OutputGarbageCollector(root_output_path=root_output_path)
+    yield garbage_collector
+    garbage_collector.close()
+
+
+@pytest.fixture(scope="session")
+def shell_logs_path(root_output_path):
+    """Path to the directory holding the per-test logs of shell commands"""
+    shell_logs_path = os.path.join(root_output_path, 'logs')
+    if not os.path.exists(shell_logs_path):
+        try:
+            os.mkdir(shell_logs_path)
+        except OSError:
+            # another xdist worker beat us to it
+            assert os.path.isdir(shell_logs_path)
+    return shell_logs_path
+
+
+@pytest.fixture(scope="function", autouse=True)
+def shell_log_file_path(request, pytestconfig, shell_logs_path):
+    """Path to the log file that shell commands run by the current test stream their output into"""
+    log_file_path = os.path.join(shell_logs_path, build_log_file_name(request.node.nodeid))
+    timeout = pytestconfig.getoption('shell_command_timeout', default=None, skip=False)
+    set_run_shell_defaults(log_file_path=log_file_path, timeout=timeout)
+    yield log_file_path
+    set_run_shell_defaults()
+
+
 @pytest.fixture(scope="session")
 def cookiecutter_config_path():
     """Path to the cookiecutter yaml config file to use"""
     return os.path.abspath(os.path.join('.', 'cookiecutter-config.yaml'))
 
 
+@pytest.fixture(scope="session")
+def harness_cache_path(repo_root_path):
+    """Path to the directory for artifacts the harness re-uses across test sessions"""
+    harness_cache_path = os.path.join(repo_root_path, 'testing', '.harness-cache')
+    if not os.path.exists(harness_cache_path):
+        try:
+            os.mkdir(harness_cache_path)
+        except OSError:
+            # another xdist worker beat us to it
+            assert os.path.isdir(harness_cache_path)
+    return harness_cache_path
+
+
+@pytest.fixture(scope="session")
+def render_cache(pytestconfig, repo_root_path, cookiecutter_config_path, harness_cache_path):
+    """Cache of rendered projects shared across sessions and workers, or None if disabled"""
+    if pytestconfig.getoption('disable_render_cache', default=False, skip=False):
+        _LOGGER.debug("Render cache is disabled")
+        return None
+    cache = RenderCache(
+        cache_root_path=os.path.join(harness_cache_path, 'renders'),
+        repo_root_path=repo_root_path,
+        cookiecutter_config_path=cookiecutter_config_path,
+        clone_strategy=pytestconfig.getoption('render_clone_strategy', default='auto', skip=False))
+    _LOGGER.debug("Using render cache at %s", cache.cache_root_path)
+    return cache
+
+
+@pytest.fixture(scope="session")
+def render_worker_pool(pytestconfig, repo_root_path, cookiecutter_config_path):
+    """Pool of warm worker processes rendering the template, or None if disabled"""
+    process_count = pytestconfig.getoption('render_workers', default=None, skip=False)
+    if process_count is None:
+        # xdist workers already render in parallel, each with its own cache of compiled templates
+        process_count = 0 if hasattr(pytestconfig, 'slaveinput') else multiprocessing.cpu_count()
+    if process_count <= 0:
+        _LOGGER.debug("Render worker pool is disabled")
+        yield None
+        return
+    pool = RenderWorkerPool(
+        repo_root_path=repo_root_path,
+        cookiecutter_config_path=cookiecutter_config_path,
+        process_count=process_count)
+    _LOGGER.debug("Using a render worker pool of %d processes", process_count)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture(scope="session")
+def resource_token_pool(pytestconfig, harness_cache_path):
+    """Host-wide pool of tokens the heavy phases of tests hold while they run, or None if unused"""
+    capacity = pytestconfig.getoption('resource_tokens', default=None, skip=False)
+    if capacity is None:
+        capacity = compute_token_capacity()
+    if capacity <= 0:
+        _LOGGER.debug("Resource token pool is not in use")
+        return None
+    pool = ResourceTokenPool(
+        pool_root_path=os.path.join(harness_cache_path, 'resource-tokens'), capacity=capacity)
+    _LOGGER.debug("Using a resource token pool of %d tokens at %s", capacity, pool.pool_root_path)
+    return pool
+
+
+@pytest.fixture(scope="session")
+def tox_virtualenv_pool(pytestconfig, harness_cache_path, resource_token_pool):
+    """Pool of pre-built tox virtualenvs shared across sessions and workers, or None if unused"""
+    if not pytestconfig.getoption('use_tox_virtualenv_pool', default=False, skip=False):
+        _LOGGER.debug("Tox virtualenv pool is not in use")
+        return None
+    pool = ToxVirtualenvPool(
+        pool_root_path=os.path.join(harness_cache_path, 'tox-pool'),
+        resource_token_pool=resource_token_pool,
+        clone_strategy=pytestconfig.getoption('render_clone_strategy', default='auto', skip=False))
+    _LOGGER.debug("Using tox virtualenv pool at %s", pool.pool_root_path)
+    return pool
+
+
+@pytest.fixture(scope="session")
+def local_package_index(pytestconfig, harness_cache_path, resource_token_pool):
+    """Local wheel store standing in for the emitted projects' package indexes, or None if unused"""
+    if not pytestconfig.getoption('use_local_package_index', default=False, skip=False):
+        _LOGGER.debug("Local package index is not in use")
+        return None
+    index = LocalPackageIndex(
+        wheelhouse_path=os.path.join(harness_cache_path, 'wheelhouse'),
+        resource_token_pool=resource_token_pool)
+    _LOGGER.debug("Using local package index at %s", index.wheelhouse_path)
+    return index
+
+
+@pytest.fixture(scope="session")
+def impact_index(pytestconfig, repo_root_path, harness_cache_path):
+    """Index of the last passing result of each test parameter combination"""
+    index = ImpactIndex(
+        index_root_path=os.path.join(harness_cache_path, 'impact'),
+        repo_root_path=repo_root_path,
+        skip_unaffected=pytestconfig.getoption('skip_unaffected', default=False, skip=False))
+    _LOGGER.debug("Using impact index at %s", index.index_root_path)
+    return index
+
+
+@pytest.fixture(scope="session")
+def render_snapshot_store(pytestconfig):
+    """Golden snapshots of the projects emitted for each combination of template parameters"""
+    store = SnapshotStore(
+        snapshots_path=os.path.join('tests', 'render', 'snapshots'),
+        update=pytestconfig.getoption('update_snapshots', default=False, skip=False),
+        with_text=pytestconfig.getoption('snapshot_with_text', default=False, skip=False))
+    _LOGGER.debug("Using render snapshots in %s", store.snapshots_path)
+    return store
+
+
 @pytest.fixture(scope="session")
 def specific_test_params_filter(request):
     """Setup optional filter for specific test params"""
@@ -120,13 +292,26 @@ def cookiecutter_json_data(original_cookiecutter_json_data):
     return copy.deepcopy(original_cookiecutter_json_data)
 
 
+@pytest.fixture(scope="function")
+def phase_timer():
+    """Timer for the phases of the current test"""
+    return PhaseTimer()
+
+
 @pytest.fixture(scope="function")
 def basic_test_params(
     pytestconfig,
     repo_root_path,
     cookiecutter_config_path,
     cookiecutter_json_data,
-    root_output_path):
+    root_output_path,
+    render_cache,
+    tox_virtualenv_pool,
+    local_package_index,
+    output_garbage_collector,
+    impact_index,
+    resource_token_pool,
+    phase_timer):
     """Group of basic parameters for conducting a test of the emitted project's make targets"""
     retain_passed_test_data = pytestconfig.getoption(
         'retain_passed_test_data', default=False, skip=False)
@@ -135,6 +320,13 @@ def basic_test_params(
         cookiecutter_config_path=cookiecutter_config_path,
         cookiecutter_json_data=cookiecutter_json_data,
         root_output_path=root_output_path,
-        retain_passed_test_data=retain_passed_test_data)
+        retain_passed_test_data=retain_passed_test_data,
+        render_cache=render_cache,
+        tox_virtualenv_pool=tox_virtualenv_pool,
+        local_package_index=local_package_index,
+        output_garbage_collector=output_garbage_collector,
+        impact_index=impact_index,
+        resource_token_pool=resource_token_pool,
+        phase_timer=phase_timer)
     _LOGGER.debug("Created these basic test params: %s", data)
     return data
@@ -9,7 +9,9 @@ Utilities for test assertions specific to tests specific to makefile targets
 
 # import core
 import glob
+import itertools
 import logging
+import multiprocessing.pool
 import os
 import pprint
 import stat
@@ -41,7 +43,10 @@ from tests.common.assertion_utils import (
     TravisFileSpec,
 )
 from tests.make.common.make_utils import (
+    dry_run_make_target,
+    list_expected_make_commands,
     parse_makefile,
+    read_make_database,
 )
 
 # logger
@@ -133,10 +138,68 @@ def assert_expected_makefile(basic_test_params, specific_test_params, project_ou
     # compare found target names to expected
     testfixtures.compare(found_target_names, expected_target_names)
 
+    # check the structure of the makefile, with make itself but without running any recipes
+    make_database = read_make_database(project_output_path)
+    assert_makefile_matches_make_database(parsed_makefile, make_database)
+    assert_make_target_tree_matches_makefile(parsed_makefile)
+    assert_make_dry_runs_match_recipes(project_output_path, parsed_makefile, make_database)
+
     _LOGGER.debug("Finished asserting that the expected Makefile was emitted for: %s",
                   str(func_params))
 
 
+def assert_makefile_matches_make_database(parsed_makefile, make_database):
+    """Assert the parsed makefile has the same rules (and recipes) make itself parsed"""
+    for target_name in parsed_makefile['targets']:
+        testfixtures.compare(
+            make_database['prerequisites'].get(target_name),
+            parsed_makefile['prerequisites'][target_name],
+            prefix="Prerequisites of make target '{}'".format(target_name))
+        testfixtures.compare(
+            make_database['recipes'].get(target_name),
+            parsed_makefile['recipes'][target_name],
+            prefix="Recipe of make target '{}'".format(target_name))
+
+
+def assert_make_target_tree_matches_makefile(parsed_makefile):
+    """Assert the tree of make targets the tests are scheduled by matches the makefile's rules"""
+    tree = MakeTarget.build_target_tree()
+    for make_target in MakeTarget:
+        testfixtures.compare(
+            parsed_makefile['prerequisites'].get(make_target.target_name),
+            MakeTarget.format_for_make(tree[make_target]),
+            prefix="Prerequisites of make target '{}' per MakeTarget.build_target_tree".format(
+                make_target.target_name))
+
+
+def assert_make_dry_runs_match_recipes(project_output_path, parsed_makefile, make_database):
+    """
+    Assert each make target expands to the commands its recipe, and those it depends on, call for.
+
+    Make only prints the commands in a dry run, so this checks what every make target would run
+    (tox included) in a fraction of a second.
+    """
+    # make spends its time waiting on the shell commands in the makefile's variables
+    thread_pool = multiprocessing.pool.ThreadPool(len(MakeTarget))
+    try:
+        dry_runs = thread_pool.map(
+            lambda make_target: dry_run_make_target(project_output_path, make_target.target_name),
+            list(MakeTarget))
+    finally:
+        thread_pool.close()
+
+    for make_target, actual_commands in zip(MakeTarget, dry_runs):
+        expected_commands = list_expected_make_commands(
+            parsed_makefile, make_database, make_target.target_name)
+        mismatches = [
+            "expected /{}/ got {!r}".format(
+                expected.pattern if expected else None, actual)
+            for expected, actual in itertools.izip_longest(expected_commands, actual_commands)
+            if expected is None or actual is None or not expected.match(actual)]
+        assert not mismatches, "Dry run of make target '{}' runs unexpected commands:\n{}".format(
+            make_target.target_name, '\n'.join(mismatches))
+
+
 def assert_expected_wheel_is_built(basic_test_params, specific_test_params, project_output_path):
     """Assert that the expected wheel can be built with the emitted template"""
     func_params = locals()
@@ -8,10 +8,13 @@ Make-related utilities
 #
 
 # import core
+import collections
 import copy
+import glob
 import logging
 import os
 import re
+import subprocess
 import sys
 
 # import third party
@@ -23,6 +26,12 @@ from tests.constants import (
 )
 import tests.common.misc_utils
 import tests.common.output_utils
+from tests.common.resource_utils import (
+    hold_resource_tokens,
+)
+from tests.common.timing_utils import (
+    PhaseTimer,
+)
 from tests.make.common.misc_utils import (
     SpecificTestParams,
 )
@@ -34,6 +43,64 @@ from tests.make.common.misc_utils import (
 # logger
 _LOGGER = logging.getLogger(__name__)
 
+# rule lines in a makefile, "target [target...]: [prerequisite...]" (but not "VAR := value")
+_MAKEFILE_RULE_REGEX = re.compile(r'^([^\s:=#][^:=#]*?)\s*:(?![:=])(.*)$')
+
+# backslash/newline line continuations in a makefile
+_MAKEFILE_CONTINUATION_REGEX = re.compile(r'\\\n[ \t]*')
+
+# the variables in the make database, "VAR = value" or "VAR := value"
+_MAKE_DATABASE_VARIABLE_REGEX = re.compile(r'^(?:export |override )*(\S+) (:=|=) ?(.*)$')
+
+# messages make prints about itself, rather than commands
+_MAKE_MESSAGE_REGEX = re.compile(r'^make(?:\[\d+\])?: ')
+
+# measurement of a test's exit status of make (that of the make invocation that failed, if any)
+MAKE_EXIT_STATUS_MEASUREMENT = 'make exit status'
+
+# measurements of the sizes of the artifacts in the emitted project's dist dir, and their files
+ARTIFACT_SIZE_MEASUREMENTS = (
+    ('wheel size bytes', '*.whl'),
+    ('docs archive size bytes', '*-html-docs.tgz'),
+)
+
+# measurements of the resources the make invocations of a test used altogether (see
+# ShellCommandUsage), the fields of the usage they come from, and how the invocations add up, which
+# tell CPU bound make targets (pylint, sphinx) from I/O bound ones (pip, virtualenv creation)
+MAKE_USAGE_MEASUREMENTS = (
+    ('make user cpu seconds', 'user_cpu_seconds', sum),
+    ('make system cpu seconds', 'system_cpu_seconds', sum),
+    ('make peak rss bytes', 'peak_rss_bytes', max),
+    ('make read bytes', 'read_bytes', sum),
+    ('make write bytes', 'write_bytes', sum),
+    ('make storage read bytes', 'storage_read_bytes', sum),
+    ('make storage write bytes', 'storage_write_bytes', sum),
+)
+
+# measurement of the time a test spent waiting for resource tokens to run make with
+RESOURCE_TOKEN_WAIT_MEASUREMENT = 'resource token wait seconds'
+
+# resource tokens each make target needs while it runs, by how much CPU and memory it takes
+# (tox virtualenv builds, sphinx, test runs), clean targets need none
+MAKE_TARGET_TOKEN_WEIGHTS = {
+    MakeTarget.BUILD: 1,
+    MakeTarget.DEVELOP: 1,
+    MakeTarget.DOCS: 2,
+    MakeTarget.DOCS_DRAFT: 2,
+    MakeTarget.FORMAT_WITH_YAPF: 1,
+    MakeTarget.INTEGRATION_TESTS: 2,
+    MakeTarget.LINT: 1,
+    MakeTarget.LINT_TESTS: 1,
+    MakeTarget.SYSTEM_TESTS: 2,
+    MakeTarget.TESTS: 2,
+    MakeTarget.TEST_WHEEL: 2,
+    MakeTarget.UNIT_TESTS: 2,
+    MakeTarget.WHEEL: 1,
+}
+
+# prints the make database without running anything (builtin rules and variables left out)
+MAKE_DATABASE_CMD = 'make --print-data-base --question --no-builtin-rules --no-builtin-variables'
+
 
 #
 # Classes / functions
@@ -48,45 +115,364 @@ def compose_make_command(make_targets):
     return cmd_text
 
 
-def run_make_on_host(specific_test_params, project_output_path):
-    """Run make in the project that was emitted on the host"""
+def get_make_token_weight(make_targets):
+    """
+    Get the resource tokens a make invocation needs: those of the heaviest make target it runs.
+
+    Make runs the targets one at a time, so the heaviest one is the most it takes at once.
+    """
+    targets_run = MakeTarget.get_targets_run_by(*(make_targets or [MakeTarget.ALL]))
+    return max(MAKE_TARGET_TOKEN_WEIGHTS.get(make_target, 0) for make_target in targets_run)
+
+
+def _record_make_usage(make_usages, phase_timer):
+    """Record the resources a test's make invocations used, see MAKE_USAGE_MEASUREMENTS"""
+    for measurement_name, field_name, combine in MAKE_USAGE_MEASUREMENTS:
+        values = [getattr(usage, field_name) for usage in make_usages]
+        if values and None not in values:
+            phase_timer.record(measurement_name, combine(values))
+
+
+def run_make_on_host(specific_test_params, project_output_path, env=None, phase_timer=None,
+                     resource_token_pool=None):
+    """
+    Run make in the project that was emitted on the host, optionally with extra env variables.
+
+    Each make target gets its own make invocation (in order) so that a failure is attributed to
+    the make target, and the targets it runs, that failed.  Each make invocation is timed as its
+    own phase if given a phase timer, which also gets the resources they used altogether.  If
+    given a resource token pool, each make invocation holds the tokens its make targets need (see
+    MAKE_TARGET_TOKEN_WEIGHTS) while it runs.
+    """
     assert isinstance(specific_test_params, SpecificTestParams)
-    make_cmd_text = compose_make_command(specific_test_params.make_targets)
-    try:
-        tests.common.misc_utils.run_shell(make_cmd_text, project_output_path)
-    except Exception as error:
-        _LOGGER.exception("Command '%s' failed (see previous STDERR): %s", make_cmd_text, error)
-        pytest.fail("Command, {}, failed, see log file for details: {}".format(
-            make_cmd_text, error))
-    else:
-        _LOGGER.debug("Successfully ran make in a shell: '%s'", make_cmd_text)
+    if phase_timer is None:
+        phase_timer = PhaseTimer()
+    make_target_lists = [[make_target] for make_target in specific_test_params.make_targets]
+    waited_seconds = 0.0
+    make_usages = []
+    for make_targets in make_target_lists or [[]]:
+        make_cmd_text = compose_make_command(make_targets)
+        try:
+            with hold_resource_tokens(resource_token_pool, get_make_token_weight(make_targets),
+                                      make_cmd_text) as token_wait_seconds:
+                waited_seconds += token_wait_seconds
+                if resource_token_pool is not None:
+                    phase_timer.record(RESOURCE_TOKEN_WAIT_MEASUREMENT, waited_seconds)
+                with phase_timer.phase(make_cmd_text):
+                    make_usages.append(tests.common.misc_utils.run_shell(
+                        make_cmd_text, project_output_path, env=env))
+        except tests.common.misc_utils.ShellCommandCancelled:
+            # another test failed first, this one didn't fail as such
+            raise
+        except tests.common.misc_utils.ShellCommandError as error:
+            phase_timer.record(MAKE_EXIT_STATUS_MEASUREMENT, error.returncode)
+            if error.usage is not None:
+                make_usages.append(error.usage)
+            _record_make_usage(make_usages, phase_timer)
+            _fail_make_command(make_cmd_text, make_targets, error)
+        except Exception as error:
+            _record_make_usage(make_usages, phase_timer)
+            _fail_make_command(make_cmd_text, make_targets, error)
+        else:
+            _LOGGER.debug("Successfully ran make in a shell: '%s'", make_cmd_text)
+    _record_make_usage(make_usages, phase_timer)
+    phase_timer.record(MAKE_EXIT_STATUS_MEASUREMENT, 0)
+
+
+def _fail_make_command(make_cmd_text, make_targets, error):
+    """Fail the test on the error of a make command, naming the make targets it runs"""
+    targets_run = sorted(
+        MakeTarget.format_for_make(list(MakeTarget.get_targets_run_by(*make_targets))))
+    _LOGGER.exception("Command '%s' failed (see previous STDERR), it runs make targets "
+                      "%s: %s", make_cmd_text, targets_run, error)
+    pytest.fail("Command, {}, failed, which runs make targets {}, see log file for "
+                "details: {}".format(make_cmd_text, targets_run, error))
+
+
+def record_artifact_sizes(project_output_path, phase_timer):
+    """Record the sizes of the artifacts (wheel, html docs archive) make left in the dist dir"""
+    dist_path = os.path.join(project_output_path, 'dist')
+    for measurement_name, file_pattern in ARTIFACT_SIZE_MEASUREMENTS:
+        artifact_paths = glob.glob(os.path.join(dist_path, file_pattern))
+        if artifact_paths:
+            phase_timer.record(
+                measurement_name,
+                sum(os.path.getsize(artifact_path) for artifact_path in artifact_paths))
 
 
 def parse_makefile(project_output_path):
     """
-    Rudimentary parsing of makefile.
-
-    Only scrapes makefile target names right now.
+    Parse the rules of the makefile.
+
+    Understands rule lines ("target [target...]: [prerequisite...]") along with their recipes,
+    line continuations and comments.  Variable assignments and directives are skipped, as are
+    double colon rules, which the emitted makefiles don't use.
+
+    Returns:
+        dict: With these keys,
+            * targets (list): Names of the (non special) targets, in the order they're defined
+            * prerequisites (OrderedDict): Lists of prerequisite names keyed by target name
+            * recipes (OrderedDict): Lists of recipe lines (as written) keyed by target name
+            * special_targets (OrderedDict): Lists of prerequisite names keyed by the names of
+              special targets like `.PHONY`
     """
-    _LOGGER.debug("Begin rudimentary parsing of makefile")
+    _LOGGER.debug("Begin parsing makefile")
     path = os.path.join(project_output_path, 'Makefile')
 
-    makefile_target_regex = re.compile(r'^(\w+):')
-    parsed_makefile = {'targets': []}
-
+    parsed_makefile = {
+        'targets': [],
+        'prerequisites': collections.OrderedDict(),
+        'recipes': collections.OrderedDict(),
+        'special_targets': collections.OrderedDict(),
+    }
     with open(path, 'r') as input_file:
-        for line in input_file.readlines():
-            _LOGGER.debug("Parsing line '%s'", str(line))
-            match_obj = re.match(makefile_target_regex, line)
-            if match_obj:
-                target_name = match_obj.group(1)
+        text = input_file.read()
+
+    # the targets whose recipe lines come next, if any
+    recipe_targets = []
+    for line in _MAKEFILE_CONTINUATION_REGEX.sub(' ', text).splitlines():
+        if line.startswith('\t') and recipe_targets:
+            for target_name in recipe_targets:
+                parsed_makefile['recipes'][target_name].append(line[1:])
+            continue
+        if not line.strip() or line.lstrip().startswith('#'):
+            # blank lines and comments don't end a recipe
+            continue
+        recipe_targets = []
+        match_obj = _MAKEFILE_RULE_REGEX.match(line)
+        if not match_obj:
+            _LOGGER.debug("Skipping makefile line which isn't a rule: '%s'", line)
+            continue
+        target_names, prerequisites = match_obj.groups()
+        prerequisites = prerequisites.split(';', 1)[0].split('#', 1)[0].split()
+        for target_name in target_names.split():
+            if target_name.startswith('.'):
+                parsed_makefile['special_targets'].setdefault(target_name, []).extend(
+                    prerequisites)
+                continue
+            if target_name not in parsed_makefile['prerequisites']:
                 parsed_makefile['targets'].append(target_name)
+                parsed_makefile['prerequisites'][target_name] = []
+                parsed_makefile['recipes'][target_name] = []
+            parsed_makefile['prerequisites'][target_name].extend(prerequisites)
+            recipe_targets.append(target_name)
     _LOGGER.debug("Parsed makefile is %s", str(parsed_makefile))
 
-    _LOGGER.debug("Finished rudimentary parsing of makefile")
+    _LOGGER.debug("Finished parsing makefile")
     return parsed_makefile
 
 
+def read_make_database(project_output_path):
+    """
+    Read the rules and variables make itself parsed out of the makefile, without running anything.
+
+    This is what `make --print-data-base --question` prints, so it is the ground truth to check
+    `parse_makefile` against.
+
+    Returns:
+        dict: With these keys,
+            * prerequisites (OrderedDict): Lists of prerequisite names keyed by target name
+            * recipes (OrderedDict): Lists of recipe lines (as written) keyed by target name
+            * variables (dict): (flavor, value) tuples keyed by the names of the variables the
+              makefile sets, where flavor is 'simple' (already expanded) or 'recursive'
+    """
+    _LOGGER.debug("Begin reading the make database in %s", project_output_path)
+    sub_proc = subprocess.Popen(
+        MAKE_DATABASE_CMD,
+        shell=True,
+        cwd=project_output_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    output, error_output = sub_proc.communicate()
+    # question mode exits 1 when the default goal is out of date, 2 on errors
+    if sub_proc.returncode not in (0, 1):
+        pytest.fail("Command, {}, failed with exit code {}: {}".format(
+            MAKE_DATABASE_CMD, sub_proc.returncode, error_output))
+
+    make_database = {
+        'prerequisites': collections.OrderedDict(),
+        'recipes': collections.OrderedDict(),
+        'variables': {},
+    }
+    lines = output.splitlines()
+    in_files_section = False
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        index += 1
+        if line == '# Files':
+            in_files_section = True
+        elif line.startswith('# files hash-table stats'):
+            in_files_section = False
+        elif line.startswith('# makefile (from ') and index < len(lines):
+            match_obj = _MAKE_DATABASE_VARIABLE_REGEX.match(lines[index])
+            if match_obj:
+                name, operator, value = match_obj.groups()
+                make_database['variables'][name] = (
+                    'simple' if operator == ':=' else 'recursive', value)
+        elif in_files_section and line == '# Not a target:':
+            # skip the rule that follows
+            index += 1
+        elif in_files_section:
+            match_obj = _MAKEFILE_RULE_REGEX.match(line)
+            if not match_obj or match_obj.group(1).startswith('.'):
+                continue
+            target_name = match_obj.group(1).strip()
+            make_database['prerequisites'][target_name] = match_obj.group(2).split()
+            recipe = make_database['recipes'].setdefault(target_name, [])
+            while index < len(lines) and (
+                    lines[index].startswith('#') or lines[index].startswith('\t')):
+                if lines[index].startswith('\t'):
+                    recipe.append(lines[index][1:])
+                index += 1
+
+    _LOGGER.debug("Finished reading the make database, it has %d targets",
+                  len(make_database['prerequisites']))
+    return make_database
+
+
+def _iter_make_references(text):
+    """Yield the (start, end, reference) of each `$x`, `$(...)` and `${...}` in make text"""
+    position = text.find('$')
+    while 0 <= position < len(text) - 1:
+        opener = text[position + 1]
+        if opener not in '({':
+            yield position, position + 2, opener
+            position = text.find('$', position + 2)
+            continue
+        closer = ')' if opener == '(' else '}'
+        depth = 0
+        end = position + 1
+        while end < len(text):
+            if text[end] == opener:
+                depth += 1
+            elif text[end] == closer:
+                depth -= 1
+                if depth == 0:
+                    break
+            end += 1
+        yield position, end + 1, text[position + 2:end]
+        position = text.find('$', end + 1)
+
+
+def _build_make_command_regex(recipe_line, variables, target_name):
+    """
+    Build a regex matching what make prints for a recipe line in a dry run.
+
+    Variables are expanded like make does, from the variables of the make database.  Whatever
+    can't be expanded without running something (like `$(shell ...)`) matches anything.
+    """
+    # make drops these prefixes (silent, ignore errors, always run) from the commands it prints
+    recipe_line = recipe_line.lstrip('@-+ \t')
+
+    # expand into tokens, each either literal text or None for anything
+    tokens = []
+    pending = [(recipe_line, 0)]
+    while pending:
+        text, depth = pending.pop(0)
+        assert depth < 20, "Recursive make variable in '{}'".format(recipe_line)
+        position = 0
+        for start, end, reference in _iter_make_references(text):
+            tokens.append(text[position:start])
+            position = end
+            if reference == '$':
+                tokens.append('$')
+            elif reference == '@':
+                tokens.append(target_name)
+            elif reference in variables:
+                flavor, value = variables[reference]
+                if flavor == 'simple':
+                    tokens.append(value)
+                else:
+                    # expand the value in place, ahead of the rest of this text
+                    pending[0:0] = [(value, depth + 1), (text[end:], depth)]
+                    position = None
+                    break
+            elif reference in os.environ:
+                tokens.append(os.environ[reference])
+            elif ' ' in reference:
+                # a function call, like $(shell ...)
+                tokens.append(None)
+            else:
+                # an unset variable
+                tokens.append('')
+        if position is not None:
+            tokens.append(text[position:])
+
+    # make prints whitespace as is, but empty expansions leave runs of it behind, so any run of
+    # whitespace matches any other (and whatever matches anything takes up the whitespace around it)
+    pattern_parts = []
+    for token in tokens:
+        if token is None:
+            while pattern_parts and pattern_parts[-1] == r'\s+':
+                pattern_parts.pop()
+            pattern_parts.append('.*')
+            continue
+        for chunk in re.split(r'(\s+)', token):
+            if not chunk:
+                continue
+            if chunk.isspace():
+                if pattern_parts and pattern_parts[-1] not in (r'\s+', '.*'):
+                    pattern_parts.append(r'\s+')
+            else:
+                pattern_parts.append(re.escape(chunk))
+    while pattern_parts and pattern_parts[-1] == r'\s+':
+        pattern_parts.pop()
+    return re.compile(r'^\s*{}\s*$'.format(''.join(pattern_parts)))
+
+
+def list_expected_make_commands(parsed_makefile, make_database, target_name):
+    """
+    List what make should print in a dry run of a target, per the parsed makefile.
+
+    That is the recipe of each target the target runs, prerequisites first and in order, with each
+    target run at most once.
+
+    Arguments:
+        parsed_makefile (dict): The makefile parsed with `parse_makefile`
+        make_database (dict): The make database read with `read_make_database`
+        target_name (str): The target to dry run
+    Returns:
+        list: Compiled regexes, one per command
+    """
+    expected_commands = []
+    visited = set()
+
+    def visit(current_target_name):
+        if current_target_name in visited:
+            return
+        visited.add(current_target_name)
+        for prerequisite in parsed_makefile['prerequisites'].get(current_target_name, []):
+            visit(prerequisite)
+        for recipe_line in parsed_makefile['recipes'].get(current_target_name, []):
+            expected_commands.append(_build_make_command_regex(
+                recipe_line, make_database['variables'], current_target_name))
+
+    visit(target_name)
+    return expected_commands
+
+
+def dry_run_make_target(project_output_path, target_name):
+    """
+    Get the commands make would run for a target, without running any of them.
+
+    Returns:
+        list: The commands `make --dry-run <target>` prints, in order
+    """
+    cmd_text = "make --dry-run {}".format(target_name)
+    sub_proc = subprocess.Popen(
+        cmd_text,
+        shell=True,
+        cwd=project_output_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    output, error_output = sub_proc.communicate()
+    if sub_proc.returncode != 0:
+        pytest.fail("Command, {}, failed with exit code {}: {}".format(
+            cmd_text, sub_proc.returncode, error_output))
+    return [line for line in output.splitlines() if not _MAKE_MESSAGE_REGEX.match(line)]
+
+
 class MakeTargetPermutationBuilder(object):
     """Utility for building permutations of make file targets"""
 
@@ -133,6 +519,85 @@ class MakeTargetPermutationBuilder(object):
         return targets
 
 
+class MakeTargetScheduler(object):
+    """
+    Utility for scheduling the fewest make invocations which still exercise every make target.
 
+    Make targets already run by the default make target are left out, as are make targets run by
+    another scheduled make target.  The remaining "apex" make targets are grouped so that each
+    group shares one emitted project:
 
+        * Targets which alter the emitted project or its tox virtualenvs in ways later targets
+          would notice (see ``ISOLATED_MAKE_TARGETS``) end a group.
+        * Clean targets go at the end of the first group which does not leave a wheel behind to
+          be checked, so they exercise cleaning up after real work.
+    """
+
+    ISOLATED_MAKE_TARGETS = (MakeTarget.DEVELOP, MakeTarget.FORMAT_WITH_YAPF, MakeTarget.TEST_WHEEL)
+
+    def __init__(self, default_make_target=MakeTargetPermutationBuilder.DEFAULT_MAKE_TARGET):
+        assert isinstance(default_make_target, MakeTarget)
+        self._tree = MakeTarget.build_target_tree()
+        self._default_make_target = default_make_target
+
+    def get_targets_to_cover(self):
+        """Get the make targets which the default make target does not run"""
+        targets_run_by_default = MakeTarget.get_targets_run_by(self._default_make_target)
+        return [make_target for make_target in MakeTarget
+                if make_target not in targets_run_by_default]
+
+    def get_apex_targets(self):
+        """Get the fewest make targets which, between them, run every make target to cover"""
+        targets_to_cover = self.get_targets_to_cover()
+        apex_targets = []
+        for make_target in targets_to_cover:
+            run_by_another = False
+            for other_target in targets_to_cover:
+                if other_target != make_target and \
+                        make_target in MakeTarget.get_targets_run_by(other_target):
+                    run_by_another = True
+                    break
+            if not run_by_another:
+                apex_targets.append(make_target)
+        return apex_targets
+
+    def build_schedule(self):
+        """
+        Build the schedule of make invocations.
 
+        Returns:
+            list: Lists of make targets, one list per emitted project, in invocation order
+        """
+        _LOGGER.debug("Begin building make target schedule")
+        plain_targets = []
+        isolated_targets = []
+        clean_targets = []
+        for make_target in self.get_apex_targets():
+            if make_target.target_name.startswith('clean'):
+                clean_targets.append(make_target)
+            elif make_target in MakeTargetScheduler.ISOLATED_MAKE_TARGETS:
+                isolated_targets.append(make_target)
+            else:
+                plain_targets.append(make_target)
+
+        # each isolated target ends a group, with the plain targets leading off the first one
+        schedule = []
+        group = list(plain_targets)
+        for make_target in isolated_targets:
+            group.append(make_target)
+            schedule.append(group)
+            group = []
+        if group:
+            schedule.append(group)
+
+        # put the clean targets after real work, but never after a wheel that gets checked
+        if clean_targets:
+            for group in schedule:
+                if not MakeTarget.should_build_a_wheel(*group):
+                    group.extend(clean_targets)
+                    break
+            else:
+                schedule.append(clean_targets)
+
+        _LOGGER.debug("Finished building make target schedule: %s", schedule)
+        return schedule
@@ -84,7 +84,10 @@ def skip_if_no_match_for_specific_params_filter(specific_test_params, specific_t
             if type_of_filtered_value == 'single_value':
                 matches_filter = (actual_attr_value == filter_attr_value)
             elif type_of_filtered_value == 'list_of_values':
-                matches_filter = (filter_attr_value in actual_attr_value)
+                # make targets also match the targets they run, since the schedule only
+                # invokes the apex targets
+                matches_filter = (
+                    filter_attr_value in MakeTarget.get_targets_run_by(*actual_attr_value))
             else:
                 raise Exception("Unsupported type of filtered value: '%s'", type_of_filtered_value)
 
@@ -135,7 +138,7 @@ class GeneratorForPytestParameterization(object):
         for pytest test parameterization
         """
         assert isinstance(specific_test_params, tests.make.common.misc_utils.SpecificTestParams)
-        params_hash = tests.common.output_utils.OutputDirectoryManager.build_params_hash(
+        params_hash = tests.common.output_utils.OutputDirectoryManager.build_short_params_hash(
             specific_test_params)
 
         if specific_test_params.make_targets:
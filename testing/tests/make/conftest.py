@@ -13,6 +13,11 @@ import pytest
 
 # this project
 
+# import to expose to pytest magic
+from .fixtures import (
+    primed_render_cache,
+)
+
 #
 # Module variables
 #
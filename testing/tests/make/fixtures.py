@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures specific to tests of make via api and cli
+"""
+
+#
+# Imports
+#
+
+# import core
+import copy
+import logging
+
+# import third party
+import pytest
+
+# this project
+from tests.make.common.cookiecutter_utils import (
+    mint_extra_context,
+)
+from tests.make.common.pytest_utils import (
+    skip_if_no_match_for_specific_params_filter,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+
+#
+# Fixtures
+#
+
+@pytest.fixture(scope="session", autouse=True)
+def primed_render_cache(
+        request,
+        original_cookiecutter_json_data,
+        render_cache,
+        render_worker_pool,
+        specific_test_params_filter):
+    """
+    Render every extra context the collected API tests need up front, with the render worker pool.
+
+    The tests then only copy their renders out of the render cache.
+    """
+    if render_cache is None or render_worker_pool is None:
+        _LOGGER.debug("Not priming the render cache")
+        return render_cache
+
+    extra_contexts = []
+    for item in request.session.items:
+        callspec = getattr(item, 'callspec', None)
+        if item.get_marker('custom_api_test') is None or callspec is None:
+            continue
+        specific_test_params = callspec.params.get('specific_test_params')
+        if specific_test_params is None:
+            continue
+        try:
+            skip_if_no_match_for_specific_params_filter(
+                specific_test_params, specific_test_params_filter)
+        except pytest.skip.Exception:
+            continue
+        extra_contexts.append(mint_extra_context(
+            copy.deepcopy(original_cookiecutter_json_data), specific_test_params))
+
+    render_cache.prime(extra_contexts=extra_contexts, render_worker_pool=render_worker_pool)
+    return render_cache
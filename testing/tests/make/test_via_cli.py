@@ -31,6 +31,7 @@ from tests.make.common.cookiecutter_utils import (
     mint_extra_context,
 )
 from tests.make.common.make_utils import (
+    record_artifact_sizes,
     run_make_on_host,
 )
 from tests.make.common.misc_utils import (
@@ -118,6 +119,10 @@ def test_via_cli(basic_test_params, specific_test_params):
     # skip if you're missing the interpreter
     skip_if_missing_an_intrepreter(specific_test_params)
 
+    # skip as a cached pass if nothing feeding the test changed since it last passed
+    basic_test_params.impact_index.skip_if_unaffected(
+        "cli", specific_test_params, basic_test_params.cookiecutter_json_data)
+
     # mint a default context
     extra_context = mint_extra_context(
         basic_test_params.cookiecutter_json_data, specific_test_params)
@@ -130,21 +135,51 @@ def test_via_cli(basic_test_params, specific_test_params):
     test_output_path = output_dir_manager.setup()
 
     # call cookiecutter CLI
-    invoker = CookieCutterInvoker(
-        repo_root_path=basic_test_params.repo_root_path,
-        cookiecutter_config_path=basic_test_params.cookiecutter_config_path)
-    invoker.invoke_via_cli(
-        working_path=os.path.abspath(os.getcwd()),
-        root_output_path=test_output_path)
+    phase_timer = basic_test_params.phase_timer
+    with phase_timer.phase('render'):
+        invoker = CookieCutterInvoker(
+            repo_root_path=basic_test_params.repo_root_path,
+            cookiecutter_config_path=basic_test_params.cookiecutter_config_path)
+        invoker.invoke_via_cli(
+            working_path=os.path.abspath(os.getcwd()),
+            root_output_path=test_output_path)
 
     # figure out where the test output_path should have ended up
     project_output_path = output_dir_manager.get_project_output_path()
 
     # do rudimentary file checks
-    assert_expected_files(basic_test_params, specific_test_params, project_output_path)
-
-    # run make in the project that was emitted
-    run_make_on_host(specific_test_params, project_output_path)
+    with phase_timer.phase('assert expected files'):
+        assert_expected_files(basic_test_params, specific_test_params, project_output_path)
+
+    # point pip at the local package index, if it is in use
+    make_env = None
+    if basic_test_params.local_package_index is not None:
+        with phase_timer.phase('prepare local package index'):
+            make_env = basic_test_params.local_package_index.prepare(
+                specific_test_params, project_output_path)
+
+    # hand the emitted project pre-built tox virtualenvs, if the pool is in use
+    if basic_test_params.tox_virtualenv_pool is not None:
+        with phase_timer.phase('attach pooled tox virtualenvs'):
+            basic_test_params.tox_virtualenv_pool.attach(
+                specific_test_params, project_output_path, env=make_env)
+
+    # run make in the project that was emitted (each make invocation is timed as its own phase)
+    run_make_on_host(
+        specific_test_params, project_output_path, env=make_env, phase_timer=phase_timer,
+        resource_token_pool=basic_test_params.resource_token_pool)
+    record_artifact_sizes(project_output_path, phase_timer)
+
+    # remember the test passed with the current template and harness
+    basic_test_params.impact_index.record_pass(
+        "cli", specific_test_params, basic_test_params.cookiecutter_json_data)
+
+    # if test passed, and retain-data flag is false, then remove the project_output_path
+    if basic_test_params.retain_passed_test_data:
+        _LOGGER.debug("Retaining data from passing test: %s", project_output_path)
+    else:
+        _LOGGER.debug("Removing data from passing test: %s", project_output_path)
+        output_dir_manager.tear_down()
 
     # done with test
     _LOGGER.debug("Finished invoking test with %s", func_params)
@@ -27,6 +27,7 @@ from tests.make.common.cookiecutter_utils import (
     mint_extra_context,
 )
 from tests.make.common.make_utils import (
+    record_artifact_sizes,
     run_make_on_host,
 )
 from tests.make.common.misc_utils import (
@@ -71,6 +72,10 @@ def run_api_test(basic_test_params, specific_test_params, specific_test_params_f
     # skip if the current specific test params don't match the filter (if any)
     skip_if_no_match_for_specific_params_filter(specific_test_params, specific_test_params_filter)
 
+    # skip as a cached pass if nothing feeding the test changed since it last passed
+    basic_test_params.impact_index.skip_if_unaffected(
+        "api", specific_test_params, basic_test_params.cookiecutter_json_data)
+
     # mint a default context
     extra_context = mint_extra_context(
         basic_test_params.cookiecutter_json_data, specific_test_params)
@@ -82,36 +87,68 @@ def run_api_test(basic_test_params, specific_test_params, specific_test_params_f
         prefix="api")
     test_output_path = output_dir_manager.setup()
 
-    # call cookiecutter python API entry point (same one used by cli)
-    invoker = CookieCutterInvoker(
-        repo_root_path=basic_test_params.repo_root_path,
-        cookiecutter_config_path=basic_test_params.cookiecutter_config_path)
-    invoker.invoke_via_api(
-        root_output_path=test_output_path,
-        extra_context=extra_context)
+    # call cookiecutter python API entry point (same one used by cli), or re-use a cached render
+    # of the same extra context if the render cache is enabled
+    phase_timer = basic_test_params.phase_timer
+    with phase_timer.phase('render'):
+        if basic_test_params.render_cache is not None:
+            basic_test_params.render_cache.render(
+                root_output_path=test_output_path,
+                extra_context=extra_context)
+        else:
+            invoker = CookieCutterInvoker(
+                repo_root_path=basic_test_params.repo_root_path,
+                cookiecutter_config_path=basic_test_params.cookiecutter_config_path)
+            invoker.invoke_via_api(
+                root_output_path=test_output_path,
+                extra_context=extra_context)
 
     # figure out where the test output_path should have ended up
     project_output_path = output_dir_manager.get_project_output_path()
 
     # do rudimentary file checks
-    assert_expected_files(basic_test_params, specific_test_params, project_output_path)
+    with phase_timer.phase('assert expected files'):
+        assert_expected_files(basic_test_params, specific_test_params, project_output_path)
 
     # assert the expected makefile is there
-    assert_expected_makefile(basic_test_params, specific_test_params, project_output_path)
-
-    # run make in the project that was emitted
-    run_make_on_host(specific_test_params, project_output_path)
+    with phase_timer.phase('assert expected makefile'):
+        assert_expected_makefile(basic_test_params, specific_test_params, project_output_path)
+
+    # point pip at the local package index, if it is in use
+    make_env = None
+    if basic_test_params.local_package_index is not None:
+        with phase_timer.phase('prepare local package index'):
+            make_env = basic_test_params.local_package_index.prepare(
+                specific_test_params, project_output_path)
+
+    # hand the emitted project pre-built tox virtualenvs, if the pool is in use
+    if basic_test_params.tox_virtualenv_pool is not None:
+        with phase_timer.phase('attach pooled tox virtualenvs'):
+            basic_test_params.tox_virtualenv_pool.attach(
+                specific_test_params, project_output_path, env=make_env)
+
+    # run make in the project that was emitted (each make invocation is timed as its own phase)
+    run_make_on_host(
+        specific_test_params, project_output_path, env=make_env, phase_timer=phase_timer,
+        resource_token_pool=basic_test_params.resource_token_pool)
+    record_artifact_sizes(project_output_path, phase_timer)
 
     # the make targets were supposed to build a wheel, then assert the built wheel is right
     if not specific_test_params.make_targets or \
             MakeTarget.should_build_a_wheel(*specific_test_params.make_targets):
         _LOGGER.debug(
             "Trying to check wheel metadata since make targets indicate that it should build one")
-        assert_expected_wheel_is_built(basic_test_params, specific_test_params, project_output_path)
+        with phase_timer.phase('assert expected wheel'):
+            assert_expected_wheel_is_built(
+                basic_test_params, specific_test_params, project_output_path)
     else:
         _LOGGER.debug("Skipping wheel check because make targets should not result in a wheel: %s",
                       str(specific_test_params.make_targets))
 
+    # remember the test passed with the current template and harness
+    basic_test_params.impact_index.record_pass(
+        "api", specific_test_params, basic_test_params.cookiecutter_json_data)
+
     # if test passed, and retain-data flag is false, then remove the project_output_path
     if basic_test_params.retain_passed_test_data:
         _LOGGER.debug("Retaining data from passing test: %s", project_output_path)
@@ -26,7 +26,10 @@ from tests.make.common.pytest_utils import (
     GeneratorForPytestParameterization,
 )
 from tests.make.via_api.common import run_api_test
-from tests.make.common.make_utils import MakeTargetPermutationBuilder
+from tests.make.common.make_utils import (
+    MakeTargetPermutationBuilder,
+    MakeTargetScheduler,
+)
 from tests.make.common.misc_utils import (
     SpecificTestParams,
 )
@@ -91,17 +94,18 @@ def pytest_generate_tests(metafunc):
 
     elif test_function_name == 'test_non_defaults':
         # Exercise the non-default make targets with the library flavor because it has
-        # just enough meat on its bones to try out the stuff
+        # just enough meat on its bones to try out the stuff.  The scheduler groups them so that
+        # each emitted project runs several of them, skipping any already run by another.
 
         project_flavor = ProjectFlavor.LIBRARY
         python_version_mode = next(iter(PythonVersionMode))
         dependency_management_mode = next(iter(DependencyManagementMode))
-        non_default_make_targets = permutation_builder.get_targets_not_called_by_default()
+        schedule = MakeTargetScheduler(permutation_builder.get_the_default_target()).build_schedule()
 
-        for make_target in non_default_make_targets:
+        for make_targets in schedule:
             specific_params = SpecificTestParams(
                 dependency_management_mode=dependency_management_mode,
-                make_targets=[make_target],
+                make_targets=make_targets,
                 project_flavor=project_flavor,
                 python_version_mode=python_version_mode,
             )
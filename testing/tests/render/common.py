@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Common scaffolding/utils for render-only testing
+"""
+
+#
+# Imports
+#
+
+# import core
+import ConfigParser
+import ast
+import collections
+import hashlib
+import logging
+import os
+import re
+
+# import third party
+import pytest
+import ruamel.yaml as yaml
+import scandir
+
+# this project
+from tests.constants import (
+    MakeTarget,
+)
+from tests.common.output_utils import (
+    OutputDirectoryManager
+)
+from tests.common.cookiecutter_utils import (
+    CookiecutterExtraContextBuilder,
+)
+from tests.make.common.assertion_utils import (
+    assert_make_dry_runs_match_recipes,
+    assert_make_target_tree_matches_makefile,
+    assert_makefile_matches_make_database,
+)
+from tests.make.common.make_utils import (
+    parse_makefile,
+    read_make_database,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# jinja markup which should never survive rendering
+_TEMPLATE_MARKER_REGEX = re.compile(r'\{\{|\}\}|\{%|%\}')
+
+# directory for rendered projects, in memory if the host has a tmpfs for it
+RENDER_ROOT_PATH = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# digests of the emitted Makefiles which passed the checks against make's database and dry runs (in
+# this process), which many parameter combinations share
+_CHECKED_MAKEFILE_DIGESTS = set()
+
+#
+# Classes
+#
+
+SpecificTestParams = collections.namedtuple(
+    'SpecificTestParams',
+    [
+        'dependency_management_mode',
+        'project_flavor',
+        'python_version_mode',
+    ])
+
+
+#
+# Functions
+#
+
+def convert_specific_params_to_metafunc_arg_id(specific_test_params):
+    """
+    convert the values of the specific test params tuple into printable arg id
+    for pytest test parameterization
+    """
+    assert isinstance(specific_test_params, SpecificTestParams)
+    params_hash = OutputDirectoryManager.build_short_params_hash(specific_test_params)
+    arg_id = '-'.join([
+        specific_test_params.python_version_mode.name.lower(),
+        specific_test_params.dependency_management_mode.name.lower(),
+        specific_test_params.project_flavor.name.lower(),
+        params_hash,
+    ])
+    return arg_id
+
+
+def mint_extra_context(cookiecutter_json_data, specific_test_params):
+    """Mint a cookiecutter "extra context". """
+    _LOGGER.debug("Begin minting a cookiecutter extra context")
+
+    # verify parameters
+    assert isinstance(specific_test_params, SpecificTestParams)
+
+    # create the base context based off the json obj
+    builder = CookiecutterExtraContextBuilder()
+    extra_context = builder.build_from_json_and_test_params(
+        cookiecutter_json_data, specific_test_params)
+
+    _LOGGER.debug("Minted extra context: %s", extra_context)
+    return extra_context
+
+
+def assert_no_template_markers(project_output_path):
+    """Assert no jinja markup was left behind in the names or text of the emitted files"""
+    leftovers = []
+    pending = [project_output_path]
+    while pending:
+        for entry in scandir.scandir(pending.pop()):
+            relative_path = os.path.relpath(entry.path, project_output_path)
+            if _TEMPLATE_MARKER_REGEX.search(entry.name):
+                leftovers.append("{} (in its name)".format(relative_path))
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+                continue
+            with open(entry.path, 'rb') as input_file:
+                content = input_file.read()
+            if b'\0' in content:
+                # binary file
+                continue
+            for line_number, line in enumerate(content.splitlines(), 1):
+                if _TEMPLATE_MARKER_REGEX.search(line):
+                    leftovers.append("{}:{}: {}".format(relative_path, line_number, line.strip()))
+    assert not leftovers, "Template markup left in emitted files:\n{}".format('\n'.join(leftovers))
+
+
+def assert_valid_travis_yml(project_output_path):
+    """Assert the emitted .travis.yml is a valid YAML mapping"""
+    with open(os.path.join(project_output_path, '.travis.yml'), 'r') as input_file:
+        data = yaml.YAML(typ='safe').load(input_file)
+    assert isinstance(data, dict), ".travis.yml is not a YAML mapping: {!r}".format(data)
+
+
+def assert_valid_makefile(project_output_path):
+    """
+    Assert the emitted Makefile defines every make target the harness knows about, soundly.
+
+    Beyond the targets being there, the rules have to match what make parses, and the harness's
+    tree of make targets, and each target has to dry run into the commands its recipes call for.
+    Those checks run make (once for the database, then once per target), so they only run once
+    per distinct Makefile: freshly rendered projects have nothing built in them, so what make
+    makes of them comes down to the Makefile.
+    """
+    parsed_makefile = parse_makefile(project_output_path)
+    rules = parsed_makefile['prerequisites']
+    missing_targets = [
+        make_target.target_name for make_target in MakeTarget
+        if make_target.target_name not in rules]
+    assert not missing_targets, "Makefile is missing targets: {}".format(missing_targets)
+    # special targets like .PHONY may name targets that aren't defined, which make ignores
+    undefined_prerequisites = [
+        "{} (needed by {})".format(prerequisite, target)
+        for target, prerequisites in rules.items()
+        for prerequisite in prerequisites
+        if prerequisite not in rules and '$' not in prerequisite and
+        not os.path.exists(os.path.join(project_output_path, prerequisite))]
+    assert not undefined_prerequisites, \
+        "Makefile has undefined prerequisites: {}".format(undefined_prerequisites)
+
+    with open(os.path.join(project_output_path, 'Makefile'), 'rb') as makefile:
+        makefile_digest = hashlib.sha256(makefile.read()).hexdigest()
+    if makefile_digest in _CHECKED_MAKEFILE_DIGESTS:
+        _LOGGER.debug("Makefile %s was already checked against make", makefile_digest)
+        return
+    make_database = read_make_database(project_output_path)
+    assert_makefile_matches_make_database(parsed_makefile, make_database)
+    assert_make_target_tree_matches_makefile(parsed_makefile)
+    assert_make_dry_runs_match_recipes(project_output_path, parsed_makefile, make_database)
+    _CHECKED_MAKEFILE_DIGESTS.add(makefile_digest)
+
+
+def assert_valid_setup_py(project_output_path):
+    """Assert the emitted setup.py parses and compiles"""
+    setup_py_path = os.path.join(project_output_path, 'setup.py')
+    with open(setup_py_path, 'r') as input_file:
+        source = input_file.read()
+    try:
+        compile(ast.parse(source, setup_py_path), setup_py_path, 'exec')
+    except SyntaxError as error:
+        pytest.fail("setup.py does not compile: {}".format(error))
+
+
+def assert_valid_ini_files(project_output_path):
+    """Assert the emitted tox.ini and setup.cfg parse as ini files"""
+    for file_name in ('tox.ini', 'setup.cfg'):
+        parser = ConfigParser.RawConfigParser()
+        try:
+            with open(os.path.join(project_output_path, file_name), 'r') as input_file:
+                parser.readfp(input_file, file_name)
+        except ConfigParser.Error as error:
+            pytest.fail("{} does not parse: {}".format(file_name, error))
+        assert parser.sections(), "{} has no sections".format(file_name)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Fast render-only checks of the emitted projects, for every combination of template parameters.
+"""
+
+
+#
+# Imports
+#
+
+# import core
+import logging
+import os
+import shutil
+import tempfile
+
+# import third party
+import cookiecutter.exceptions
+import jinja2
+import pytest
+
+# this project
+from tests.constants import (
+    DependencyManagementMode,
+    ProjectFlavor,
+    PythonVersionMode,
+)
+from tests.render.common import (
+    RENDER_ROOT_PATH,
+    SpecificTestParams,
+    assert_no_template_markers,
+    assert_valid_ini_files,
+    assert_valid_makefile,
+    assert_valid_setup_py,
+    assert_valid_travis_yml,
+    convert_specific_params_to_metafunc_arg_id,
+    mint_extra_context,
+)
+from tests.common.cookiecutter_utils import (
+    CookieCutterInvoker,
+    CookiecutterJSONField,
+    get_shared_bytecode_cache,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# pytest marker
+pytestmark = [pytest.mark.custom_render_test]
+
+
+#
+# Pytest hooks
+#
+
+def pytest_generate_tests(metafunc):
+    """Metafunc hook for generating parameters for render tests"""
+
+    # bail out if you're not trying to use specific_test_params
+    if 'specific_test_params' not in metafunc.funcargnames:
+        return
+
+    # generate all the combos
+    arg_names = 'specific_test_params'
+    arg_ids = []
+    arg_values = []
+    for project_flavor in iter(ProjectFlavor):
+        for python_version_mode in iter(PythonVersionMode):
+            for dependency_management_mode in iter(DependencyManagementMode):
+                combo = SpecificTestParams(
+                    dependency_management_mode=dependency_management_mode,
+                    project_flavor=project_flavor,
+                    python_version_mode=python_version_mode,
+                )
+                arg_id = convert_specific_params_to_metafunc_arg_id(combo)
+                arg_ids.append(arg_id)
+                arg_values.append(combo)
+
+    # return via hook
+    metafunc.parametrize(arg_names, arg_values, indirect=False, ids=arg_ids, scope=None)
+
+
+#
+# Tests
+#
+
+def test_rendered_structure(basic_test_params, specific_test_params, render_snapshot_store):
+    func_params = locals()
+    _LOGGER.debug("Begin invoking test with %s", func_params)
+
+    # mint a default context
+    extra_context = mint_extra_context(
+        basic_test_params.cookiecutter_json_data, specific_test_params)
+
+    # render into memory (if possible), since nothing here needs to outlive the test
+    test_output_path = tempfile.mkdtemp(prefix='render-', dir=RENDER_ROOT_PATH)
+    try:
+        invoker = CookieCutterInvoker(
+            repo_root_path=basic_test_params.repo_root_path,
+            cookiecutter_config_path=basic_test_params.cookiecutter_config_path,
+            # compile each template once per process rather than once per render
+            bytecode_cache=get_shared_bytecode_cache())
+        try:
+            invoker.invoke_via_api(
+                root_output_path=test_output_path,
+                extra_context=extra_context)
+        except (cookiecutter.exceptions.CookiecutterException, jinja2.TemplateError) as error:
+            pytest.fail("Template failed to render: {}".format(error))
+
+        package_name = basic_test_params.cookiecutter_json_data[
+            CookiecutterJSONField.PACKAGE_NAME.json_name]
+        project_output_path = os.path.join(test_output_path, package_name)
+
+        # structural checks of the emitted project
+        assert_no_template_markers(project_output_path)
+        assert_valid_travis_yml(project_output_path)
+        assert_valid_makefile(project_output_path)
+        assert_valid_setup_py(project_output_path)
+        assert_valid_ini_files(project_output_path)
+
+        # and against the golden snapshot of it, which catches every other change to its files
+        render_snapshot_store.check(
+            convert_specific_params_to_metafunc_arg_id(specific_test_params), project_output_path)
+    finally:
+        shutil.rmtree(test_output_path, ignore_errors=True)
+
+    _LOGGER.debug("Finished invoking test with %s", func_params)
@@ -51,7 +51,7 @@ def convert_specific_params_to_metafunc_arg_id(specific_test_params):
     for pytest test parameterization
     """
     assert isinstance(specific_test_params, SpecificTestParams)
-    params_hash = OutputDirectoryManager.build_params_hash(specific_test_params)
+    params_hash = OutputDirectoryManager.build_short_params_hash(specific_test_params)
     arg_id = '-'.join([
         specific_test_params.python_version_mode.name.lower(),
         specific_test_params.dependency_management_mode.name.lower(),
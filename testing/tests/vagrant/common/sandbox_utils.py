@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for standing in for the vagrant VMs with local sandboxes (chroots in their own namespaces)
+"""
+
+#
+# Imports
+#
+
+# import core
+import collections
+import errno
+import hashlib
+import logging
+import os
+import pipes
+import re
+import shlex
+import shutil
+
+# import third party
+import pytest
+import shutilwhich
+
+# this project
+from tests.common.misc_utils import (
+    file_lock,
+    run_shell,
+)
+from tests.common.resource_utils import (
+    hold_resource_tokens,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+# string variables of the Vagrantfile (like the python environments to provision)
+_VAGRANTFILE_VARIABLE_REGEX = re.compile(r'^\s*(\w+) = "([^"]*)"\s*$', re.MULTILINE)
+
+# the start of a VM's definition in the Vagrantfile
+_VAGRANTFILE_DEFINE_REGEX = re.compile(r'config\.vm\.define "([^"]+)"')
+
+# a shell provisioner of a VM, either inline or a script (with optional arguments)
+_VAGRANTFILE_PROVISION_REGEX = re.compile(
+    r'\.vm\.provision "shell", privileged: (true|false), '
+    r'(?:inline: "([^"]*)"|path: "([^"]*)"(?:, args: \[([^\]]*)\])?)')
+
+# ruby string interpolation, of the Vagrantfile's variables
+_RUBY_INTERPOLATION_REGEX = re.compile(r'#\{(\w+)\}')
+
+# the user that vagrant runs unprivileged provisioners and ssh commands as
+_UNPRIVILEGED_USER = 'vagrant'
+
+# PATH within the sandboxes
+_SANDBOX_PATH = '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin'
+
+# base rootfs tarballs, by their file name extensions
+_ROOTFS_TARBALL_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.xz')
+
+# resource tokens a sandbox command holds (provisioning, builds)
+SANDBOX_TOKEN_WEIGHT = 1
+
+# a provisioner of a VM in the Vagrantfile, either an inline command or a script and its arguments
+ProvisionStep = collections.namedtuple(
+    'ProvisionStep',
+    [
+        'privileged',
+        'inline',
+        'path',
+        'args',
+    ])
+
+
+#
+# Functions
+#
+
+def parse_vagrantfile_provisioning(project_output_path):
+    """
+    Parse the shell provisioners of each VM from the emitted project's Vagrantfile.
+
+    Returns:
+        OrderedDict: Lists of ProvisionStep, in the order they run, keyed by VM name
+    """
+    with open(os.path.join(project_output_path, 'Vagrantfile'), 'r') as vagrantfile:
+        vagrantfile_text = vagrantfile.read()
+    variables = dict(_VAGRANTFILE_VARIABLE_REGEX.findall(vagrantfile_text))
+
+    def interpolate(text):
+        return _RUBY_INTERPOLATION_REGEX.sub(lambda match: variables[match.group(1)], text)
+
+    provisioning = collections.OrderedDict()
+    define_matches = list(_VAGRANTFILE_DEFINE_REGEX.finditer(vagrantfile_text))
+    for index, define_match in enumerate(define_matches):
+        end = define_matches[index + 1].start() if index + 1 < len(define_matches) else None
+        steps = provisioning[define_match.group(1)] = []
+        for match in _VAGRANTFILE_PROVISION_REGEX.finditer(
+                vagrantfile_text, define_match.end(), end or len(vagrantfile_text)):
+            privileged, inline, path, args_text = match.groups()
+            steps.append(ProvisionStep(
+                privileged=privileged == 'true',
+                inline=interpolate(inline) if inline is not None else None,
+                path=path,
+                args=[interpolate(arg) for arg in re.findall(r'"([^"]*)"', args_text or '')]))
+    return provisioning
+
+
+def _quote_provisioner_arg(arg):
+    """Quote an argument of a provisioning script the way vagrant does (shell variables expand)"""
+    return '"{}"'.format(arg.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+#
+# Classes
+#
+
+class SandboxBackend(object):
+    """
+    Stands in for the vagrant VMs with sandboxes, which come up in seconds on any Linux host.
+
+    A sandbox is a chroot over an overlay of a cached base rootfs (so bringing one up copies
+    nothing), run in its own mount and pid namespaces, with the emitted project mounted at
+    `/vagrant`.  Bringing a sandbox up runs the same shell provisioners, in the same order, as the
+    VM's definition in the Vagrantfile does.  Privileged provisioners run as root, while the
+    unprivileged ones and ssh commands run with the environment of the vagrant user (as root
+    still).  The network is the host's.  Every VM shares the one base rootfs, whatever the vagrant
+    box mode.
+    """
+
+    name = 'sandbox'
+
+    def __init__(self, base_rootfs_path, harness_cache_path, resource_token_pool=None):
+        """
+        Arguments:
+            base_rootfs_path (str): The base rootfs, a directory or a tarball (which gets extracted
+                into the harness cache once), or None if there isn't one
+            harness_cache_path (str): Directory of the harness cache
+            resource_token_pool (ResourceTokenPool): Optional pool of resource tokens for the
+                sandbox commands to hold while they run
+        """
+        self.base_rootfs_path = base_rootfs_path and os.path.abspath(base_rootfs_path)
+        self.harness_cache_path = harness_cache_path
+        self.resource_token_pool = resource_token_pool
+
+    def skip_if_unavailable(self):
+        """Skip the test if there's no base rootfs, or the host can't run sandboxes"""
+        if self.base_rootfs_path is None:
+            pytest.skip("No base rootfs for the sandbox VM backend (see --vm-base-rootfs)")
+        if not os.path.exists(self.base_rootfs_path):
+            pytest.skip("Base rootfs {} not found".format(self.base_rootfs_path))
+        for executable_name in ('unshare', 'chroot'):
+            if not shutilwhich.which(executable_name):
+                pytest.skip("No {} executable found".format(executable_name))
+
+    def get_base_rootfs_path(self):
+        """Get the base rootfs directory, extracting the base rootfs tarball if need be"""
+        if not self.base_rootfs_path.endswith(_ROOTFS_TARBALL_EXTENSIONS):
+            return self.base_rootfs_path
+
+        tarball_stat = os.stat(self.base_rootfs_path)
+        rootfs_cache_path = os.path.join(self.harness_cache_path, 'vm-rootfs')
+        extracted_path = os.path.join(rootfs_cache_path, hashlib.sha256("{}:{}:{}".format(
+            self.base_rootfs_path, tarball_stat.st_size, tarball_stat.st_mtime)).hexdigest()[:16])
+        try:
+            os.makedirs(rootfs_cache_path)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        with file_lock("{}.lock".format(extracted_path)):
+            if not os.path.exists(extracted_path):
+                _LOGGER.info("Extracting base rootfs %s into %s",
+                             self.base_rootfs_path, extracted_path)
+                scratch_path = "{}.scratch".format(extracted_path)
+                shutil.rmtree(scratch_path, ignore_errors=True)
+                os.mkdir(scratch_path)
+                run_shell("tar --numeric-owner -xpf {}".format(pipes.quote(self.base_rootfs_path)),
+                          working_path=scratch_path)
+                os.rename(scratch_path, extracted_path)
+        return extracted_path
+
+    @staticmethod
+    def get_sandbox_path(working_path, vm_name):
+        """Get the directory of a VM's sandbox, next to the emitted project"""
+        return os.path.join(
+            os.path.dirname(os.path.abspath(working_path)), "sandbox-{}".format(vm_name))
+
+    def run_in_sandbox(self, working_path, vm_name, cmd_text, privileged):
+        """
+        Run a shell command in a VM's sandbox.
+
+        Arguments:
+            working_path (str): The emitted project (with the Vagrantfile)
+            vm_name (str): Name of the VM
+            cmd_text (str): The shell command
+            privileged (bool): Whether to run as root, rather than as the vagrant user
+        """
+        sandbox_path = SandboxBackend.get_sandbox_path(working_path, vm_name)
+        root_path = os.path.join(sandbox_path, 'root')
+        if privileged:
+            home_path, user_name = '/root', 'root'
+        else:
+            home_path, user_name = "/home/{}".format(_UNPRIVILEGED_USER), _UNPRIVILEGED_USER
+            cmd_text = "mkdir -p {0} && cd {0} && {1}".format(home_path, cmd_text)
+
+        # the mounts only live as long as the mount namespace, so nothing is left to unmount
+        setup_cmd_texts = [
+            "mount -t overlay overlay -o lowerdir={},upperdir={},workdir={} {}".format(
+                self.get_base_rootfs_path(), os.path.join(sandbox_path, 'upper'),
+                os.path.join(sandbox_path, 'work'), root_path),
+            "mkdir -p {0}/dev {0}/proc {0}/vagrant {0}/etc".format(root_path),
+            "mount --rbind /dev {}/dev".format(root_path),
+            "mount -t proc proc {}/proc".format(root_path),
+            "mount --bind {} {}/vagrant".format(os.path.abspath(working_path), root_path),
+            "cp -L /etc/resolv.conf {}/etc/resolv.conf".format(root_path),
+            "exec chroot {} /usr/bin/env -i HOME={} USER={} PATH={} /bin/bash -c {}".format(
+                root_path, home_path, user_name, _SANDBOX_PATH, pipes.quote(cmd_text)),
+        ]
+        unshare_cmd_text = "unshare --mount --pid --fork --kill-child{} /bin/sh -c {}".format(
+            '' if os.geteuid() == 0 else ' --map-root-user',
+            pipes.quote(' && '.join(setup_cmd_texts)))
+        with hold_resource_tokens(self.resource_token_pool, SANDBOX_TOKEN_WEIGHT,
+                                  "sandbox {}".format(vm_name)):
+            run_shell(unshare_cmd_text, working_path=working_path)
+
+    def up(self, working_path, vm_name):
+        """Bring up a VM's sandbox, running its provisioners, unless it's already up"""
+        sandbox_path = SandboxBackend.get_sandbox_path(working_path, vm_name)
+        if os.path.exists(sandbox_path):
+            _LOGGER.debug("Sandbox %s is already up", sandbox_path)
+            return
+        provisioning = parse_vagrantfile_provisioning(working_path)
+        assert vm_name in provisioning, "No VM {} defined in the Vagrantfile".format(vm_name)
+
+        for dir_name in ('upper', 'work', 'root'):
+            os.makedirs(os.path.join(sandbox_path, dir_name))
+        # there's no need for sudo in the sandbox, but the provisioners call it anyway
+        self.run_in_sandbox(
+            working_path, vm_name,
+            "command -v sudo > /dev/null || "
+            "{ printf '#!/bin/sh\\nexec \"$@\"\\n' > /usr/local/bin/sudo && "
+            "chmod +x /usr/local/bin/sudo; }",
+            privileged=True)
+        for step in provisioning[vm_name]:
+            if step.inline is not None:
+                cmd_text = step.inline
+            else:
+                cmd_text = ' '.join(
+                    ['/bin/bash', pipes.quote(os.path.join('/vagrant', step.path))] +
+                    [_quote_provisioner_arg(arg) for arg in step.args])
+            _LOGGER.debug("Provisioning sandbox %s with: '%s'", vm_name, cmd_text)
+            self.run_in_sandbox(working_path, vm_name, cmd_text, privileged=step.privileged)
+
+    def run_vagrant_command(self, working_path, vagrant_command):
+        """
+        Do what a vagrant command (see VagrantVM) does to a VM, to its sandbox.
+
+        Arguments:
+            working_path (str): The emitted project (with the Vagrantfile)
+            vagrant_command (str): The vagrant command (status, destroy, up or ssh)
+        """
+        words = shlex.split(vagrant_command)
+        action = words[0]
+        vm_name = [word for word in words[1:] if not word.startswith('-')][0]
+        sandbox_path = SandboxBackend.get_sandbox_path(working_path, vm_name)
+        if action == 'status':
+            _LOGGER.info("Sandbox of VM %s is %s", vm_name,
+                         'up' if os.path.exists(sandbox_path) else 'not created')
+        elif action == 'destroy':
+            shutil.rmtree(sandbox_path, ignore_errors=True)
+        elif action == 'up':
+            self.up(working_path, vm_name)
+        elif action == 'ssh':
+            assert os.path.exists(sandbox_path), "Sandbox of VM {} is not up".format(vm_name)
+            self.run_in_sandbox(
+                working_path, vm_name, words[words.index('-c') + 1], privileged=False)
+        else:
+            raise ValueError("Unsupported vagrant command for sandboxes: '{}'".format(
+                vagrant_command))
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 """
-Utilities for invoking Vagrant
+Utilities for invoking Vagrant, or whichever VM backend stands in for it
 """
 
 #
@@ -15,8 +15,12 @@ import os
 
 # this project
 from tests.common.misc_utils import (
+    ShellCommandCancelled,
     run_shell,
 )
+from tests.vagrant.common.pytest_utils import (
+    skip_if_no_vagrant_executable,
+)
 
 # logger
 _LOGGER = logging.getLogger(__name__)
@@ -27,10 +31,12 @@ _LOGGER = logging.getLogger(__name__)
 #
 
 
-def invoke_vagrant_command(working_path, vagrant_commands):
-    """Run vagrant under test"""
+def invoke_vagrant_command(working_path, vagrant_commands, vm_backend=None):
+    """Run vagrant under test (or have the VM backend do what the vagrant commands would)"""
     run_params = locals()
     _LOGGER.debug("Begin invoking the vagrant under test with: %s", run_params)
+    if vm_backend is None:
+        vm_backend = VagrantBackend()
 
     # assert that there is a Vagrantfile in the working dir
     assert os.path.exists(os.path.join(working_path, 'Vagrantfile')), \
@@ -38,11 +44,34 @@ def invoke_vagrant_command(working_path, vagrant_commands):
 
     try:
         for vagrant_command in vagrant_commands:
-            cmd_text = "vagrant {}".format(vagrant_command)
-            _LOGGER.debug("Invoking this vagrant command: '%s'", cmd_text)
-            run_shell(cmd_text, working_path=working_path)
+            _LOGGER.debug("Invoking this vagrant command via the %s backend: '%s'",
+                          vm_backend.name, vagrant_command)
+            vm_backend.run_vagrant_command(working_path, vagrant_command)
+    except ShellCommandCancelled:
+        # another test failed first, this one didn't fail as such
+        raise
     except Exception as error:
         _LOGGER.exception("Invocation of vagrant under test failed!")
-        raise Exception("Cookiecutter failed, see log file")
+        raise Exception("Vagrant ({} backend) failed, see log file".format(vm_backend.name))
     else:
         _LOGGER.debug("Finished invoking the vagrant under test with: %s", run_params)
+
+
+#
+# Classes
+#
+
+class VagrantBackend(object):
+    """Brings up the vagrant VMs as virtual machines, via vagrant itself"""
+
+    name = 'vagrant'
+
+    @staticmethod
+    def skip_if_unavailable():
+        """Skip the test if vagrant isn't installed"""
+        skip_if_no_vagrant_executable()
+
+    @staticmethod
+    def run_vagrant_command(working_path, vagrant_command):
+        """Run a vagrant command (see VagrantVM)"""
+        run_shell("vagrant {}".format(vagrant_command), working_path=working_path)
@@ -0,0 +1,31 @@
+"""
+Pytest configuration plumbing specific to tests of the vagrant environment
+"""
+#
+# Imports
+#
+
+# import core
+import logging
+
+# import third party
+import pytest
+
+# this project
+
+# import to expose to pytest magic
+from .fixtures import (
+    vm_backend,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+
+#
+# Hooks
+#
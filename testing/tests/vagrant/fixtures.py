@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures specific to tests of the vagrant environment
+"""
+
+#
+# Imports
+#
+
+# import core
+import logging
+
+# import third party
+import pytest
+
+# this project
+from tests.constants import (
+    VagrantVMBackend,
+)
+from tests.vagrant.common.sandbox_utils import (
+    SandboxBackend,
+)
+from tests.vagrant.common.vagrant_utils import (
+    VagrantBackend,
+)
+
+#
+# Module variables
+#
+
+# logger
+_LOGGER = logging.getLogger(__name__)
+
+
+#
+# Fixtures
+#
+
+@pytest.fixture(scope="session")
+def vm_backend(pytestconfig, harness_cache_path, resource_token_pool):
+    """Backend bringing up the vagrant VMs of the emitted projects (see VagrantVMBackend)"""
+    backend_name = pytestconfig.getoption('vm_backend', default=None, skip=False)
+    if VagrantVMBackend[(backend_name or 'vagrant').upper()] is VagrantVMBackend.SANDBOX:
+        backend = SandboxBackend(
+            base_rootfs_path=pytestconfig.getoption('vm_base_rootfs', default=None, skip=False),
+            harness_cache_path=harness_cache_path,
+            resource_token_pool=resource_token_pool)
+    else:
+        backend = VagrantBackend()
+    _LOGGER.debug("Using the %s VM backend", backend.name)
+    return backend
@@ -25,6 +25,9 @@ from tests.constants import (
 from tests.common.cookiecutter_utils import (
     CookieCutterInvoker,
 )
+from tests.common.misc_utils import (
+    ShellCommandCancelled,
+)
 from tests.common.output_utils import (
     OutputDirectoryManager,
 )
@@ -39,7 +42,6 @@ from tests.vagrant.common.vagrant_utils import (
 )
 from tests.vagrant.common.pytest_utils import (
     convert_specific_params_to_metafunc_arg_id,
-    skip_if_no_vagrant_executable,
 )
 
 #
@@ -110,12 +112,12 @@ def pytest_generate_tests(metafunc):
 # Tests
 #
 
-def test_create_vm(basic_test_params, specific_test_params):
+def test_create_vm(basic_test_params, specific_test_params, vm_backend):
     func_params = locals()
     _LOGGER.debug("Begin invoking test with %s", func_params)
 
-    # skip if no vagrant exe
-    skip_if_no_vagrant_executable()
+    # skip if the vm backend can't run here (no vagrant exe, or no base rootfs for sandboxes)
+    vm_backend.skip_if_unavailable()
 
     # check vm
     vagrant_vm = specific_test_params.vagrant_vm
@@ -150,7 +152,10 @@ def test_create_vm(basic_test_params, specific_test_params):
             vagrant_vm.get_status_cmd(),
             vagrant_vm.get_destroy_cmd(),
             vagrant_vm.get_up_cmd(),
-        ])
+        ], vm_backend=vm_backend)
+    except ShellCommandCancelled:
+        # another test failed first, this one didn't fail as such
+        raise
     except Exception as error:
         _LOGGER.exception(
             "Fatal error while running ssh commands within vm under test %s",
@@ -159,7 +164,8 @@ def test_create_vm(basic_test_params, specific_test_params):
             specific_test_params.vagrant_vm.name, error))
     finally:
         _LOGGER.debug("tear down vagrant vm under test")
-        invoke_vagrant_command(project_output_path, [vagrant_vm.get_destroy_cmd()])
+        invoke_vagrant_command(
+            project_output_path, [vagrant_vm.get_destroy_cmd()], vm_backend=vm_backend)
 
     # no op for now
     _LOGGER.debug("Finished invoking test with %s", func_params)